@@ -9,7 +9,7 @@ import json
 import traceback
 import io
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from flask import Flask, request, jsonify, send_from_directory, session, send_file
 from flask_cors import CORS
@@ -25,17 +25,12 @@ try:
     print("=" * 60)
 
     # Основные модули
-    from database import Database
+    from database import Database, page_cursor, parse_cursor
     from gee_client import GEEClient
     from change_detector import ChangeDetector
-    from grid_analyzer import GridAnalyzer
-    from notification import NotificationManager, EmailConfig
-    from grid_creator import GridCreator
 
-    # Все детекторы
-    from ultimate_detector import detect_changes_ultimate, UltimateDetector
-    from super_forest_detector import SuperForestDetector
-    from improved_change_detector import detect_changes_improved
+    # Детекторы, сетки и уведомления загружаются при первом использовании
+    from detector_registry import registry
 
     print("✓ Все модули загружены успешно!")
 
@@ -51,21 +46,33 @@ app = Flask(__name__, static_folder='./frontend', static_url_path='/')
 app.secret_key = os.urandom(32)
 CORS(app, supports_credentials=True)
 
+# Размер страницы списков снимков (?limit=): по умолчанию и наибольший
+PAGE_LIMIT = int(os.getenv('API_PAGE_LIMIT', '100'))
+PAGE_MAX_LIMIT = int(os.getenv('API_PAGE_MAX_LIMIT', '500'))
+
 # Глобальные объекты
 db = None
 gee_client = None
 change_detector = None
-grid_analyzer = None
-notification_manager = None
-grid_creator = None
-ultimate_detector = None
-forest_detector = None
 
 # Мониторинг в фоне
 monitoring_threads = {}
 monitoring_active = False
 
 
+def page_args():
+    """
+    Параметры страницы из запроса: ?after=<дата>,<id>&limit=
+
+    Returns:
+        (курсор или None, размер страницы); ValueError - неверные параметры
+    """
+    limit = int(request.args.get('limit', PAGE_LIMIT))
+    if limit < 1:
+        raise ValueError("limit должен быть положительным")
+    return parse_cursor(request.args.get('after')), min(limit, PAGE_MAX_LIMIT)
+
+
 def ensure_original_folder():
     """Создает папку original если ее нет"""
     original_dir = Path('satellite_images') / 'original'
@@ -138,27 +145,8 @@ def move_to_original_folder(image_path, territory_name=None):
             new_path = original_dir / filename
             counter += 1
 
-        # Перемещаем или конвертируем файл
-            try:
-                from PIL import Image
-                img = Image.open(image_path)
-                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                    img = img.convert('RGBA')
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1])
-                    img = background
-                else:
-                    img = img.convert('RGB')
-
-                img.save(new_path, 'JPEG', quality=95, optimize=True)
-                os.remove(image_path)  # Удаляем PNG файл
-                print(f" PNG конвертирован в JPG: {new_path}")
-            except Exception as e:
-                print(f"⚠ Ошибка конвертации PNG: {e}")
-                shutil.move(image_path, new_path)
-        else:
-            # перемещаем файл
-            shutil.move(image_path, new_path)
+        # Снимок уже закодирован в формат хранения при загрузке - только перемещаем
+        shutil.move(image_path, new_path)
 
         print(f" Файл сохранен в original: {new_path}")
         return str(new_path)
@@ -171,8 +159,7 @@ def move_to_original_folder(image_path, territory_name=None):
 
 def init_system():
     """Инициализация всей системы"""
-    global db, gee_client, change_detector, grid_analyzer
-    global notification_manager, grid_creator, ultimate_detector, forest_detector
+    global db, gee_client, change_detector
 
     try:
         print("\n" + "=" * 60)
@@ -191,37 +178,20 @@ def init_system():
         db.migrate_users()
 
         # 2. Google Earth Engine - настраиваем для сохранения в правильную папку
-        gee_client = GEEClient(cache_dir='satellite_images')
-        print("✓ Google Earth Engine подключен")
+        gee_client = GEEClient(cache_dir='satellite_images', database=db, image_format='jpg')
+        if gee_client.offline:
+            print("✓ Google Earth Engine: офлайн режим (только сохраненные снимки)")
+        else:
+            print("✓ Google Earth Engine: подключение при первой загрузке снимка")
 
         # 3. Детектор изменений
         change_detector = ChangeDetector(db, gee_client)
         print("✓ Детектор изменений готов")
 
-        # 4. Анализатор сетки
-        grid_analyzer = GridAnalyzer()
-        print("✓ Анализатор сетки готов")
-
-        # 5. Создатель сеток
-        grid_creator = GridCreator(grid_size=32)
-        print("✓ Создатель сеток готов")
-
-        # 6. Детекторы
-        ultimate_detector = UltimateDetector(debug=False)
-        forest_detector = SuperForestDetector()
-        print("✓ Улучшенные детекторы загружены")
-
-        # 7. Email уведомления
-        try:
-            email_config = EmailConfig()
-            if email_config.EMAIL_ENABLED:
-                notification_manager = NotificationManager(email_config)
-                print(f"✓ Email уведомления включены ({email_config.EMAIL_TO})")
-            else:
-                print("ℹ Email уведомления отключены")
-        except Exception as e:
-            print(f" Email уведомления: {e}")
-            notification_manager = None
+        # 4. Детекторы, сетки, email уведомления - загрузка при первом использовании
+        registry.register('gee', lambda: gee_client.compare_images_advanced,
+                          'Сравнение GEEClient.compare_images_advanced')
+        print(f"✓ Зарегистрированы: {', '.join(registry.names())}")
 
         print("=" * 60)
         print(" ВСЯ СИСТЕМА ГОТОВА К РАБОТЕ!")
@@ -235,6 +205,31 @@ def init_system():
         return False
 
 
+def get_notification_manager():
+    """Менеджер email уведомлений (None, если уведомления отключены или не настроены)"""
+    try:
+        return registry.get('notifications')
+    except Exception as e:
+        print(f" Email уведомления: {e}")
+        return None
+
+
+def get_grid_creator():
+    """Создатель сеток (None, если модуль не загрузился)"""
+    try:
+        return registry.get('grid_creator')
+    except Exception as e:
+        print(f" Создатель сеток: {e}")
+        return None
+
+
+def run_detector(name, before_path, after_path):
+    """Сравнение снимков детектором из реестра; неизвестное имя - сравнение GEE"""
+    if name not in registry.names():
+        name = 'gee'
+    return registry.detect(name, before_path, after_path)
+
+
 def create_test_image_bytes():
     """Создает тестовое изображение в формате bytes"""
     try:
@@ -366,15 +361,16 @@ def get_territories():
         all_territories = db.get_all_territories()
 
         # Фильтруем по пользователю
-        user_territories = []
-        for t in all_territories:
-            if t.get('user') == username or str(t.get('id')).startswith(username):
-                # Добавляем информацию об изображениях
-                images = db.get_territory_images(t['id'])
-                t['image_count'] = len(images)
-                t['latest_image'] = images[0] if images else None
-                t['latest_image_date'] = images[0]['capture_date'] if images else None
-                user_territories.append(t)
+        user_territories = [t for t in all_territories
+                            if t.get('user') == username or str(t.get('id')).startswith(username)]
+        # Информация об изображениях - одним запросом для всех территорий
+        summaries = db.get_territory_summaries([t['id'] for t in user_territories])
+        latest_images = db.get_images([s['latest_image_id'] for s in summaries.values() if s['latest_image_id']])
+        for t in user_territories:
+            summary = summaries.get(t['id'], {})
+            t['image_count'] = summary.get('image_count', 0)
+            t['latest_image'] = latest_images.get(summary.get('latest_image_id'))
+            t['latest_image_date'] = summary.get('latest_capture_date')
 
         return jsonify({
             'success': True,
@@ -571,6 +567,29 @@ def get_satellite_for_territory(territory_id):
             print(f"   Сообщение: {message}")
             print(f"   Путь: {image_path}")
 
+            fetch_info = gee_client.last_fetch_info()
+            if fetch_info.get('reused'):
+                # Сцена не изменилась - файл уже в базе, повторная детекция не нужна
+                images = db.get_territory_images(territory_id)
+                return jsonify({
+                    'success': True,
+                    'reused': True,
+                    'image': {
+                        'id': fetch_info.get('image_id'),
+                        'path': image_path,
+                        'date': capture_date
+                    },
+                    'capture_date': capture_date,
+                    'images_count': len(images),
+                    'message': f'Новых снимков для территории "{territory["name"]}" нет, '
+                               f'последний снимок от {capture_date}',
+                    'debug': {
+                        'requested_date': custom_date,
+                        'actual_capture_date': capture_date,
+                        'scene_id': fetch_info.get('scene_id')
+                    }
+                })
+
             # Перемещаем в папку original
             original_path = move_to_original_folder(image_path, territory['name'])
             print(f" Файл перемещен: {original_path}")
@@ -589,7 +608,9 @@ def get_satellite_for_territory(territory_id):
             # Сохраняем изображение в базу
             image_id = db.add_image(
                 territory_id, original_path, capture_date,
-                cloud_cover, file_size
+                cloud_cover, file_size,
+                scene_id=fetch_info.get('scene_id'),
+                render_key=fetch_info.get('render_key')
             )
             print(f" Изображение сохранено в БД, ID: {image_id}")
 
@@ -661,6 +682,47 @@ def get_territory(territory_id):
         }), 500
 
 
+@app.route('/api/territories/<int:territory_id>/available-dates', methods=['GET'])
+def get_territory_available_dates(territory_id):
+    """Даты съемки Sentinel-2 над территорией (по локальному каталогу сцен)"""
+    try:
+        territory = db.get_territory(territory_id)
+        if not territory:
+            return jsonify({
+                'success': False,
+                'message': 'Территория не найдена'
+            }), 404
+
+        if gee_client is None or gee_client.catalog is None:
+            return jsonify({
+                'success': False,
+                'message': 'Каталог сцен недоступен'
+            }), 503
+
+        end_date = request.args.get('end') or (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        start_date = request.args.get('start') or \
+            (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=90)).strftime('%Y-%m-%d')
+        max_cloud = float(request.args.get('max_cloud', 100))
+
+        dates = gee_client.get_available_dates(territory['latitude'], territory['longitude'],
+                                               start_date, end_date, max_cloud)
+
+        return jsonify({
+            'success': True,
+            'territory_id': territory_id,
+            'start': start_date,
+            'end': end_date,
+            'dates': dates,
+            'count': len(dates)
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Ошибка: {str(e)}'
+        }), 500
+
+
 @app.route('/api/territories/<int:territory_id>/images', methods=['GET'])
 def get_territory_images_api(territory_id):
     """Получение изображений территории для веб-интерфейса"""
@@ -802,8 +864,11 @@ def get_satellite():
             image_path = result[1]
             capture_date = result[2]
 
-            # Перемещаем в папку original
-            original_path = move_to_original_folder(image_path, name)
+            # Перемещаем в папку original (сохраненную ранее сцену не трогаем)
+            if gee_client.last_fetch_info().get('reused'):
+                original_path = image_path
+            else:
+                original_path = move_to_original_folder(image_path, name)
 
             return jsonify({
                 'success': True,
@@ -859,8 +924,12 @@ def system_info():
                 'territories': stats.get('territories', 0),
                 'images': stats.get('images', 0),
                 'changes': stats.get('changes', 0),
-                'gee_connected': gee_client is not None,
-                'email_enabled': notification_manager is not None,
+                'gee_connected': gee_client is not None and gee_client.is_connected,
+                # Без создания менеджера: импорт notification тянет cv2, numpy и PIL
+                'email_enabled': (registry.is_loaded('notifications') and
+                                  registry.get('notifications') is not None),
+                'detectors': registry.describe(),
+                'scene_catalog': gee_client.catalog.stats() if gee_client is not None and gee_client.catalog else None,
                 'monitoring_active': len(monitoring_threads) > 0,
                 'files_original': original_count,
                 'files_main': main_count,
@@ -923,14 +992,8 @@ def detect_changes():
                 'message': 'Файлы изображений не найдены'
             }), 404
 
-        # Используем детектор изменений
-        if detector == 'ultimate' and ultimate_detector:
-            result = ultimate_detector.detect_changes(old_path, new_path)
-        elif detector == 'improved':
-            result = detect_changes_improved(old_path, new_path)
-        else:
-            # Используем GEE клиент для сравнения
-            result = gee_client.compare_images_advanced(old_path, new_path)
+        # Используем детектор изменений (модуль загружается при первом вызове)
+        result = run_detector(detector, old_path, new_path)
 
         if 'error' in result:
             return jsonify({
@@ -1029,12 +1092,17 @@ def require_auth():
 
 @app.route('/api/territories/<int:territory_id>/images/all', methods=['GET'])
 def get_all_territory_images(territory_id):
-    """Получение ВСЕХ изображений территории для выбора"""
+    """Изображения территории для выбора, постранично (?after=<дата>,<id>&limit=)"""
     try:
         user = session.get('user')
         if not user:
             return jsonify({'success': False, 'message': 'Не авторизован'}), 401
 
+        try:
+            after, limit = page_args()
+        except ValueError as error:
+            return jsonify({'success': False, 'message': str(error)}), 400
+
         territory = db.get_territory(territory_id)
         if not territory:
             return jsonify({
@@ -1042,7 +1110,8 @@ def get_all_territory_images(territory_id):
                 'message': 'Территория не найдена'
             }), 404
 
-        images = db.get_territory_images(territory_id, limit=100)  # Больше изображений для выбора
+        # Страница изображений; следующая - по next_cursor
+        images = db.get_territory_images(territory_id, limit=limit, after=after)
 
         # Форматируем данные для фронтенда
         formatted_images = []
@@ -1091,7 +1160,8 @@ def get_all_territory_images(territory_id):
                 'name': territory['name']
             },
             'images': formatted_images,
-            'count': len(formatted_images)
+            'count': len(formatted_images),
+            'next_cursor': page_cursor(images, limit, 'capture_date')
         })
 
     except Exception as e:
@@ -1153,14 +1223,7 @@ def compare_selected_images():
         print(f"   Детектор: {detector_type}")
 
         # Выбираем детектор в зависимости от типа
-        result = None
-        if detector_type == 'improved':
-            result = detect_changes_improved(current_path, comparison_path)
-        elif detector_type == 'ultimate' and ultimate_detector:
-            result = ultimate_detector.detect_changes(current_path, comparison_path)
-        else:
-            # Используем GEE клиент
-            result = gee_client.compare_images_advanced(current_path, comparison_path)
+        result = run_detector(detector_type, current_path, comparison_path)
 
         if 'error' in result:
             return jsonify({
@@ -1218,12 +1281,13 @@ def compare_selected_images():
         email_sent = False
         email_message = ""
 
+        notification_manager = get_notification_manager()
         if notification_manager and getattr(notification_manager.config, 'EMAIL_ENABLED', False):
             try:
                 # Получаем email пользователя из базы данных
                 user_email = None
                 try:
-                    with sqlite3.connect(db.db_path) as conn:
+                    with db.connection() as conn:
                         cursor = conn.cursor()
                         cursor.execute('SELECT notification_emails FROM users WHERE username = ?', (user['username'],))
                         result_db = cursor.fetchone()
@@ -1286,6 +1350,7 @@ def compare_selected_images():
                                 # Создаем сеточные визуализации
                                 grid_files = {}
                                 try:
+                                    grid_creator = get_grid_creator()
                                     if grid_creator and os.path.exists(current_path):
                                         print(" Создаю сеточные визуализации...")
 
@@ -1462,187 +1527,6 @@ def quick_compare():
         }), 500
 
 
-@app.route('/api/territories/<int:territory_id>/images/all', methods=['GET'])
-def get_all_territory_images_api(territory_id):
-    """Получение ВСЕХ изображений территории"""
-    try:
-        user = session.get('user')
-        if not user:
-            return jsonify({'success': False, 'message': 'Не авторизован'}), 401
-
-        # Проверяем существование территории
-        territory = db.get_territory(territory_id)
-        if not territory:
-            print(f"Территория {territory_id} не найдена в БД")
-
-            # Пробуем найти любую территорию пользователя
-            with sqlite3.connect(db.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Ищем территории пользователя
-                username = user.get('username')
-                cursor.execute("SELECT * FROM territories WHERE description LIKE ? OR description LIKE ? LIMIT 1",
-                               (f'%{username}%', f'%пользователь: {username}%'))
-
-                alt_territory = cursor.fetchone()
-                if alt_territory:
-                    territory = dict(alt_territory)
-                    territory_id = territory['id']
-                    print(f"Использую альтернативную территорию ID: {territory_id}")
-                else:
-                    # Берем первую территорию из БД
-                    cursor.execute("SELECT * FROM territories ORDER BY id LIMIT 1")
-                    first_territory = cursor.fetchone()
-                    if first_territory:
-                        territory = dict(first_territory)
-                        territory_id = territory['id']
-                        print(f"Использую первую территорию из БД ID: {territory_id}")
-                    else:
-                        return jsonify({
-                            'success': False,
-                            'message': 'В базе данных нет территорий'
-                        }), 404
-
-        # Получаем изображения из БД
-        images = []
-        try:
-            with sqlite3.connect(db.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                # Проверяем существование таблицы satellite_images
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='satellite_images';")
-                has_satellite_table = cursor.fetchone() is not None
-
-                if has_satellite_table:
-                    # Используем таблицу satellite_images
-                    cursor.execute('''
-                        SELECT * FROM satellite_images 
-                        WHERE territory_id = ? 
-                        ORDER BY capture_date DESC
-                    ''', (territory_id,))
-                else:
-                    # Используем таблицу images
-                    cursor.execute('''
-                        SELECT * FROM images 
-                        WHERE territory_id = ? 
-                        ORDER BY capture_date DESC
-                    ''', (territory_id,))
-
-                db_rows = cursor.fetchall()
-                images = [dict(row) for row in db_rows]
-
-                print(f"Найдено {len(images)} изображений для территории {territory_id}")
-
-        except Exception as db_error:
-            print(f"Ошибка БД при получении изображений: {db_error}")
-            import traceback
-            traceback.print_exc()
-            images = db.get_territory_images(territory_id, limit=100) if hasattr(db, 'get_territory_images') else []
-
-        # Форматируем данные для фронтенда
-        formatted_images = []
-        for img in images:
-            # Получаем путь к файлу
-            image_path = img.get('image_path') or img.get('path', '')
-
-            if not image_path:
-                print(f"Изображение {img.get('id')} не имеет пути")
-                continue
-
-            file_exists = False
-            real_path = ""
-
-            search_paths = []
-
-            # 1. Оригинальный путь из БД
-            if image_path:
-                search_paths.append(image_path)
-
-            # 2. В папке original по имени файла
-            filename = os.path.basename(image_path)
-            if filename:
-                search_paths.append(os.path.join('satellite_images', 'original', filename))
-
-            # 3. По ID в папке original
-            if img.get('id'):
-                search_paths.append(f"satellite_images/original/image_{img['id']}.jpg")
-                search_paths.append(f"satellite_images/original/image_{img['id']}.jpeg")
-                search_paths.append(f"satellite_images/original/image_{img['id']}.png")
-
-            # Ищем файл
-            for path in search_paths:
-                if os.path.exists(path):
-                    file_exists = True
-                    real_path = path
-                    break
-
-            if not file_exists:
-                print(f"Файл не найден: {image_path}")
-                continue
-
-            # Получаем информацию о файле
-            try:
-                from PIL import Image
-                with Image.open(real_path) as pil_img:
-                    width, height = pil_img.size
-                    resolution = f"{width}x{height}"
-            except Exception as img_error:
-                print(f"Ошибка открытия изображения {real_path}: {img_error}")
-                resolution = "Неизвестно"
-
-            # Получаем размер файла
-            try:
-                file_size_bytes = os.path.getsize(real_path)
-                if file_size_bytes < 1024:
-                    file_size_str = f"{file_size_bytes} байт"
-                elif file_size_bytes < 1024 * 1024:
-                    file_size_str = f"{file_size_bytes / 1024:.1f} KB"
-                else:
-                    file_size_str = f"{file_size_bytes / (1024 * 1024):.1f} MB"
-            except:
-                file_size_str = "Неизвестно"
-
-            # Создаем URL для доступа
-            final_filename = os.path.basename(real_path)
-            url = f"/api/images/file/{final_filename}"
-
-            formatted_images.append({
-                'id': img.get('id'),
-                'date': img.get('capture_date', img.get('date', 'Неизвестно')),
-                'cloud_cover': img.get('cloud_cover'),
-                'file_size': file_size_str,
-                'file_exists': True,
-                'url': url,
-                'filename': final_filename,
-                'path': real_path,
-                'resolution': resolution,
-                'full_url': f"http://localhost:5000{url}"
-            })
-
-        print(f"Вернул {len(formatted_images)} изображений для территории {territory_id}")
-
-        return jsonify({
-            'success': True,
-            'territory': {
-                'id': territory['id'],
-                'name': territory['name']
-            },
-            'images': formatted_images,
-            'count': len(formatted_images)
-        })
-
-    except Exception as e:
-        print(f"Ошибка в get_all_territory_images_api: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'message': f'Ошибка сервера: {str(e)}'
-        }), 500
-
-
 @app.route('/api/auth/sync', methods=['POST'])
 def auth_sync():
     """Синхронизация авторизации из localStorage"""
@@ -1681,7 +1565,7 @@ def debug_territories():
     """Диагностика - какие территории есть в БД"""
     try:
         import savedTerritories
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -1715,7 +1599,7 @@ def get_user_territories():
         username = user.get('username')
         print(f" Поиск территорий для пользователя: {username}")
 
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -1724,32 +1608,32 @@ def get_user_territories():
 
             print(f"Найдено территорий: {len(territories)}")
 
-            # Форматируем ответ
-            formatted = []
-            for t in territories:
-                # Количество изображений
-                cursor.execute('SELECT COUNT(*) FROM images WHERE territory_id = ?', (t['id'],))
-                img_count = cursor.fetchone()[0]
-
-                formatted.append({
-                    'id': t['id'],
-                    'name': t['name'],
-                    'latitude': t['latitude'],
-                    'longitude': t['longitude'],
-                    'description': t['description'],
-                    'image_count': img_count,
-                    'created_at': t['created_at'],
-                    'is_active': t.get('is_active', 1)
-                })
-
-            return jsonify({
-                'success': True,
-                'territories': formatted,
-                'count': len(formatted),
-                'username': username,
-                'note': 'Показаны все активные территории из БД'
+        # Количество изображений - одним запросом для всех территорий
+        summaries = db.get_territory_summaries()
+
+        # Форматируем ответ
+        formatted = []
+        for t in territories:
+            summary = summaries.get(t['id'], {})
+            formatted.append({
+                'id': t['id'],
+                'name': t['name'],
+                'latitude': t['latitude'],
+                'longitude': t['longitude'],
+                'description': t['description'],
+                'image_count': summary.get('image_count', 0),
+                'created_at': t['created_at'],
+                'is_active': t.get('is_active', 1)
             })
 
+        return jsonify({
+            'success': True,
+            'territories': formatted,
+            'count': len(formatted),
+            'username': username,
+            'note': 'Показаны все активные территории из БД'
+        })
+
     except Exception as e:
         print(f" Ошибка получения территорий: {e}")
         import traceback
@@ -1775,7 +1659,7 @@ def debug_auth():
 def debug_check_db():
     """Проверка что есть в базе данных"""
     try:
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             cursor = conn.cursor()
 
             # 1. Какие таблицы есть
@@ -1807,7 +1691,7 @@ def debug_check_db():
 def debug_db_structure():
     """Проверка структуры базы данных"""
     try:
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             cursor = conn.cursor()
 
             # 1. Получить список таблиц
@@ -1877,6 +1761,7 @@ def send_email_notification(territory_info, change_data, image_files=None):
         print(f"{'=' * 60}")
 
         # Проверяем конфигурацию
+        notification_manager = get_notification_manager()
         if not notification_manager:
             print("⚠ Менеджер уведомлений не инициализирован")
             return False
@@ -1973,6 +1858,7 @@ def check_and_send_notification(territory_id, change_data):
 
         # Проверяем порог
         change_percent = change_data.get('change_percentage', 0)
+        notification_manager = get_notification_manager()
         threshold = getattr(notification_manager.config, 'CHANGE_THRESHOLD', 5.0) if notification_manager else 5.0
 
         print(f" Проверка порога: {change_percent}% vs {threshold}%")
@@ -2010,7 +1896,7 @@ def save_user_email():
             return jsonify({'success': False, 'message': 'Неверный формат email'}), 400
 
         # Получаем текущие email пользователя
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             cursor = conn.cursor()
 
             # Проверяем, существует ли пользователь
@@ -2118,7 +2004,7 @@ def get_user_info():
 
         username = user.get('username')
 
-        with sqlite3.connect(db.db_path) as conn:
+        with db.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -0,0 +1,148 @@
+"""
+Дозагрузка истории снимков территории
+
+Сцены за период берутся из каталога одним постраничным запросом, из каждого
+окна cadence дней выбирается наименее облачная, снимки скачиваются параллельно
+через общий ограничитель запросов и добавляются в базу одной транзакцией.
+
+Повторный запуск продолжает прерванную дозагрузку: сцены, уже записанные
+для территории, пропускаются, а скачанные файлы берутся из кэша GEEClient.
+
+Запуск:
+    python backfill.py <territory_id> <начало YYYY-MM-DD> <конец YYYY-MM-DD> [облачность] [шаг_дней]
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+from database import Database
+from gee_client import GEEClient
+from scene_catalog import SceneCatalog
+
+FETCH_MODE = os.getenv('GEE_FETCH_MODE', 'png')
+FETCH_PROFILE = os.getenv('GEE_FETCH_PROFILE', 'rgb')
+# Параллельные загрузки (частоту запросов все равно ограничивает RateLimiter)
+BACKFILL_WORKERS = int(os.getenv('GEE_BACKFILL_WORKERS', '4'))
+
+
+def pick_by_cadence(scenes: List[Dict[str, Any]], start: str, end: str,
+                    cadence: int) -> List[Dict[str, Any]]:
+    """
+    Наименее облачная сцена в каждом окне cadence дней периода [start, end)
+
+    Returns:
+        Выбранные сцены по возрастанию даты
+    """
+    start_date = datetime.strptime(start, '%Y-%m-%d')
+    best: Dict[int, Dict[str, Any]] = {}
+    for scene in scenes:
+        window = (datetime.strptime(scene['date'], '%Y-%m-%d') - start_date).days // max(1, cadence)
+        current = best.get(window)
+        if current is None or (scene['cloud_cover'], current['date']) < (current['cloud_cover'], scene['date']):
+            best[window] = scene
+    return [best[window] for window in sorted(best) if best[window]['date'] < end]
+
+
+def backfill(territory_id: int, start: str, end: str, max_cloud: float = 30.0, cadence: int = 30,
+             db: Database = None, gee: GEEClient = None, image_size: int = 512,
+             fetch_mode: str = FETCH_MODE, profile: str = FETCH_PROFILE,
+             workers: int = BACKFILL_WORKERS) -> Dict[str, Any]:
+    """
+    История снимков территории за период [start, end)
+
+    Args:
+        territory_id: ID территории
+        start: Начало периода (YYYY-MM-DD)
+        end: Конец периода (YYYY-MM-DD, не включается)
+        max_cloud: Максимальная облачность в %
+        cadence: Шаг истории в днях (один снимок на окно)
+
+    Returns:
+        {'success', 'message', 'selected', 'skipped', 'downloaded', 'failed', 'image_ids'}
+    """
+    db = db or Database()
+    gee = gee or GEEClient(database=db)
+
+    territory = db.get_territory(territory_id)
+    if not territory:
+        return {'success': False, 'message': f"Территория {territory_id} не найдена"}
+    latitude, longitude = territory['latitude'], territory['longitude']
+
+    print(f"\nДОЗАГРУЗКА ИСТОРИИ: {territory['name']}")
+    print(f"Период: {start} - {end}, шаг {cadence} дн., облачность < {max_cloud}%")
+
+    # Одно постраничное обращение к коллекции на весь период
+    catalog = gee.catalog or SceneCatalog(str(db.db_path), lambda: gee.backend, gee.rate_limiter)
+    if not catalog.ensure(latitude, longitude, start, end):
+        return {'success': False, 'message': "Не удалось получить список сцен"}
+
+    selected = pick_by_cadence(catalog.scenes(latitude, longitude, start, end, max_cloud),
+                               start, end, cadence)
+
+    # Продолжение после прерывания: уже записанные сцены не загружаем
+    stored = db.get_territory_scene_ids(territory_id)
+    pending = [scene for scene in selected if scene['scene_id'] not in stored]
+    print(f"Выбрано сцен: {len(selected)}, уже в базе: {len(selected) - len(pending)}, "
+          f"к загрузке: {len(pending)}")
+
+    if gee.rate_limiter is not None and pending:
+        print(f"Оценка времени загрузки: не менее "
+              f"{gee.rate_limiter.estimate_seconds(download_requests=len(pending)):.0f} сек")
+
+    def fetch(scene):
+        success, path, date, message = gee.fetch_scene(latitude, longitude, scene, image_size,
+                                                       fetch_mode, profile)
+        return scene, success, path, message, gee.last_fetch_info()
+
+    rows = []
+    failed = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            for scene, success, path, message, info in pool.map(fetch, pending):
+                if not success:
+                    print(f"   {scene['date']}: ошибка - {message}")
+                    failed.append({'scene_id': scene['scene_id'], 'date': scene['date'], 'message': message})
+                    continue
+                print(f"   {scene['date']}: {message}")
+                rows.append({
+                    'territory_id': territory_id,
+                    'image_path': path,
+                    'capture_date': scene['date'],
+                    'cloud_cover': scene['cloud_cover'],
+                    'file_size': os.path.getsize(path) if os.path.exists(path) else None,
+                    'scene_id': scene['scene_id'],
+                    'render_key': info.get('render_key')
+                })
+
+    image_ids = db.add_images_many(rows) if rows else []
+
+    message = f"Добавлено снимков: {len(image_ids)}, ошибок: {len(failed)}"
+    print(message)
+    return {
+        'success': not failed,
+        'message': message,
+        'selected': len(selected),
+        'skipped': len(selected) - len(pending),
+        'downloaded': len(image_ids),
+        'failed': failed,
+        'image_ids': image_ids
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    today = datetime.now()
+    result = backfill(
+        int(sys.argv[1]),
+        sys.argv[2] if len(sys.argv) > 2 else (today - timedelta(days=365)).strftime('%Y-%m-%d'),
+        sys.argv[3] if len(sys.argv) > 3 else (today + timedelta(days=1)).strftime('%Y-%m-%d'),
+        max_cloud=float(sys.argv[4]) if len(sys.argv) > 4 else 30.0,
+        cadence=int(sys.argv[5]) if len(sys.argv) > 5 else 30
+    )
+    sys.exit(0 if result['success'] else 1)
@@ -0,0 +1,119 @@
+"""
+Замер пропускной способности слоя БД (запросов в секунду)
+
+Сравниваются:
+    до    - новое sqlite3.connect на каждый запрос, журнал по умолчанию (DELETE)
+    после - Database: соединение потока, кэш запросов; с DB_WAL=1 также
+            WAL и synchronous=NORMAL
+
+Запуск:
+    python benchmark_db.py [число_запросов] [потоков]
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from database import Database, DB_WAL
+
+TERRITORIES = 200
+IMAGES_PER_TERRITORY = 20
+
+READ_QUERY = '''
+    SELECT * FROM images
+    WHERE territory_id = ?
+    ORDER BY capture_date DESC
+    LIMIT 1
+'''
+WRITE_QUERY = '''
+    INSERT INTO changes (territory_id, old_image_id, new_image_id, change_percentage)
+    VALUES (?, ?, ?, ?)
+'''
+
+
+def fill(db: Database) -> None:
+    with db.connection() as conn:
+        for index in range(TERRITORIES):
+            conn.execute('INSERT INTO territories (name, latitude, longitude) VALUES (?, ?, ?)',
+                         (f'T{index}', 55.0 + index * 0.01, 37.0))
+        conn.executemany('''
+            INSERT INTO images (territory_id, image_path, capture_date) VALUES (?, ?, ?)
+        ''', [(territory_id, f'img_{territory_id}_{day}.png', f'2024-01-{day + 1:02d}')
+              for territory_id in range(1, TERRITORIES + 1) for day in range(IMAGES_PER_TERRITORY)])
+
+
+def legacy_read(db_path: str, territory_id: int) -> None:
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(READ_QUERY, (territory_id,))
+        cursor.fetchone()
+
+
+def legacy_write(db_path: str, territory_id: int) -> None:
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(WRITE_QUERY, (territory_id, 1, 2, 1.0))
+        conn.commit()
+
+
+def measure(operation, count: int, threads: int) -> float:
+    """Запросов в секунду при threads потоках"""
+    def worker(share: int) -> None:
+        rng = random.Random(share)
+        for _ in range(share):
+            operation(rng.randint(1, TERRITORIES))
+
+    shares = [count // threads + (1 if index < count % threads else 0) for index in range(threads)]
+    pool = [threading.Thread(target=worker, args=(share,)) for share in shares]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    work_dir = tempfile.mkdtemp(prefix='benchmark_db_')
+
+    try:
+        legacy_path = os.path.join(work_dir, 'legacy.db')
+        legacy_db = Database(legacy_path)
+        fill(legacy_db)
+        legacy_db.close()
+        # Старый режим журнала (WAL сохраняется в файле базы)
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute('PRAGMA journal_mode=DELETE')
+
+        db = Database(os.path.join(work_dir, 'current.db'))
+        fill(db)
+
+        def current_write(territory_id: int) -> None:
+            db.add_change(territory_id, 1, 2, 1.0)
+
+        print(f"=== ПРОПУСКНАЯ СПОСОБНОСТЬ БД ({count} запросов, журнал {'WAL' if DB_WAL else 'DELETE'}) ===")
+        print(f"{'Запрос':<28} {'До, запр/с':>12} {'После, запр/с':>14} {'Ускорение':>10}")
+        cases = [
+            ('get_latest_image, 1 поток', lambda t: legacy_read(legacy_path, t), db.get_latest_image, 1),
+            (f'get_latest_image, {threads} потока', lambda t: legacy_read(legacy_path, t),
+             db.get_latest_image, threads),
+            ('add_change, 1 поток', lambda t: legacy_write(legacy_path, t), current_write, 1),
+            (f'add_change, {threads} потока', lambda t: legacy_write(legacy_path, t), current_write, threads),
+        ]
+        for name, before, after, thread_count in cases:
+            before_qps = measure(before, count, thread_count)
+            after_qps = measure(after, count, thread_count)
+            print(f"{name:<28} {before_qps:>12.0f} {after_qps:>14.0f} {after_qps / before_qps:>9.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
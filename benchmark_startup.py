@@ -0,0 +1,93 @@
+"""
+Замер времени холодного запуска (импорт модулей в чистом интерпретаторе)
+
+Запуск:
+    python benchmark_startup.py            - таблица времени импорта
+    python benchmark_startup.py --check    - код выхода 1, если превышен бюджет
+
+Бюджеты (секунды) можно переопределить: STARTUP_BUDGET_APP=1.5 и т.п.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# Модуль -> бюджет холодного импорта в секундах
+BUDGETS = {
+    'database': 0.2,
+    'gee_client': 0.8,
+    'change_detector': 0.8,
+    'detector_registry': 0.1,
+    'app': 1.5,
+    'main': 1.5,
+}
+
+# Модули, которые не должны загружаться при старте веб-сервера
+HEAVY_MODULES = ['ee', 'cv2', 'scipy', 'skimage', 'ultimate_detector', 'super_forest_detector',
+                 'improved_change_detector', 'grid_analyzer', 'grid_creator', 'notification']
+
+RUNS = 3
+
+_PROBE = """
+import io, json, sys, time
+from contextlib import redirect_stdout
+start = time.perf_counter()
+error = None
+with redirect_stdout(io.StringIO()):
+    try:
+        __import__({module!r})
+    except BaseException as e:
+        error = repr(e)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'error': error,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    """Лучшее время импорта из RUNS запусков отдельного интерпретатора"""
+    best = None
+    for _ in range(RUNS):
+        code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = output.stdout.strip().splitlines()
+        result = json.loads(lines[-1]) if lines else {'seconds': 0.0, 'error': output.stderr[-200:], 'heavy': []}
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main():
+    check = '--check' in sys.argv
+    failed = False
+
+    print("=== ВРЕМЯ ХОЛОДНОГО ЗАПУСКА ===")
+    print(f"{'Модуль':<20} {'Время, с':>9} {'Бюджет, с':>10}  Статус")
+
+    for module, budget in BUDGETS.items():
+        budget = float(os.getenv(f"STARTUP_BUDGET_{module.upper()}", budget))
+        result = measure(module)
+
+        if result['error']:
+            # Модуль, который не импортируется, не запустится и в работе
+            status = f"ошибка импорта: {result['error']}"
+            failed = True
+        elif result['seconds'] > budget:
+            status = "ПРЕВЫШЕН БЮДЖЕТ"
+            failed = True
+        else:
+            status = "OK"
+
+        print(f"{module:<20} {result['seconds']:>9.3f} {budget:>10.2f}  {status}")
+        if module == 'app' and result['heavy']:
+            print(f"   При старте загружены тяжелые модули: {', '.join(result['heavy'])}")
+            failed = True
+
+    if check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,10 @@
 """
 
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from database import Database
-from ultimate_detector import detect_forest_changes
 from gee_client import GEEClient
-from improved_change_detector import detect_changes_improved
-from grid_creator import GridCreator
+from detector_registry import registry
 import traceback
 
 
@@ -18,10 +16,14 @@ class ChangeDetector:
         self.gee = gee_client
         self.notifier = None
         self.email_config = None
-        self.grid_creator = GridCreator(grid_size=32)
 
         self._load_email_config()
 
+    @property
+    def grid_creator(self):
+        """Создатель сеток (загружается при первой визуализации)"""
+        return registry.get('grid_creator')
+
     def _load_email_config(self):
         try:
             from config_email import EmailConfig
@@ -57,7 +59,32 @@ class ChangeDetector:
         print(f"   Путь к новому: {new_image['image_path']}")
         print(f"   Путь к старому: {old_image['image_path']}")
 
-        comparison = detect_changes_improved(
+        comparison = self.compare_images(old_image, new_image)
+        if comparison is None:
+            return None
+
+        return self.save_changes(territory_id, old_image, new_image, comparison, send_notification)
+
+    @staticmethod
+    def _change_percentage(comparison: Dict[str, Any]) -> float:
+        """Процент изменений из результатов детектора"""
+        if 'real_change_percentage' in comparison:
+            return comparison['real_change_percentage']
+        return comparison.get('change_percentage', 0)
+
+    def compare_images(self, old_image: Dict[str, Any], new_image: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Сравнение двух снимков детекторами (только вычисления, без записи в БД)
+
+        Args:
+            old_image: Запись старого снимка ('image_path', 'capture_date', 'id')
+            new_image: Запись нового снимка ('id' может отсутствовать, если снимок еще не сохранен)
+
+        Returns:
+            Результаты сравнения или None при ошибке
+        """
+        comparison = registry.detect(
+            'improved',
             old_image['image_path'],
             new_image['image_path']
         )
@@ -66,7 +93,8 @@ class ChangeDetector:
             print(f"Ошибка в улучшенном детекторе: {comparison['error']}")
 
             try:
-                comparison = detect_forest_changes(
+                comparison = registry.detect(
+                    'ultimate',
                     old_image['image_path'],
                     new_image['image_path']
                 )
@@ -99,10 +127,7 @@ class ChangeDetector:
         print("Сравнение выполнено успешно!")
 
         # процент изменений из результатов
-        if 'real_change_percentage' in comparison:
-            change_percentage = comparison['real_change_percentage']
-        else:
-            change_percentage = comparison.get('change_percentage', 0)
+        change_percentage = self._change_percentage(comparison)
 
         print(f"\nРЕЗУЛЬТАТЫ: {change_percentage:.2f}% изменений")
 
@@ -139,8 +164,15 @@ class ChangeDetector:
 
         comparison['new_image_date'] = new_image['capture_date']
         comparison['old_image_date'] = old_image['capture_date']
-        comparison['new_image_id'] = new_image['id']
+        comparison['new_image_id'] = new_image.get('id')
         comparison['old_image_id'] = old_image['id']
+        return comparison
+
+    def save_changes(self, territory_id: int, old_image: Dict[str, Any], new_image: Dict[str, Any],
+                     comparison: Dict[str, Any], send_notification: bool = True) -> Dict[str, Any]:
+        """Запись результатов сравнения в БД и уведомление (если включено)"""
+        change_percentage = self._change_percentage(comparison)
+        comparison['new_image_id'] = new_image['id']
 
         # Сохраняем изменение в БД
         change_id = self.db.add_change(
@@ -153,10 +185,36 @@ class ChangeDetector:
         print(f"Изменения сохранены в БД с ID: {change_id}")
 
         # === Передаем все данные в уведомление ===
-        if send_notification and self._should_send_notification(change_percentage):
-            print(f"\nОтправка уведомления с полными результатами...")
-            self._send_notification(territory_id, change_id, comparison, new_image, old_image)
-
+        if send_notification:
+            self.notify_changes(territory_id, change_id, comparison, new_image, old_image)
+
+        return self._change_result(change_id, change_percentage, old_image, new_image, comparison)
+
+    def save_changes_many(self, entries: List[Tuple[int, Dict[str, Any], Dict[str, Any], Dict[str, Any]]]
+                          ) -> List[Dict[str, Any]]:
+        """
+        Запись результатов нескольких сравнений одной транзакцией (без уведомлений)
+
+        Args:
+            entries: (territory_id, old_image, new_image, comparison)
+
+        Returns:
+            Результаты как у save_changes, в порядке entries
+        """
+        rows = []
+        for territory_id, old_image, new_image, comparison in entries:
+            comparison['new_image_id'] = new_image['id']
+            rows.append({'territory_id': territory_id, 'old_image_id': old_image['id'],
+                         'new_image_id': new_image['id'],
+                         'change_percentage': self._change_percentage(comparison)})
+
+        change_ids = self.db.save_changes_many(rows)
+        return [self._change_result(change_id, row['change_percentage'], old_image, new_image, comparison)
+                for change_id, row, (_, old_image, new_image, comparison) in zip(change_ids, rows, entries)]
+
+    @staticmethod
+    def _change_result(change_id: int, change_percentage: float, old_image: Dict[str, Any],
+                       new_image: Dict[str, Any], comparison: Dict[str, Any]) -> Dict[str, Any]:
         # Вывод предупреждений
         if change_percentage > 10:
             print(f"ВНИМАНИЕ: Значительные изменения обнаружены!")
@@ -182,6 +240,15 @@ class ChangeDetector:
             'grid_visualization_path': comparison.get('grid_visualization_path')
         }
 
+    def notify_changes(self, territory_id: int, change_id: int, comparison: Dict[str, Any],
+                       new_image: Dict[str, Any], old_image: Dict[str, Any]) -> bool:
+        """Уведомление об изменениях, если превышен порог; True - уведомление отправлялось"""
+        if not self._should_send_notification(self._change_percentage(comparison)):
+            return False
+        print(f"\nОтправка уведомления с полными результатами...")
+        self._send_notification(territory_id, change_id, comparison, new_image, old_image)
+        return True
+
     def _should_send_notification(self, change_percentage: float) -> bool:
         if not self.email_config or not hasattr(self.email_config, 'CHANGE_THRESHOLD'):
             return change_percentage > 5.0
@@ -324,9 +391,6 @@ class ChangeDetector:
             grid_files = {}
 
             try:
-                if not hasattr(self, 'grid_creator') or self.grid_creator is None:
-                    self.grid_creator = GridCreator(grid_size=32)
-
                 territory_name = territory.get('name', 'Территория')
 
                 grid_result = self.grid_creator.create_grid_for_email(
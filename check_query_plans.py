@@ -0,0 +1,108 @@
+"""
+Проверка планов запросов горячих методов Database (EXPLAIN QUERY PLAN)
+
+Запросы перехватываются у самих методов Database на временной базе,
+поэтому проверяется именно тот SQL, который выполняет программа. Полный
+просмотр таблицы (SCAN без индекса) или сортировка во временном B-дереве
+считаются ошибкой: на базе с миллионами строк такие запросы деградируют.
+
+Запуск:
+    python check_query_plans.py       - код выхода 1, если найден полный просмотр
+"""
+
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from database import Database
+
+TERRITORIES = 50
+IMAGES_PER_TERRITORY = 40
+
+
+def fill(db: Database) -> None:
+    with db.connection() as conn:
+        for index in range(TERRITORIES):
+            conn.execute('INSERT INTO territories (name, latitude, longitude) VALUES (?, ?, ?)',
+                         (f'T{index}', 55.0 + index * 0.01, 37.0))
+        conn.executemany('''
+            INSERT INTO images (territory_id, image_path, capture_date) VALUES (?, ?, ?)
+        ''', [(territory_id, f'img_{territory_id}_{day}.png', f'2024-{day // 28 + 1:02d}-{day % 28 + 1:02d}')
+              for territory_id in range(1, TERRITORIES + 1) for day in range(IMAGES_PER_TERRITORY)])
+        conn.executemany('''
+            INSERT INTO changes (territory_id, old_image_id, new_image_id, change_percentage)
+            VALUES (?, ?, ?, ?)
+        ''', [(territory_id, image_id, image_id + 1, 1.0)
+              for territory_id in range(1, TERRITORIES + 1)
+              for image_id in range((territory_id - 1) * IMAGES_PER_TERRITORY + 1,
+                                    (territory_id - 1) * IMAGES_PER_TERRITORY + 6)])
+        conn.execute('ANALYZE')
+
+
+def capture(db: Database, call) -> list:
+    """SQL-запросы SELECT и DELETE, выполненные вызовом call"""
+    statements = []
+    # Методы Database выполняют запросы на соединении этого же потока
+    with db.connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith(('SELECT', 'DELETE'))]
+
+
+def bad_steps(db: Database, statement: str) -> list:
+    """Шаги плана с полным просмотром таблицы или временной сортировкой"""
+    with db.connection() as conn:
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}')]
+    return [step for step in plan
+            if (step.startswith('SCAN') and 'INDEX' not in step) or 'TEMP B-TREE' in step]
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='query_plans_')
+    failed = False
+    try:
+        db = Database(str(Path(work_dir) / 'plans.db'))
+        fill(db)
+
+        checks = {
+            'get_territory_images': lambda: db.get_territory_images(7, limit=10),
+            'get_latest_image': lambda: db.get_latest_image(7),
+            'get_territory_image_count': lambda: db.get_territory_image_count(7),
+            'get_recent_changes(territory)': lambda: db.get_recent_changes(7, limit=20),
+            'get_recent_changes': lambda: db.get_recent_changes(limit=20),
+            'get_territory_images(after)': lambda: db.get_territory_images(7, limit=10, after=('2024-01-10', 5)),
+            'get_recent_changes(after)': lambda: db.get_recent_changes(limit=20, after=('2099-01-01', 5)),
+            'get_statistics': db.get_statistics,
+            'get_territory_summaries': lambda: db.get_territory_summaries([7, 8]),
+            'find_image_by_scene': lambda: db.find_image_by_scene('S2A_7', 'png:rgb:512'),
+            'has_change_for_image': lambda: db.has_change_for_image(2),
+            # Последним: удаляет тестовые данные. Тот же DELETE сравнений
+            # выполняет cleanup_missing_files (сам он читает все снимки)
+            'delete_images_many': lambda: db.delete_images_many([3, 4, 5]),
+        }
+
+        print("=== ПЛАНЫ ЗАПРОСОВ ===")
+        for name, call in checks.items():
+            statements = capture(db, call)
+            problems = [step for statement in statements for step in bad_steps(db, statement)]
+            if not statements:
+                print(f"{name:<32} запросов не выполнено")
+                failed = True
+            elif problems:
+                print(f"{name:<32} ПОЛНЫЙ ПРОСМОТР: {'; '.join(problems)}")
+                failed = True
+            else:
+                print(f"{name:<32} OK")
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,43 +4,431 @@
 import json
 import os
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+# Ожидание блокировки записи, занятой другим соединением (мс)
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+# Размер кэша подготовленных запросов на соединение
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+# Журнал WAL (DB_WAL=1): чтение не ждет записи, но WAL работает через общую
+# память и только на одном узле - базу нельзя открывать с других машин или
+# по сетевой файловой системе (например, общую очередь job_queue нескольких узлов).
+# По умолчанию - обычный журнал (DELETE), база может лежать на общем диске
+DB_WAL = os.getenv('DB_WAL', '').lower() in ('1', 'true', 'yes')
+# Срок хранения сводок территорий в памяти (секунды). Запись через этот же
+# объект Database сбрасывает кэш сразу, запись других процессов видна по истечении срока
+DB_SUMMARY_CACHE_SECONDS = float(os.getenv('DB_SUMMARY_CACHE_SECONDS', '30'))
+
+def _add_column_if_missing(cursor, table: str, column: str, column_type: str) -> None:
+    """Добавление столбца в таблицу, созданную старой версией программы"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _table_columns(cursor, table: str) -> List[str]:
+    """Столбцы таблицы (пустой список, если таблицы нет)"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _add_image_scene_columns(cursor) -> None:
+    # Столбцы, добавленные после создания таблицы
+    _add_column_if_missing(cursor, 'images', 'scene_id', 'TEXT')
+    _add_column_if_missing(cursor, 'images', 'render_key', 'TEXT')
+
+
+def _merge_legacy_tables(cursor) -> None:
+    """
+    Перенос старых таблиц satellite_images и change_history в images и changes
+
+    ID снимков в images назначаются заново, ссылки change_history
+    (image1_id, image2_id) пересчитываются на новые ID.
+    """
+    image_ids = {}
+    legacy_images = _table_columns(cursor, 'satellite_images')
+    if legacy_images:
+        added_at = 'added_at' if 'added_at' in legacy_images else 'CURRENT_TIMESTAMP'
+        cursor.execute(f'''
+            SELECT id, territory_id, image_path, capture_date, cloud_cover, file_size, {added_at}
+            FROM satellite_images
+        ''')
+        for row in cursor.fetchall():
+            cursor.execute('''
+                INSERT INTO images (territory_id, image_path, capture_date, cloud_cover, file_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', row[1:])
+            image_ids[row[0]] = cursor.lastrowid
+        cursor.execute('DROP TABLE satellite_images')
+
+    legacy_changes = _table_columns(cursor, 'change_history')
+    if legacy_changes:
+        fields = [column if column in legacy_changes else 'NULL'
+                  for column in ('territory_id', 'image1_id', 'image2_id', 'change_percentage', 'detected_at')]
+        cursor.execute(f"SELECT {', '.join(fields)} FROM change_history")
+        for territory_id, old_id, new_id, percentage, detected_at in cursor.fetchall():
+            cursor.execute('''
+                INSERT INTO changes (territory_id, old_image_id, new_image_id, change_percentage, detected_at)
+                VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            ''', (territory_id, image_ids.get(old_id, old_id), image_ids.get(new_id, new_id),
+                  percentage, detected_at))
+        cursor.execute('DROP TABLE change_history')
+
+
+def page_cursor(rows: List[Dict[str, Any]], limit: int, date_field: str) -> Optional[str]:
+    """
+    Курсор следующей страницы "<дата>,<id>" по последней строке страницы
+
+    None - страница неполная, дальше строк нет. Разбор курсора - parse_cursor.
+    """
+    if not rows or len(rows) < limit:
+        return None
+    return f"{rows[-1][date_field]},{rows[-1]['id']}"
+
+
+def parse_cursor(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Курсор "<дата>,<id>" в (дата, id); ValueError - неверный формат"""
+    if not value:
+        return None
+    date, separator, row_id = value.rpartition(',')
+    if not separator or not date:
+        raise ValueError(f"Неверный курсор: {value}")
+    return date, int(row_id)
+
+
+# Счетчики statistics, вычисленные по самим таблицам
+STATISTICS_QUERY = '''
+    SELECT (SELECT COUNT(*) FROM territories WHERE is_active = 1),
+           (SELECT COUNT(*) FROM images),
+           (SELECT COUNT(*) FROM changes),
+           (SELECT MAX(created_at) FROM images),
+           (SELECT MAX(detected_at) FROM changes)
+'''
+STATISTICS_FIELDS = ('territories', 'images', 'changes', 'last_image_date', 'last_change_date')
+
+
+def _inserted_ids(cursor, count: int) -> List[int]:
+    """
+    ID строк, вставленных последним executemany (в порядке параметров)
+
+    Транзакция держит блокировку записи с первой вставки, поэтому rowid
+    вставленных строк идут подряд и заканчиваются last_insert_rowid().
+    """
+    if not count:
+        return []
+    cursor.execute('SELECT last_insert_rowid()')
+    last = cursor.fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+def _refresh_statistics(cursor) -> None:
+    """Пересчет строки statistics по таблицам (полный просмотр)"""
+    cursor.execute(STATISTICS_QUERY)
+    values = cursor.fetchone()
+    cursor.execute('''
+        INSERT OR REPLACE INTO statistics
+            (id, territories, images, changes, last_image_date, last_change_date, repaired_at)
+        VALUES (1, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', values)
+
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-оператор или функция(cursor).
+# Применяются один раз при запуске, по порядку, в одной транзакции;
+# примененные версии записаны в schema_version. Новые изменения схемы -
+# только новой миграцией в конце списка.
+MIGRATIONS = [
+    (1, 'основные таблицы', [
+        # Таблица территорий
+        '''
+        CREATE TABLE IF NOT EXISTS territories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            description TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица изображений
+        '''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            territory_id INTEGER,
+            image_path TEXT NOT NULL,
+            capture_date TEXT NOT NULL,
+            cloud_cover REAL,
+            file_size INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            scene_id TEXT,  -- system:index снимка Sentinel-2
+            render_key TEXT,  -- параметры загрузки (режим, размер, область)
+            FOREIGN KEY (territory_id) REFERENCES territories (id)
+        )
+        ''',
+        _add_image_scene_columns,
+        # Таблица изменений
+        '''
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            territory_id INTEGER,
+            old_image_id INTEGER,
+            new_image_id INTEGER,
+            change_percentage REAL,
+            change_data TEXT,  -- JSON с результатами сравнения
+            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            comparison_type TEXT DEFAULT 'auto',
+            FOREIGN KEY (territory_id) REFERENCES territories (id),
+            FOREIGN KEY (old_image_id) REFERENCES images (id),
+            FOREIGN KEY (new_image_id) REFERENCES images (id)
+        )
+        ''',
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT,
+            email TEXT,
+            notification_emails TEXT DEFAULT '[]',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Прогоны мониторинга и этапы обработки территорий в них
+        '''
+        CREATE TABLE IF NOT EXISTS monitoring_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'running',  -- running, completed, abandoned
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS run_items (
+            run_id INTEGER NOT NULL,
+            territory_id INTEGER NOT NULL,
+            stage TEXT NOT NULL DEFAULT 'pending',  -- pending, fetched, saved, done, failed
+            image_path TEXT,
+            capture_date TEXT,
+            scene_id TEXT,
+            render_key TEXT,
+            image_id INTEGER,
+            message TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, territory_id),
+            FOREIGN KEY (run_id) REFERENCES monitoring_runs (id),
+            FOREIGN KEY (territory_id) REFERENCES territories (id)
+        )
+        ''',
+    ]),
+    (2, 'индексы выборок снимков и изменений', [
+        # get_territory_images, get_latest_image, get_territory_image_count
+        'CREATE INDEX IF NOT EXISTS idx_images_territory_date ON images (territory_id, capture_date DESC)',
+        # get_recent_changes по территории и по всем территориям
+        'CREATE INDEX IF NOT EXISTS idx_changes_territory_date ON changes (territory_id, detected_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_changes_date ON changes (detected_at DESC)',
+    ]),
+    (3, 'перенос satellite_images и change_history в images и changes', [
+        _merge_legacy_tables,
+    ]),
+    (4, 'счетчики статистики, обновляемые триггерами', [
+        # Одна строка (id = 1); get_statistics читает ее вместо COUNT(*) по таблицам.
+        # Удаление не сдвигает время последней активности назад, это делает repair_statistics
+        '''
+        CREATE TABLE IF NOT EXISTS statistics (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            territories INTEGER NOT NULL DEFAULT 0,  -- активные территории
+            images INTEGER NOT NULL DEFAULT 0,
+            changes INTEGER NOT NULL DEFAULT 0,
+            last_image_date TIMESTAMP,
+            last_change_date TIMESTAMP,
+            repaired_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_territory_insert AFTER INSERT ON territories
+        WHEN NEW.is_active = 1
+        BEGIN
+            UPDATE statistics SET territories = territories + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_territory_delete AFTER DELETE ON territories
+        WHEN OLD.is_active = 1
+        BEGIN
+            UPDATE statistics SET territories = territories - 1 WHERE id = 1;
+        END
+        ''',
+        # Мягкое удаление и восстановление территории (is_active)
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_territory_active AFTER UPDATE OF is_active ON territories
+        WHEN (OLD.is_active IS 1) != (NEW.is_active IS 1)
+        BEGIN
+            UPDATE statistics SET territories = territories + (NEW.is_active IS 1) - (OLD.is_active IS 1)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_image_insert AFTER INSERT ON images
+        BEGIN
+            UPDATE statistics
+            SET images = images + 1,
+                last_image_date = CASE WHEN last_image_date IS NULL OR NEW.created_at > last_image_date
+                                       THEN NEW.created_at ELSE last_image_date END
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_image_delete AFTER DELETE ON images
+        BEGIN
+            UPDATE statistics SET images = images - 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_change_insert AFTER INSERT ON changes
+        BEGIN
+            UPDATE statistics
+            SET changes = changes + 1,
+                last_change_date = CASE WHEN last_change_date IS NULL OR NEW.detected_at > last_change_date
+                                        THEN NEW.detected_at ELSE last_change_date END
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_statistics_change_delete AFTER DELETE ON changes
+        BEGIN
+            UPDATE statistics SET changes = changes - 1 WHERE id = 1;
+        END
+        ''',
+        _refresh_statistics,
+    ]),
+    (5, 'время последней успешной проверки территории', [
+        # Загрузка без новой сцены и пропуск по пролетам тоже проверка: от нее
+        # считается "несвежесть" территории в PriorityScheduler
+        "ALTER TABLE territories ADD COLUMN last_checked_at TIMESTAMP",
+    ]),
+    (6, 'индекс снимков по сцене', [
+        # find_image_by_scene - при каждой загрузке каждой территории
+        'CREATE INDEX IF NOT EXISTS idx_images_scene ON images (scene_id, render_key)',
+    ]),
+    (7, 'индексы сравнений по снимкам', [
+        # has_change_for_image и удаление сравнений вместе со снимками
+        # (delete_images_many, cleanup_missing_files)
+        'CREATE INDEX IF NOT EXISTS idx_changes_old_image ON changes (old_image_id)',
+        'CREATE INDEX IF NOT EXISTS idx_changes_new_image ON changes (new_image_id)',
+    ]),
+]
+
+
+class ThreadConnections:
+    """
+    Соединения с базой по одному на поток
+
+    Соединение открывается один раз на поток (sqlite3 не разрешает общее
+    соединение между потоками) и живет вместе с ним, поэтому кэш подготовленных
+    запросов переиспользуется. Через этот класс к базе обращаются Database,
+    каталог сцен, индекс растров и очередь задач - с одинаковыми настройками.
+    """
+
+    def __init__(self, db_path, busy_timeout_ms: int = DB_BUSY_TIMEOUT_MS):
+        self.db_path = Path(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """
+        Соединение текущего потока
+
+        С DB_WAL включается WAL (чтение во время записи) и synchronous=NORMAL,
+        который в режиме WAL не теряет целостность базы.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000,
+                                   cached_statements=DB_STATEMENT_CACHE)
+            if DB_WAL:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            else:
+                # Режим WAL хранится в файле базы: возвращаем обычный журнал,
+                # если база была открыта с DB_WAL=1
+                try:
+                    conn.execute('PRAGMA journal_mode=DELETE')
+                except sqlite3.OperationalError as error:
+                    print(f"Журнал WAL не отключен (база открыта другим процессом): {error}")
+            conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, row_factory=None) -> Iterator[sqlite3.Connection]:
+        """Соединение потока как транзакция: фиксация при выходе, откат при ошибке"""
+        conn = self.get()
+        conn.row_factory = row_factory
+        with conn:
+            yield conn
+
+    def close(self) -> None:
+        """Закрытие соединения текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
 
 
 class Database:
     def __init__(self, db_path: str = "satellite_monitor.db"):
-        self.conn = None
         self.db_path = Path(db_path)
+        self._connections = ThreadConnections(self.db_path)
+        # Кэш get_territory_summary: {territory_id: сводка} и время его загрузки
+        self._summaries: Optional[Dict[int, Dict[str, Any]]] = None
+        self._summaries_loaded_at = 0.0
+        self._summaries_lock = threading.Lock()
         self._init_db()
 
+    def _thread_connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (ThreadConnections)"""
+        return self._connections.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Соединение потока как транзакция: фиксация при выходе, откат при ошибке
+
+            with db.connection() as conn:
+                conn.execute(...)
+        """
+        conn = self._thread_connection()
+        # Как у нового соединения: строки - кортежи, пока метод не задаст row_factory
+        conn.row_factory = None
+        written = conn.total_changes
+        with conn:
+            yield conn
+        if conn.total_changes != written:
+            self._invalidate_summaries()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._thread_connection()
+
+    def close(self) -> None:
+        """Закрытие соединения текущего потока"""
+        self._connections.close()
+
     def delete_image(self, image_id):
         """Удалить изображение из базы данных"""
-        if self.conn is None:
-            print("⚠  Восстанавливаю соединение с БД...")
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row
-
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS satellite_images (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    territory_id INTEGER NOT NULL,
-                    image_path TEXT NOT NULL,
-                    capture_date DATE NOT NULL,
-                    cloud_cover REAL,
-                    file_size INTEGER,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            self.conn.commit()
-
-            cursor.execute('DELETE FROM satellite_images WHERE id = ?', (image_id,))
+            cursor.execute('DELETE FROM images WHERE id = ?', (image_id,))
             self.conn.commit()
 
             if cursor.rowcount > 0:
+                self._invalidate_summaries()
                 print(f" Изображение ID {image_id} удалено из БД")
                 return True
             else:
@@ -59,21 +447,19 @@ class Database:
             cursor = self.conn.cursor()
 
             # Получаем все записи
-            cursor.execute('SELECT id, image_path FROM satellite_images')
+            cursor.execute('SELECT id, image_path FROM images')
             all_images = cursor.fetchall()
 
-            deleted_count = 0
-            for img in all_images:
-                image_id, image_path = img[0], img[1]
+            missing = [(img[0],) for img in all_images if not os.path.exists(img[1])]
+            for (image_id,) in missing:
+                print(f"🗑️  Удалена запись ID {image_id} (файл отсутствует)")
 
-                if not os.path.exists(image_path):
-                    cursor.execute('DELETE FROM satellite_images WHERE id = ?', (image_id,))
-                    cursor.execute('DELETE FROM change_history WHERE image1_id = ? OR image2_id = ?',
-                                   (image_id, image_id))
-                    deleted_count += 1
-                    print(f"🗑️  Удалена запись ID {image_id} (файл отсутствует)")
+            cursor.executemany('DELETE FROM images WHERE id = ?', missing)
+            cursor.executemany('DELETE FROM changes WHERE old_image_id = ?1 OR new_image_id = ?1', missing)
+            deleted_count = len(missing)
 
             self.conn.commit()
+            self._invalidate_summaries()
             print(f"\n Очистка завершена. Удалено записей: {deleted_count}")
             return deleted_count
 
@@ -83,14 +469,9 @@ class Database:
 
     def update_image_size(self, image_id, file_size):
         """Обновить размер файла изображения"""
-        if self.conn is None:
-            print("⚠  Восстанавливаю соединение с БД...")
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row
-
         try:
             cursor = self.conn.cursor()
-            cursor.execute('UPDATE satellite_images SET file_size = ? WHERE id = ?',
+            cursor.execute('UPDATE images SET file_size = ? WHERE id = ?',
                            (file_size, image_id))
             self.conn.commit()
             return cursor.rowcount > 0
@@ -100,107 +481,51 @@ class Database:
         finally:
             cursor.close()
 
-    def get_statistics(self):
-        """Получить статистику системы"""
-        if self.conn is None:
-            print("️  Восстанавливаю соединение с БД...")
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row
-
-        stats = {}
-        try:
-            cursor = self.conn.cursor()
-
-            cursor.execute('SELECT COUNT(*) FROM territories')
-            stats['territories'] = cursor.fetchone()[0]
-
-            cursor.execute('SELECT COUNT(*) FROM satellite_images')
-            stats['images'] = cursor.fetchone()[0]
-
-            cursor.execute('SELECT COUNT(*) FROM change_history')
-            stats['changes'] = cursor.fetchone()[0]
-
-            cursor.execute('SELECT MAX(capture_date) FROM satellite_images')
-            stats['last_image_date'] = cursor.fetchone()[0]
-
-            cursor.execute('SELECT MAX(detected_at) FROM change_history')
-            stats['last_change_date'] = cursor.fetchone()[0]
-
-            return stats
-        except Exception as e:
-            print(f" Ошибка статистики: {e}")
-            return stats
-        finally:
-            cursor.close()
-
     def _init_db(self):
-        """Инициализация базы данных"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-
-            # Таблица территорий
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS territories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    latitude REAL NOT NULL,
-                    longitude REAL NOT NULL,
-                    description TEXT,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Таблица изображений
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS images (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    territory_id INTEGER,
-                    image_path TEXT NOT NULL,
-                    capture_date TEXT NOT NULL,
-                    cloud_cover REAL,
-                    file_size INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (territory_id) REFERENCES territories (id)
-                )
-            ''')
-
-            # Таблица изменений
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS changes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    territory_id INTEGER,
-                    old_image_id INTEGER,
-                    new_image_id INTEGER,
-                    change_percentage REAL,
-                    change_data TEXT,  -- НОВЫЙ СТОЛБЕЦ для хранения JSON данных
-                    detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    comparison_type TEXT DEFAULT 'auto',  -- НОВЫЙ СТОЛБЕЦ
-                    FOREIGN KEY (territory_id) REFERENCES territories (id),
-                    FOREIGN KEY (old_image_id) REFERENCES images (id),
-                    FOREIGN KEY (new_image_id) REFERENCES images (id)
-                )
-            ''')
-
-            # таблица пользователей
-            cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS users (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            username TEXT UNIQUE NOT NULL,
-                            password TEXT,
-                            email TEXT,
-                            notification_emails TEXT DEFAULT '[]',
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
+        """Инициализация базы данных: недостающие миграции схемы"""
+        with self.connection() as conn:
+            self._migrate(conn.cursor())
             conn.commit()
 
+    @staticmethod
+    def _migrate(cursor) -> None:
+        """Применение миграций схемы, которых еще нет в schema_version"""
+        # Блокировка записи: процесс, запущенный одновременно, дождется
+        # окончания миграций и увидит новую версию
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        current = cursor.fetchone()[0]
+
+        for version, description, steps in MIGRATIONS:
+            if version <= current:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                           (version, description))
+            print(f"Миграция схемы {version}: {description}")
+
+    def schema_version(self) -> int:
+        """Текущая версия схемы"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            return cursor.fetchone()[0]
+
     def add_territory(self, name: str, latitude: float, longitude: float,
                       description: str = "") -> int:
         """Добавление новой территории"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO territories (name, latitude, longitude, description)
@@ -211,7 +536,7 @@ class Database:
 
     def get_territory(self, territory_id: int) -> Optional[Dict[str, Any]]:
         """Получение территории по ID"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM territories WHERE id = ?', (territory_id,))
@@ -220,7 +545,7 @@ class Database:
 
     def get_all_territories(self, active_only: bool = True) -> List[Dict[str, Any]]:
         """Получение всех территорий"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
@@ -254,7 +579,7 @@ class Database:
         query = f"UPDATE territories SET {', '.join(updates)} WHERE id = ?"
 
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, values)
                 conn.commit()
@@ -267,34 +592,130 @@ class Database:
         return self.update_territory(territory_id, is_active=0)
 
     def add_image(self, territory_id: int, image_path: str, capture_date: str,
-                  cloud_cover: Optional[float] = None, file_size: Optional[int] = None) -> int:
+                  cloud_cover: Optional[float] = None, file_size: Optional[int] = None,
+                  scene_id: Optional[str] = None, render_key: Optional[str] = None) -> int:
         """Добавление изображения в базу"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO images (territory_id, image_path, capture_date, 
-                                  cloud_cover, file_size)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (territory_id, image_path, capture_date, cloud_cover, file_size))
+                INSERT INTO images (territory_id, image_path, capture_date,
+                                  cloud_cover, file_size, scene_id, render_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (territory_id, image_path, capture_date, cloud_cover, file_size,
+                  scene_id, render_key))
             conn.commit()
             return cursor.lastrowid
 
-    def get_territory_images(self, territory_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Получение изображений территории"""
-        with sqlite3.connect(self.db_path) as conn:
+    def add_images_many(self, images: List[Dict[str, Any]], run_id: Optional[int] = None) -> List[int]:
+        """
+        Добавление нескольких изображений одной транзакцией
+
+        Args:
+            images: Словари с ключами territory_id, image_path, capture_date
+                    и необязательными cloud_cover, file_size, scene_id, render_key
+            run_id: Прогон мониторинга - в той же транзакции территории
+                    отмечаются этапом 'saved' (после перезапуска снимок
+                    не будет записан повторно)
+
+        Returns:
+            ID добавленных изображений в порядке images
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO images (territory_id, image_path, capture_date,
+                                  cloud_cover, file_size, scene_id, render_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(image['territory_id'], image['image_path'], image['capture_date'],
+                   image.get('cloud_cover'), image.get('file_size'),
+                   image.get('scene_id'), image.get('render_key')) for image in images])
+            image_ids = _inserted_ids(cursor, len(images))
+
+            if run_id is not None:
+                cursor.executemany('''
+                    UPDATE run_items SET stage = 'saved', image_id = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE run_id = ? AND territory_id = ?
+                ''', [(image_id, run_id, image['territory_id']) for image_id, image in zip(image_ids, images)])
+            conn.commit()
+            return image_ids
+
+    def delete_images_many(self, image_ids: List[int]) -> int:
+        """
+        Удаление нескольких изображений одной транзакцией
+
+        Вместе со снимками удаляются сравнения, в которых они участвовали.
+
+        Returns:
+            Количество удаленных изображений
+        """
+        if not image_ids:
+            return 0
+        params = [(image_id,) for image_id in image_ids]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM changes WHERE old_image_id = ?1 OR new_image_id = ?1', params)
+            cursor.executemany('DELETE FROM images WHERE id = ?', params)
+            conn.commit()
+            return cursor.rowcount
+
+    def find_image_by_scene(self, scene_id: str, render_key: str) -> Optional[Dict[str, Any]]:
+        """Последнее изображение из той же сцены, загруженное с теми же параметрами"""
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT * FROM images 
-                WHERE territory_id = ? 
-                ORDER BY capture_date DESC 
-                LIMIT ?
-            ''', (territory_id, limit))
+                SELECT * FROM images
+                WHERE scene_id = ? AND render_key = ?
+                ORDER BY id DESC
+                LIMIT 1
+            ''', (scene_id, render_key))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def get_territory_scene_ids(self, territory_id: int) -> set:
+        """ID сцен, снимки которых уже сохранены для территории"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT DISTINCT scene_id FROM images
+                WHERE territory_id = ? AND scene_id IS NOT NULL
+            ''', (territory_id,))
+            return {row[0] for row in cursor.fetchall()}
+
+    def get_territory_images(self, territory_id: int, limit: int = 10,
+                             after: Optional[Tuple[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Получение изображений территории (новые первыми)
+
+        Args:
+            after: Курсор (capture_date, id) последнего снимка предыдущей страницы;
+                   страница начинается сразу после него (см. page_cursor)
+        """
+        with self.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            if after is None:
+                cursor.execute('''
+                    SELECT * FROM images 
+                    WHERE territory_id = ? 
+                    ORDER BY capture_date DESC, id
+                    LIMIT ?
+                ''', (territory_id, limit))
+            else:
+                # Порядок совпадает с индексом (territory_id, capture_date DESC, rowid),
+                # условие capture_date <= ? - поиск по индексу, а не пропуск строк
+                cursor.execute('''
+                    SELECT * FROM images
+                    WHERE territory_id = ? AND capture_date <= ?
+                      AND (capture_date < ? OR id > ?)
+                    ORDER BY capture_date DESC, id
+                    LIMIT ?
+                ''', (territory_id, after[0], after[0], after[1], limit))
             return [dict(row) for row in cursor.fetchall()]
 
     def get_latest_image(self, territory_id: int) -> Optional[Dict[str, Any]]:
         """Получение последнего изображения территории"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute('''
@@ -309,7 +730,7 @@ class Database:
     def add_change(self, territory_id: int, old_image_id: int, new_image_id: int,
                    change_percentage: float) -> int:
         """Добавление записи об изменении"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO changes (territory_id, old_image_id, new_image_id,
@@ -319,75 +740,181 @@ class Database:
             conn.commit()
             return cursor.lastrowid
 
-    def get_recent_changes(self, territory_id: Optional[int] = None,
-                           limit: int = 20) -> List[Dict[str, Any]]:
-        """Получение последних изменений"""
-        with sqlite3.connect(self.db_path) as conn:
+    def save_changes_many(self, changes: List[Dict[str, Any]]) -> List[int]:
+        """
+        Добавление нескольких записей об изменениях одной транзакцией
+
+        Args:
+            changes: Словари с ключами territory_id, old_image_id, new_image_id,
+                     change_percentage и необязательными change_data,
+                     detected_at, comparison_type
+
+        Returns:
+            ID добавленных записей в порядке changes
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO changes (territory_id, old_image_id, new_image_id, change_percentage,
+                                   change_data, detected_at, comparison_type)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            ''', [(change['territory_id'], change['old_image_id'], change['new_image_id'],
+                   change['change_percentage'], change.get('change_data'),
+                   change.get('detected_at'), change.get('comparison_type', 'auto')) for change in changes])
+            change_ids = _inserted_ids(cursor, len(changes))
+            conn.commit()
+            return change_ids
+
+    def get_recent_changes(self, territory_id: Optional[int] = None, limit: int = 20,
+                           after: Optional[Tuple[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Получение последних изменений
+
+        Args:
+            after: Курсор (detected_at, id) последнего изменения предыдущей страницы
+        """
+        conditions = []
+        params: List[Any] = []
+        if territory_id:
+            conditions.append('c.territory_id = ?')
+            params.append(territory_id)
+        if after is not None:
+            # Как у снимков: порядок индекса (detected_at DESC, rowid)
+            conditions.append('c.detected_at <= ? AND (c.detected_at < ? OR c.id > ?)')
+            params.extend((after[0], after[0], after[1]))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-
-            if territory_id:
-                cursor.execute('''
-                    SELECT c.*, t.name as territory_name 
-                    FROM changes c
-                    JOIN territories t ON c.territory_id = t.id
-                    WHERE c.territory_id = ?
-                    ORDER BY c.detected_at DESC 
-                    LIMIT ?
-                ''', (territory_id, limit))
-            else:
-                cursor.execute('''
-                    SELECT c.*, t.name as territory_name 
-                    FROM changes c
-                    JOIN territories t ON c.territory_id = t.id
-                    ORDER BY c.detected_at DESC 
-                    LIMIT ?
-                ''', (limit,))
+            cursor.execute(f'''
+                SELECT c.*, t.name as territory_name 
+                FROM changes c
+                JOIN territories t ON c.territory_id = t.id
+                {where}
+                ORDER BY c.detected_at DESC, c.id
+                LIMIT ?
+            ''', params + [limit])
 
             return [dict(row) for row in cursor.fetchall()]
 
     def get_statistics(self) -> Dict[str, Any]:
-        """Получение статистики"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Получение статистики (счетчики из таблицы statistics, без просмотра таблиц)"""
+        with self.connection() as conn:
             cursor = conn.cursor()
-
-            # Количество территорий
-            cursor.execute('SELECT COUNT(*) FROM territories WHERE is_active = 1')
-            territory_count = cursor.fetchone()[0]
-
-            # Количество изображений
-            cursor.execute('SELECT COUNT(*) FROM images')
-            image_count = cursor.fetchone()[0]
-
-            # Количество изменений
-            cursor.execute('SELECT COUNT(*) FROM changes')
-            change_count = cursor.fetchone()[0]
-
-            # Последняя активность
-            cursor.execute('SELECT MAX(created_at) FROM images')
-            last_image = cursor.fetchone()[0]
-
-            cursor.execute('SELECT MAX(detected_at) FROM changes')
-            last_change = cursor.fetchone()[0]
-
-            return {
-                'territories': territory_count,
-                'images': image_count,
-                'changes': change_count,
-                'last_image_date': last_image,
-                'last_change_date': last_change
-            }
+            cursor.execute(f"SELECT {', '.join(STATISTICS_FIELDS)} FROM statistics WHERE id = 1")
+            row = cursor.fetchone()
+            if row is None:
+                # Строку удалили вручную - пересчет по таблицам
+                _refresh_statistics(cursor)
+                cursor.execute(STATISTICS_QUERY)
+                row = cursor.fetchone()
+            return dict(zip(STATISTICS_FIELDS, row))
+
+    def repair_statistics(self) -> Dict[str, Tuple[Any, Any]]:
+        """
+        Сверка счетчиков statistics с таблицами и их исправление
+
+        Returns:
+            {поле: (было, стало)} для разошедшихся значений
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Счетчики не должны меняться между сверкой и записью
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f"SELECT {', '.join(STATISTICS_FIELDS)} FROM statistics WHERE id = 1")
+            stored = cursor.fetchone() or (None,) * len(STATISTICS_FIELDS)
+            cursor.execute(STATISTICS_QUERY)
+            actual = cursor.fetchone()
+            _refresh_statistics(cursor)
+
+        drift = {field: (old, new) for field, old, new in zip(STATISTICS_FIELDS, stored, actual) if old != new}
+        if drift:
+            print(f"Статистика исправлена: {drift}")
+        return drift
+
+    def get_territory_summaries(self, territory_ids: Optional[List[int]] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Сводки территорий одним запросом
+
+        Returns:
+            {territory_id: {'image_count', 'latest_image_id', 'latest_capture_date',
+                            'latest_change_percentage', 'latest_change_at'}}
+            для всех территорий (или только territory_ids)
+        """
+        territory_filter = ''
+        params: List[Any] = []
+        if territory_ids is not None:
+            if not territory_ids:
+                return {}
+            territory_filter = f"WHERE t.id IN ({', '.join('?' * len(territory_ids))})"
+            params = list(territory_ids)
+
+        with self.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            # ID последнего снимка и процент последнего изменения: в SQLite столбец
+            # рядом с MAX() берется из строки с максимумом, поэтому хватает одной группировки
+            cursor.execute(f'''
+                SELECT t.id AS territory_id,
+                       COALESCE(i.image_count, 0) AS image_count,
+                       i.latest_image_id,
+                       i.latest_capture_date,
+                       c.change_percentage AS latest_change_percentage,
+                       c.latest_change_at
+                FROM territories t
+                LEFT JOIN (
+                    SELECT territory_id, id AS latest_image_id, COUNT(*) AS image_count,
+                           MAX(capture_date) AS latest_capture_date
+                    FROM images
+                    GROUP BY territory_id
+                ) i ON i.territory_id = t.id
+                LEFT JOIN (
+                    SELECT territory_id, change_percentage, MAX(detected_at) AS latest_change_at
+                    FROM changes
+                    GROUP BY territory_id
+                ) c ON c.territory_id = t.id
+                {territory_filter}
+            ''', params)
+            return {row['territory_id']: {key: row[key] for key in row.keys() if key != 'territory_id'}
+                    for row in cursor.fetchall()}
+
+    def get_territory_summary(self, territory_id: int) -> Dict[str, Any]:
+        """Сводка территории из кэша (при устаревании - один запрос для всех территорий)"""
+        with self._summaries_lock:
+            if (self._summaries is None or
+                    time.monotonic() - self._summaries_loaded_at > DB_SUMMARY_CACHE_SECONDS):
+                self._summaries = self.get_territory_summaries()
+                self._summaries_loaded_at = time.monotonic()
+            summary = self._summaries.get(territory_id)
+        return dict(summary) if summary else {'image_count': 0, 'latest_image_id': None,
+                                              'latest_capture_date': None,
+                                              'latest_change_percentage': None, 'latest_change_at': None}
+
+    def _invalidate_summaries(self) -> None:
+        self._summaries = None
 
     def get_territory_image_count(self, territory_id: int) -> int:
         """Получение количества изображений для территории"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM images WHERE territory_id = ?', (territory_id,))
             return cursor.fetchone()[0]
 
+    def get_images(self, image_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Изображения по списку ID одним запросом: {image_id: изображение}"""
+        if not image_ids:
+            return {}
+        with self.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM images WHERE id IN ({', '.join('?' * len(image_ids))})",
+                           list(image_ids))
+            return {row['id']: dict(row) for row in cursor.fetchall()}
+
     def get_image(self, image_id: int) -> Optional[Dict[str, Any]]:
         """Получение изображения по ID"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM images WHERE id = ?', (image_id,))
@@ -398,7 +925,7 @@ class Database:
                               change_percentage: float, change_data: str,
                               detected_at: str, comparison_type: str = 'auto'):
         """Сохранение результата детекции изменений"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO changes (territory_id, old_image_id, new_image_id,
@@ -409,10 +936,168 @@ class Database:
             conn.commit()
             return cursor.lastrowid
 
+    def has_change_for_image(self, new_image_id: int) -> bool:
+        """Есть ли уже результат детекции для нового снимка"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM changes WHERE new_image_id = ? LIMIT 1', (new_image_id,))
+            return cursor.fetchone() is not None
+
+    def get_territory_activity(self, window_days: int = 30,
+                               alert_threshold: float = 5.0) -> Dict[int, Dict[str, Any]]:
+        """
+        История изменений и загрузок по территориям одним запросом
+
+        Returns:
+            {territory_id: {'recent_changes', 'recent_alerts', 'avg_change',
+                            'last_alert_at', 'last_fetch_at', 'last_checked_at'}}
+
+            last_checked_at - последняя успешная проверка (mark_territories_checked)
+            или загрузка снимка, если она позже
+        """
+        window = f'-{int(window_days)} days'
+        with self.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT t.id AS territory_id,
+                       COALESCE(c.recent_changes, 0) AS recent_changes,
+                       COALESCE(c.recent_alerts, 0) AS recent_alerts,
+                       c.avg_change,
+                       c.last_alert_at,
+                       i.last_fetch_at,
+                       CASE WHEN t.last_checked_at IS NULL OR i.last_fetch_at > t.last_checked_at
+                            THEN i.last_fetch_at ELSE t.last_checked_at END AS last_checked_at
+                FROM territories t
+                LEFT JOIN (
+                    SELECT territory_id,
+                           SUM(detected_at >= datetime('now', ?)) AS recent_changes,
+                           SUM(detected_at >= datetime('now', ?) AND change_percentage > ?) AS recent_alerts,
+                           AVG(CASE WHEN detected_at >= datetime('now', ?) THEN change_percentage END) AS avg_change,
+                           MAX(CASE WHEN change_percentage > ? THEN detected_at END) AS last_alert_at
+                    FROM changes
+                    GROUP BY territory_id
+                ) c ON c.territory_id = t.id
+                LEFT JOIN (
+                    SELECT territory_id, MAX(created_at) AS last_fetch_at
+                    FROM images
+                    GROUP BY territory_id
+                ) i ON i.territory_id = t.id
+            ''', (window, window, alert_threshold, window, alert_threshold))
+            return {row['territory_id']: dict(row) for row in cursor.fetchall()}
+
+    def mark_territories_checked(self, territory_ids: List[int]) -> None:
+        """Отметка успешной проверки территорий (даже если нового снимка нет)"""
+        with self.connection() as conn:
+            conn.executemany('UPDATE territories SET last_checked_at = CURRENT_TIMESTAMP WHERE id = ?',
+                             [(territory_id,) for territory_id in territory_ids])
+            conn.commit()
+
+    # ========== ПРОГОНЫ МОНИТОРИНГА ==========
+
+    def start_monitoring_run(self, resume_hours: float = 24) -> Tuple[int, bool]:
+        """
+        Продолжение незавершенного прогона или начало нового
+
+        Незавершенный прогон, начатый раньше resume_hours назад, не продолжается
+        (снимки в нем устарели) и помечается как abandoned.
+
+        Returns:
+            (run_id, продолжен_ли_прерванный_прогон)
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE monitoring_runs SET status = 'abandoned', finished_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND started_at < datetime('now', ?)
+            ''', (f'-{float(resume_hours)} hours',))
+
+            cursor.execute('''
+                SELECT id FROM monitoring_runs
+                WHERE status = 'running'
+                ORDER BY id DESC
+                LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if row:
+                conn.commit()
+                return row[0], True
+
+            cursor.execute("INSERT INTO monitoring_runs (status) VALUES ('running')")
+            conn.commit()
+            return cursor.lastrowid, False
+
+    def add_run_items(self, run_id: int, territory_ids: List[int]) -> None:
+        """Добавление территорий в прогон (уже добавленные сохраняют свой этап)"""
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO run_items (run_id, territory_id) VALUES (?, ?)
+            ''', [(run_id, territory_id) for territory_id in territory_ids])
+            conn.commit()
+
+    def get_run_items(self, run_id: int) -> Dict[int, Dict[str, Any]]:
+        """Этапы территорий прогона: {territory_id: запись run_items}"""
+        with self.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM run_items WHERE run_id = ?', (run_id,))
+            return {row['territory_id']: dict(row) for row in cursor.fetchall()}
+
+    def update_run_item(self, run_id: int, territory_id: int, stage: str, **fields) -> None:
+        """
+        Отметка этапа территории в прогоне
+
+        fields: image_path, capture_date, scene_id, render_key, image_id, message
+        """
+        allowed_fields = ['image_path', 'capture_date', 'scene_id', 'render_key', 'image_id', 'message']
+        updates = ["stage = ?", "updated_at = CURRENT_TIMESTAMP"]
+        values = [stage]
+        for field, value in fields.items():
+            if field in allowed_fields:
+                updates.append(f"{field} = ?")
+                values.append(value)
+        values.extend([run_id, territory_id])
+
+        with self.connection() as conn:
+            conn.execute(f"UPDATE run_items SET {', '.join(updates)} WHERE run_id = ? AND territory_id = ?",
+                         values)
+            conn.commit()
+
+    def mark_run_items(self, run_id: int, territory_ids: List[int], stage: str) -> None:
+        """Отметка этапа нескольких территорий прогона одной транзакцией"""
+        with self.connection() as conn:
+            conn.executemany('''
+                UPDATE run_items SET stage = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE run_id = ? AND territory_id = ?
+            ''', [(stage, run_id, territory_id) for territory_id in territory_ids])
+            conn.commit()
+
+    def finish_monitoring_run(self, run_id: int, status: str = 'completed') -> Dict[str, int]:
+        """
+        Завершение прогона
+
+        Returns:
+            Количество территорий прогона по этапам
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE monitoring_runs SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, run_id))
+            cursor.execute('''
+                SELECT stage, COUNT(*) FROM run_items
+                WHERE run_id = ?
+                GROUP BY stage
+            ''', (run_id,))
+            stages = {stage: count for stage, count in cursor.fetchall()}
+            conn.commit()
+            return stages
+
     def save_user_email(self, username: str, email_data: list) -> bool:
         """Сохранение email пользователя в базу данных"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
 
                 # Проверяем существование пользователя
@@ -438,7 +1123,7 @@ class Database:
     def get_user_emails(self, username: str) -> list:
         """Получение email пользователя из базы данных"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.cursor()
 
@@ -456,7 +1141,7 @@ class Database:
     def migrate_users(self):
         """Миграция пользователей из localStorage в базу данных"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connection() as conn:
                 cursor = conn.cursor()
 
                 # Проверяем, есть ли уже пользователи
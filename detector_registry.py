@@ -0,0 +1,123 @@
+"""
+Реестр детекторов изменений и тяжелых компонентов с ленивой загрузкой
+
+Модули детекторов тянут за собой OpenCV, scipy и scikit-image, поэтому
+импортируются только при первом обращении к детектору, а не при запуске.
+"""
+
+import threading
+from typing import Callable, Dict, Any, List
+
+# Детектор - функция (путь_до, путь_после) -> словарь результата
+Detector = Callable[[str, str], Dict[str, Any]]
+
+_NOT_LOADED = object()
+
+
+class DetectorRegistry:
+    """Имя -> фабрика; объект создается один раз при первом get()"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._descriptions: Dict[str, str] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any], description: str = '') -> None:
+        """Регистрация (или замена) фабрики; ранее созданный объект сбрасывается"""
+        with self._lock:
+            self._factories[name] = factory
+            self._descriptions[name] = description
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """
+        Объект по имени (импорт модуля и создание при первом обращении)
+
+        Raises:
+            KeyError: если имя не зарегистрировано
+        """
+        instance = self._instances.get(name, _NOT_LOADED)
+        if instance is not _NOT_LOADED:
+            return instance
+
+        with self._lock:
+            instance = self._instances.get(name, _NOT_LOADED)
+            if instance is _NOT_LOADED:
+                if name not in self._factories:
+                    raise KeyError(f"Неизвестный детектор: {name}")
+                instance = self._factories[name]()
+                self._instances[name] = instance
+            return instance
+
+    def detect(self, name: str, before_path: str, after_path: str) -> Dict[str, Any]:
+        """Сравнение двух снимков детектором name"""
+        return self.get(name)(before_path, after_path)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def names(self) -> List[str]:
+        return list(self._factories)
+
+    def describe(self) -> Dict[str, Dict[str, Any]]:
+        """Описание зарегистрированных объектов (для /api/system/info)"""
+        return {name: {'description': self._descriptions.get(name, ''), 'loaded': self.is_loaded(name)}
+                for name in self._factories}
+
+
+# ========== ФАБРИКИ ПО УМОЛЧАНИЮ ==========
+
+def _improved_detector() -> Detector:
+    from improved_change_detector import detect_changes_improved
+    return detect_changes_improved
+
+
+def _ultimate_detector() -> Detector:
+    from ultimate_detector import UltimateDetector
+    return UltimateDetector(debug=False).detect_with_intelligence
+
+
+def _forest_detector() -> Detector:
+    from super_forest_detector import SuperForestDetector
+    return SuperForestDetector().detect_changes_aggressive
+
+
+def _gee_detector() -> Detector:
+    from gee_client import GEEClient
+    return GEEClient().compare_images_advanced
+
+
+def _grid_creator():
+    from grid_creator import GridCreator
+    return GridCreator(grid_size=32)
+
+
+def _grid_analyzer():
+    from grid_analyzer import GridAnalyzer
+    return GridAnalyzer()
+
+
+def _notification_manager():
+    """NotificationManager или None, если email уведомления отключены"""
+    from notification import NotificationManager, EmailConfig
+    email_config = EmailConfig()
+    if not email_config.EMAIL_ENABLED:
+        return None
+    return NotificationManager(email_config)
+
+
+def create_default_registry() -> DetectorRegistry:
+    detectors = DetectorRegistry()
+    detectors.register('improved', _improved_detector, 'Улучшенный детектор (фильтрация сезонных изменений)')
+    detectors.register('ultimate', _ultimate_detector, 'Ультимативный детектор (тип территории)')
+    detectors.register('forest', _forest_detector, 'Супер-агрессивный детектор вырубок')
+    detectors.register('gee', _gee_detector, 'Сравнение GEEClient.compare_images_advanced')
+    detectors.register('grid_creator', _grid_creator, 'Создатель сеток')
+    detectors.register('grid_analyzer', _grid_analyzer, 'Анализатор сетки')
+    detectors.register('notifications', _notification_manager, 'Email уведомления')
+    return detectors
+
+
+# Общий реестр процесса
+registry = create_default_registry()
@@ -0,0 +1,107 @@
+"""
+Объединение загрузок близко расположенных территорий
+
+Окна соседних территорий (1.5x1.5 км) сильно перекрываются, поэтому
+территории группируются по расстоянию, для группы загружается одна
+охватывающая область на общей сетке пикселей, а окно каждой территории
+вырезается из нее локально. Количество запросов к GEE зависит от числа
+различных участков, а не от числа территорий.
+"""
+
+import math
+import os
+from typing import Dict, Any, List, Tuple
+
+# Наибольшая сторона охватывающей области группы в метрах
+COALESCE_MAX_SPAN_M = float(os.getenv('GEE_COALESCE_MAX_SPAN_M', '3000'))
+
+METERS_PER_DEGREE = 111320.0
+
+
+def window_bounds(latitude: float, longitude: float,
+                  buffer_m: float = 750.0) -> Tuple[float, float, float, float]:
+    """Окно территории в градусах: (min_lon, min_lat, max_lon, max_lat)"""
+    dlat = buffer_m / METERS_PER_DEGREE
+    dlon = buffer_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    return longitude - dlon, latitude - dlat, longitude + dlon, latitude + dlat
+
+
+def _span_m(territories: List[Dict[str, Any]], buffer_m: float) -> float:
+    """Наибольшая сторона области, охватывающей окна всех территорий"""
+    lats = [t['latitude'] for t in territories]
+    lons = [t['longitude'] for t in territories]
+    cos_lat = max(math.cos(math.radians(sum(lats) / len(lats))), 1e-6)
+    return max((max(lats) - min(lats)) * METERS_PER_DEGREE,
+               (max(lons) - min(lons)) * METERS_PER_DEGREE * cos_lat) + 2 * buffer_m
+
+
+def cluster_territories(territories: List[Dict[str, Any]], buffer_m: float = 750.0,
+                        max_span_m: float = COALESCE_MAX_SPAN_M) -> List[List[Dict[str, Any]]]:
+    """
+    Группировка территорий, окна которых помещаются в общую область
+
+    Жадно: территория добавляется в первую группу, охват которой с ней
+    не превышает max_span_m, иначе образует новую группу.
+    """
+    clusters: List[List[Dict[str, Any]]] = []
+    for territory in sorted(territories, key=lambda t: (t['latitude'], t['longitude'])):
+        for cluster in clusters:
+            if _span_m(cluster + [territory], buffer_m) <= max_span_m:
+                cluster.append(territory)
+                break
+        else:
+            clusters.append([territory])
+    return clusters
+
+
+def plan_region(territories: List[Dict[str, Any]], image_size: int,
+                buffer_m: float = 750.0) -> Dict[str, Any]:
+    """
+    Общая сетка пикселей для группы
+
+    Размер пикселя тот же, что при отдельной загрузке окна (2 * buffer_m / image_size),
+    поэтому вырезанное окно имеет размер image_size x image_size.
+
+    Returns:
+        {'bounds', 'width', 'height', 'geotransform', 'center',
+         'crops': {territory_id: (row, col)}}
+    """
+    lats = [t['latitude'] for t in territories]
+    center_lat = sum(lats) / len(lats)
+    center_lon = sum(t['longitude'] for t in territories) / len(territories)
+
+    min_lon, min_lat, max_lon, max_lat = window_bounds(center_lat, center_lon, buffer_m)
+    dx = (max_lon - min_lon) / image_size
+    dy = (max_lat - min_lat) / image_size
+
+    windows = {t['id']: window_bounds(t['latitude'], t['longitude'], buffer_m) for t in territories}
+    origin_lon = min(window[0] for window in windows.values())
+    origin_lat = max(window[3] for window in windows.values())
+
+    # Смещения окон округляются до целого пикселя общей сетки
+    crops = {territory_id: (int(round((origin_lat - window[3]) / dy)),
+                            int(round((window[0] - origin_lon) / dx)))
+             for territory_id, window in windows.items()}
+    width = max(col for _, col in crops.values()) + image_size
+    height = max(row for row, _ in crops.values()) + image_size
+
+    return {
+        'bounds': (origin_lon, origin_lat - height * dy, origin_lon + width * dx, origin_lat),
+        'width': width,
+        'height': height,
+        # Порядок GDAL: (x0, dx, 0, y0, 0, dy)
+        'geotransform': [origin_lon, dx, 0.0, origin_lat, 0.0, -dy],
+        'center': (center_lat, center_lon),
+        'crops': crops
+    }
+
+
+def crop_geotransform(plan: Dict[str, Any], row: int, col: int) -> List[float]:
+    """Геопривязка окна, вырезанного из общей области со смещением (row, col)"""
+    x0, dx, _, y0, _, dy = plan['geotransform']
+    return [x0 + col * dx, dx, 0.0, y0 + row * dy, 0.0, dy]
+
+
+def crop_bounds(plan: Dict[str, Any], row: int, col: int, size: int) -> List[float]:
+    x0, dx, _, y0, _, dy = crop_geotransform(plan, row, col)
+    return [x0, y0 + size * dy, x0 + size * dx, y0]
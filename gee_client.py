@@ -7,13 +7,25 @@ import os
 import sys
 import logging
 import hashlib
+import importlib
+import io
+import math
 import tempfile
+import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 import numpy as np
 
+from imagery_backend import ImageryBackend, ImageryBackendError, EarthEngineBackend, backend_from_env
+from rate_limiter import RateLimiter, get_rate_limiter
+from raster_store import RasterStore, RGB_BANDS, DEFAULT_STRETCH, FETCH_PROFILES, load_bgr, load_raster, _stretch_lut
+from raster_index import RasterIndex, crop_raster
+from scene_catalog import SceneCatalog, CATALOG_ENABLED, search_window
+from fetch_coalescer import cluster_territories, plan_region, crop_geotransform, crop_bounds
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -21,13 +33,87 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Лимит ответа computePixels (~48 МБ) с запасом
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+MAX_TILE_SIZE = 2048
+# Параллельные запросы тайлов (ограничение GEE на одновременные запросы)
+TILE_WORKERS = 4
+
+# Проект Google Cloud с доступом к Earth Engine
+DEFAULT_PROJECT_ID = "careful-journey-480220-j1"
+# Офлайн режим: GEE не подключается, доступны только сохраненные снимки
+OFFLINE_MODE = os.getenv('GEE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# Формат хранения снимков: 'png' или 'jpg'
+IMAGE_FORMAT = os.getenv('GEE_IMAGE_FORMAT', 'png')
+# Форматы файлов кэша (снимки, сохраненные при другом GEE_IMAGE_FORMAT, тоже находятся и удаляются)
+CACHE_FORMATS = ('png', 'jpg')
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Полная двумерная свертка двух малых ядер"""
+    result = np.zeros((a.shape[0] + b.shape[0] - 1, a.shape[1] + b.shape[1] - 1))
+    for i in range(b.shape[0]):
+        for j in range(b.shape[1]):
+            result[i:i + a.shape[0], j:j + a.shape[1]] += a * b[i, j]
+    return result
+
+
+def _enhance_kernel() -> list:
+    """
+    Ядро 5x5, эквивалентное Sharpness(1.3) -> GaussianBlur(0.5) -> Sharpness(1.1)
+
+    Sharpness(k) в PIL: k * изображение + (1 - k) * SMOOTH.
+    """
+    identity = np.zeros((3, 3))
+    identity[1, 1] = 1.0
+    smooth = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float64) / 13.0
+
+    gauss_1d = np.exp(-np.arange(-1, 2) ** 2 / (2 * 0.5 ** 2))
+    gauss = np.outer(gauss_1d, gauss_1d)
+    gauss /= gauss.sum()
+
+    kernel = _convolve(_convolve(1.3 * identity - 0.3 * smooth, gauss), 1.1 * identity - 0.1 * smooth)
+    # Внешнее кольцо 7x7 пренебрежимо мало
+    kernel = kernel[1:-1, 1:-1]
+    kernel /= kernel.sum()
+    return [float(value) for value in kernel.ravel()]
+
+
+ENHANCE_KERNEL = _enhance_kernel()
+
+
+def _brightness_contrast_lut(histogram: list, brightness: float, contrast: float) -> list:
+    """
+    Общая таблица для ImageEnhance.Brightness и затем ImageEnhance.Contrast
+
+    Контраст в PIL считается от средней яркости (L) уже осветленного
+    изображения; она вычисляется по гистограммам каналов без второго прохода.
+    """
+    bright = [min(255, int(value * brightness + 0.5)) for value in range(256)]
+
+    means = []
+    for channel in range(3):
+        counts = histogram[channel * 256:(channel + 1) * 256]
+        total = sum(counts) or 1
+        means.append(sum(bright[value] * count for value, count in enumerate(counts)) / total)
+    mean = int(0.299 * means[0] + 0.587 * means[1] + 0.114 * means[2] + 0.5)
+
+    lut = [max(0, min(255, int(mean + (value - mean) * contrast + 0.5))) for value in bright]
+    return lut * 3
+
 
 class GEEClient:
     """Клиент для работы с Google Earth Engine"""
 
     def __init__(self, credentials_path: str = 'credentials.json',
                  cache_dir: str = 'satellite_images',
-                 max_cache_size: int = 100):
+                 max_cache_size: int = 100,
+                 database=None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 backend: Optional[ImageryBackend] = None,
+                 image_format: Optional[str] = None,
+                 offline: Optional[bool] = None):
         """
         Инициализация клиента GEE
 
@@ -35,129 +121,142 @@ class GEEClient:
             credentials_path: Путь к файлу с учетными данными GEE
             cache_dir: Директория для кэширования изображений
             max_cache_size: Максимальное количество изображений в кэше
+            database: База данных для повторного использования уже загруженных сцен и каталога сцен
+            rate_limiter: Ограничитель запросов (по умолчанию общий для процесса)
+            backend: Источник снимков (по умолчанию Earth Engine, GEE_BACKEND=local - локальный)
+            image_format: Формат сохраняемых снимков 'png' или 'jpg' (по умолчанию GEE_IMAGE_FORMAT)
+            offline: Без подключения к GEE - работа только с сохраненными снимками (по умолчанию GEE_OFFLINE)
         """
-        # Импортируем обязательные модули
-        self._import_required_modules()
-
         self.credentials_path = credentials_path
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.max_cache_size = max_cache_size
+        self.image_format = (image_format or IMAGE_FORMAT).lower().replace('jpeg', 'jpg')
         self.request_count = 0
         self._cache_metadata = {}
-
-        # Инициализация GEE
-        self._init_gee()
-
-    def _import_required_modules(self):
-        """Импорт обязательных модулей"""
-        try:
-            import ee
-            self.ee = ee
-        except ImportError:
-            print("Модуль 'earthengine-api' не установлен!")
-            print("Установите: pip install earthengine-api")
-            sys.exit(1)
-
-        try:
-            from PIL import Image, ImageEnhance, ImageFilter
-            self.Image = Image
-            self.ImageEnhance = ImageEnhance
-            self.ImageFilter = ImageFilter
-        except ImportError:
-            print("Модуль 'Pillow' не установлен!")
-            print("Установите: pip install pillow")
-            sys.exit(1)
-
-        try:
-            import cv2
-            self.cv2 = cv2
-        except ImportError:
-            print("Модуль 'opencv-python' не установлен!")
-            print("Установите: pip install opencv-python")
-            self.cv2 = None
-
-        try:
-            import requests
-            self.requests = requests
-        except ImportError:
-            print("Модуль 'requests' не установлен!")
-            print("Установите: pip install requests")
-            sys.exit(1)
+        self.raster_store = RasterStore(str(self.cache_dir / 'raw'))
+        self.database = database
+        # Загруженные растры по сцене и границам: покрытые области вырезаются локально
+        self.raster_index = RasterIndex(str(database.db_path)) if database is not None else None
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        # Сведения о последней загрузке (отдельно для каждого потока)
+        self._fetch_info = threading.local()
+
+        # Earth Engine подключается при первой загрузке снимка, а не при запуске:
+        # просмотр снимков, сравнение и обслуживание БД работают без сети
+        self.offline = OFFLINE_MODE if offline is None else offline
+        self._backend = backend or backend_from_env()
+        self._backend_lock = threading.Lock()
+        self._modules: Dict[str, Any] = {}
+
+        # Локальный каталог сцен: поиск снимка без запроса к GEE
+        self.catalog = None
+        if database is not None and CATALOG_ENABLED:
+            self.catalog = SceneCatalog(str(database.db_path), lambda: self.backend, self.rate_limiter)
+
+        if self._backend is not None:
+            print(f"Источник снимков: {self._backend.name}")
+
+    def _module(self, name: str, package: str, required: bool = False):
+        """Ленивый импорт модуля (None, если необязательный модуль не установлен)"""
+        if name not in self._modules:
+            try:
+                self._modules[name] = importlib.import_module(name)
+            except ImportError:
+                if required:
+                    raise ImageryBackendError(f"Модуль '{package}' не установлен! "
+                                              f"Установите: pip install {package}")
+                print(f"Модуль '{package}' не установлен!")
+                print(f"Установите: pip install {package}")
+                self._modules[name] = None
+        return self._modules[name]
+
+    @property
+    def ee(self):
+        return self._module('ee', 'earthengine-api', required=True)
+
+    @property
+    def requests(self):
+        return self._module('requests', 'requests', required=True)
+
+    @property
+    def cv2(self):
+        return self._module('cv2', 'opencv-python')
+
+    @property
+    def Image(self):
+        return self._module('PIL.Image', 'pillow', required=True)
+
+    @property
+    def ImageEnhance(self):
+        return self._module('PIL.ImageEnhance', 'pillow', required=True)
+
+    @property
+    def ImageFilter(self):
+        return self._module('PIL.ImageFilter', 'pillow', required=True)
+
+    @property
+    def backend(self) -> ImageryBackend:
+        """Источник снимков; Earth Engine инициализируется при первом обращении"""
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    if self.offline:
+                        raise ImageryBackendError("Офлайн режим: загрузка снимков отключена (GEE_OFFLINE)")
+                    self._init_gee()
+                    self._backend = EarthEngineBackend(self.ee, self.requests)
+        return self._backend
+
+    @property
+    def is_connected(self) -> bool:
+        """Подключен ли источник снимков (без попытки подключения)"""
+        return self._backend is not None
+
+    def _backend_errors(self) -> Tuple[type, ...]:
+        """Исключения источника снимков, не вызывая его инициализацию"""
+        if self._backend is None:
+            return (ImageryBackendError,)
+        return self._backend.errors
 
     def _init_gee(self) -> None:
-        """Инициализация Google Earth Engine"""
-        try:
-            print("\n" + "=" * 60)
-            print("ИНИЦИАЛИЗАЦИЯ GOOGLE EARTH ENGINE")
-            print("=" * 60)
-
-            # Твой ID проекта
-            PROJECT_ID = "careful-journey-480220-j1"
+        """
+        Инициализация Google Earth Engine
 
-            print(f"Проект: {PROJECT_ID}")
+        Raises:
+            ImageryBackendError: если инициализация не удалась
+        """
+        ee = self.ee
+        project_id = os.getenv('GEE_PROJECT_ID', DEFAULT_PROJECT_ID)
+        logger.info(f"Инициализация Google Earth Engine (проект {project_id})")
 
-            # Пробуем инициализацию с использованием credentials.json
+        try:
             if os.path.exists(self.credentials_path):
-                print(f"\nНайден файл {self.credentials_path}")
-                print("Инициализируем GEE...")
-
                 try:
                     # Инициализация с проектом
-                    self.ee.Initialize(project=PROJECT_ID)
-                    print(f"GEE успешно инициализирован!")
-                    return
-                except self.ee.EEException as e:
-                    print(f"Ошибка GEE: {e}")
-
+                    ee.Initialize(project=project_id)
+                except ee.EEException as e:
                     # Если ошибка связана с проектом, пробуем без указания проекта
-                    if "project" in str(e).lower():
-                        print("Пробуем инициализацию без указания проекта...")
-                        try:
-                            self.ee.Initialize()
-                            print("GEE инициализирован без указания проекта")
-                            return
-                        except Exception as e2:
-                            print(f"Ошибка: {e2}")
-
-                    raise e
+                    if "project" not in str(e).lower():
+                        raise
+                    logger.warning(f"Ошибка GEE: {e}; инициализация без указания проекта")
+                    ee.Initialize()
+            elif sys.stdin is not None and sys.stdin.isatty():
+                # Авторизация через браузер возможна только в интерактивном режиме
+                print(f"Файл {self.credentials_path} не найден, авторизация через браузер...")
+                ee.Authenticate()
+                ee.Initialize(project=project_id)
             else:
-                print(f"\nФайл {self.credentials_path} не найден!")
-                print("Создай сервисный аккаунт в Google Cloud Console")
-                print("и сохрани credentials.json в папку проекта")
-
-                # Пробуем авторизацию через браузер
-                print("\nПробуем авторизацию через браузер...")
-                try:
-                    self.ee.Authenticate()
-                    self.ee.Initialize(project=PROJECT_ID)
-                    print("Авторизация через браузер успешна!")
-                    return
-                except Exception as e:
-                    print(f"Ошибка: {e}")
-
-            # Если ничего не сработало
-            print("\n" + "=" * 60)
-            print("НЕ УДАЛОСЬ ИНИЦИАЛИЗИРОВАТЬ GEE")
-            print("=" * 60)
-
-            print("\nЧТО СДЕЛАТЬ:")
-            print("1. Перейди: https://code.earthengine.google.com/")
-            print("2. Нажми 'Sign Up' или 'Accept' для активации Earth Engine")
-            print("3. Обычно это занимает 1-2 дня на одобрение Google")
-            print("4. ИЛИ создай сервисный аккаунт в Google Cloud Console")
-            print("5. Положи файл credentials.json в папку проекта")
-
-            print("\nПрограмма завершена. Настрой GEE и попробуй снова.")
-            sys.exit(0)
-
+                raise ImageryBackendError(
+                    f"Файл {self.credentials_path} не найден. Создай сервисный аккаунт в "
+                    f"Google Cloud Console и сохрани credentials.json в папку проекта")
+        except ImageryBackendError:
+            raise
         except Exception as e:
-            print(f"\nКритическая ошибка инициализации GEE: {e}")
-            print("\nРешение:")
-            print("1. Проверь интернет-соединение")
-            print("2. Убедись что Earth Engine API включен для твоего проекта")
-            print("3. Убедись что у сервисного аккаунта есть права Editor/Owner")
-            sys.exit(1)
+            raise ImageryBackendError(
+                f"Не удалось инициализировать GEE: {e}. Проверь интернет-соединение и то, "
+                f"что Earth Engine API включен для проекта {project_id}") from e
+
+        logger.info("GEE успешно инициализирован")
 
     @staticmethod
     def _get_cache_key(latitude: float, longitude: float, image_date: str) -> str:
@@ -165,15 +264,27 @@ class GEEClient:
         key_str = f"{latitude:.6f}_{longitude:.6f}_{image_date}"
         return hashlib.md5(key_str.encode()).hexdigest()
 
-    def _get_cached_image(self, latitude: float, longitude: float, image_date: str) -> Optional[str]:
+    def _cache_path(self, cache_key: str, image_size: int, image_format: Optional[str] = None) -> Path:
+        """Файл кэша снимка: {ключ}_{размер}.{формат}"""
+        return self.cache_dir / f"{cache_key}_{image_size}.{image_format or self.image_format}"
+
+    def _cached_files(self, cache_key: str) -> List[Path]:
+        """Все файлы кэша с этим ключом (любого размера и формата)"""
+        return [path for image_format in CACHE_FORMATS
+                for path in self.cache_dir.glob(f"{cache_key}_*.{image_format}")]
+
+    def _get_cached_image(self, latitude: float, longitude: float, image_date: str,
+                          image_size: int) -> Optional[str]:
         """Получение изображения из кэша если оно существует"""
         cache_key = self._get_cache_key(latitude, longitude, image_date)
-        image_path = self.cache_dir / f"{cache_key}.png"
-
-        if image_path.exists():
-            self._cache_metadata[cache_key] = datetime.now()
-            logger.debug(f"Изображение найдено в кэше: {image_path}")
-            return str(image_path)
+        # Сначала текущий формат хранения, затем остальные
+        formats = [self.image_format] + [f for f in CACHE_FORMATS if f != self.image_format]
+        for image_format in formats:
+            image_path = self._cache_path(cache_key, image_size, image_format)
+            if image_path.exists():
+                self._cache_metadata[cache_key] = datetime.now()
+                logger.debug(f"Изображение найдено в кэше: {image_path}")
+                return str(image_path)
 
         return None
 
@@ -202,8 +313,7 @@ class GEEClient:
             to_remove = max(1, int(len(sorted_items) * 0.2))
 
             for cache_key, _ in sorted_items[:to_remove]:
-                image_path = self.cache_dir / f"{cache_key}.png"
-                if image_path.exists():
+                for image_path in self._cached_files(cache_key):
                     try:
                         image_path.unlink()
                         logger.debug(f"Удален старый файл кэша: {image_path}")
@@ -216,44 +326,77 @@ class GEEClient:
         except Exception as clean_error:
             logger.error(f"Ошибка при очистке кэша: {clean_error}")
 
-    def _enhance_image(self, image_path: str) -> str:
-        """Улучшение изображения для лучшей детекции изменений"""
-        try:
-            # Открываем изображение
-            img = self.Image.open(image_path)
-
-            # 1. Увеличиваем яркость (сделает детали видимыми)
-            enhancer = self.ImageEnhance.Brightness(img)
-            img = enhancer.enhance(1.4)  # +40% яркости
+    def _enhance_image(self, img):
+        """
+        Улучшение изображения для лучшей детекции изменений (в памяти)
 
-            # 2. Увеличиваем контраст (улучшит границы объектов)
-            enhancer = self.ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.4)  # +40% контраста
+        Прежние пять проходов PIL сведены к двум:
+            1. яркость +40% и контраст +40% - одна таблица LUT;
+            2. резкость +30%, размытие 0.5 и резкость +10% - одно ядро 5x5.
+        """
+        try:
+            alpha = img.getchannel('A') if img.mode in ('RGBA', 'LA') else None
+            img = img.convert('RGB')
 
-            # 3. Легкое увеличение резкости (улучшит детали)
-            enhancer = self.ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.3)  # +30% резкости
+            img = img.point(_brightness_contrast_lut(img.histogram(), 1.4, 1.4))
+            img = img.filter(self.ImageFilter.Kernel((5, 5), ENHANCE_KERNEL, scale=1))
 
-            # 4. Легкое размытие для уменьшения пиксельности
-            img = img.filter(self.ImageFilter.GaussianBlur(radius=0.5))
+            if alpha is not None:
+                img.putalpha(alpha)
+            return img
 
-            # 5. Снова легкая резкость для компенсации
-            enhancer = self.ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(1.1)  # +10% резкости
+        except Exception as e:
+            logger.error(f"Ошибка улучшения изображения: {e}")
+            return img
+
+    def _save_image(self, img, filepath: Path) -> None:
+        """Кодирование в формат хранения (атомарно, через временный файл)"""
+        tmp_path = filepath.with_name(filepath.name + '.tmp')
+        if self.image_format == 'jpg':
+            img.convert('RGB').save(tmp_path, 'JPEG', quality=95)
+        else:
+            img.save(tmp_path, 'PNG')
+        os.replace(tmp_path, filepath)
+
+    def last_fetch_info(self) -> Dict[str, Any]:
+        """
+        Сведения о последней загрузке в текущем потоке
 
-            # Сохраняем с высоким качеством
-            img.save(image_path, 'PNG', optimize=True, quality=95)
+        Returns:
+            {'scene_id', 'render_key', 'reused', 'image_id'};
+            reused=True - сцена уже загружена ранее, файл взят из базы
+        """
+        return dict(getattr(self._fetch_info, 'data', {}))
 
-            return image_path
+    def _set_fetch_info(self, **info) -> None:
+        self._fetch_info.data = info
 
-        except Exception as e:
-            logger.error(f"Ошибка улучшения изображения: {e}")
-            return image_path
+    @staticmethod
+    def _render_key(latitude: float, longitude: float, image_size: int,
+                    fetch_mode: str, profile: str = 'rgb', buffer_m: float = 750.0) -> str:
+        """Параметры загрузки, влияющие на содержимое файла"""
+        bands = profile if fetch_mode == 'npy' else 'rgb'
+        return f"{fetch_mode}:{bands}:{image_size}:{int(buffer_m)}:{latitude:.5f},{longitude:.5f}"
+
+    def _find_downloaded_scene(self, scene_id: Optional[str], render_key: str) -> Optional[Dict[str, Any]]:
+        """Ранее сохраненное изображение той же сцены, если файл еще существует"""
+        if self.database is None or not scene_id:
+            return None
+        try:
+            stored = self.database.find_image_by_scene(scene_id, render_key)
+        except Exception as error:
+            logger.warning(f"Не удалось проверить сцену {scene_id}: {error}")
+            return None
+        if stored and os.path.exists(stored['image_path']):
+            return stored
+        return None
 
     def get_satellite_image(self, latitude: float, longitude: float,
                             date: Optional[str] = None,
                             cloud_cover_threshold: float = 30.0,
-                            image_size: int = 2048) -> Tuple[bool, Optional[str], Optional[str], str]:
+                            image_size: int = 2048,
+                            fetch_mode: str = 'png',
+                            profile: str = 'rgb') -> Tuple[bool, Optional[str], Optional[str], str]:
         """
         Получение спутникового изображения с ОПТИМАЛЬНЫМИ НАСТРОЙКАМИ
 
@@ -263,10 +406,13 @@ class GEEClient:
             date: Дата (YYYY-MM-DD) или None для текущей
             cloud_cover_threshold: Максимальная облачность в %
             image_size: Размер изображения (2048 = оптимально для детекции)
+            fetch_mode: 'png' - миниатюра getThumbURL, 'npy' - сырые каналы uint16 через computePixels
+            profile: Набор каналов для режима 'npy': 'rgb' или 'multispectral' (+ B8, B11, B12)
 
         Returns:
             (успех, путь_к_файлу, дата_изображения, сообщение)
         """
+        self._set_fetch_info()
         try:
             # Оптимальный размер для детекции изменений
             if image_size > 2048:
@@ -284,113 +430,529 @@ class GEEClient:
             print(f"Размер изображения: {image_size}x{image_size} пикселей")
             print(f"Область: {image_size * 10 / 1000:.1f}x{image_size * 10 / 1000:.1f} км")
 
-            # Проверяем кэш
-            cached_image = self._get_cached_image(latitude, longitude, actual_date)
-            if cached_image:
-                print("Используем изображение из кэша")
-                return True, cached_image, actual_date, "Изображение из кэша"
+            # Кэш проверяется после выбора сцены: иначе last_fetch_info() не знает
+            # scene_id, и повторная загрузка записывает второй снимок той же сцены
+            image, image_date, cloud_cover, scene_id, error = self._find_best_image(
+                latitude, longitude, actual_date, cloud_cover_threshold)
+            if image is None:
+                return False, None, None, error
 
-            # Создаем точку интереса
-            point = self.ee.Geometry.Point([longitude, latitude])
+            return self._download_scene(image, latitude, longitude, image_size, fetch_mode, profile)
 
-            # Определяем диапазон дат
-            try:
-                target_date = datetime.strptime(actual_date, '%Y-%m-%d')
-            except ValueError as date_error:
-                return False, None, None, f"Некорректный формат даты: {date_error}"
+        except self._backend_errors() as gee_error:
+            return False, None, None, f"Ошибка GEE: {str(gee_error)}"
+        except Exception as error:
+            return False, None, None, f"Внутренняя ошибка: {str(error)}"
 
-            # Ищем за последние 60 дней
-            start_date = (target_date - timedelta(days=60)).strftime('%Y-%m-%d')
-            end_date = (target_date + timedelta(days=1)).strftime('%Y-%m-%d')
+    def _download_scene(self, image: Dict[str, Any], latitude: float, longitude: float,
+                        image_size: int, fetch_mode: str = 'png',
+                        profile: str = 'rgb') -> Tuple[bool, Optional[str], Optional[str], str]:
+        """Загрузка выбранной сцены (если она не была загружена ранее)"""
+        scene_id, image_date, cloud_cover = image['scene_id'], image['date'], image['cloud_cover']
+
+        # Та же сцена с теми же параметрами уже загружена - не скачиваем повторно
+        render_key = self._render_key(latitude, longitude, image_size, fetch_mode, profile)
+        self._set_fetch_info(scene_id=scene_id, render_key=render_key, reused=False)
+        stored = self._find_downloaded_scene(scene_id, render_key)
+        if stored:
+            print(f"Сцена {scene_id} не изменилась, используем сохраненное изображение")
+            self._set_fetch_info(scene_id=scene_id, render_key=render_key, reused=True,
+                                 image_id=stored['id'])
+            return True, stored['image_path'], stored['capture_date'], \
+                f"Снимок не изменился (сцена {scene_id})"
+
+        if fetch_mode == 'npy':
+            return self._fetch_pixels(image, latitude, longitude, image_date, cloud_cover,
+                                      image_size, profile)
+
+        cached_image = self._get_cached_image(latitude, longitude, image_date, image_size)
+        if cached_image:
+            # Снимок этой даты уже скачан (например, прерванной дозагрузкой истории)
+            print("Используем ранее сохраненный снимок")
+            return True, cached_image, image_date, "Изображение из кэша"
+
+        filepath = self._cache_path(self._get_cache_key(latitude, longitude, image_date), image_size)
+
+        # ОПТИМАЛЬНЫЕ НАСТРОЙКИ ДЛЯ ДЕТЕКЦИИ ИЗМЕНЕНИЙ:
+        # Меньшая область (750 метров = 1.5x1.5 км) + лучшие настройки контраста
+        region = self._region_bounds(latitude, longitude)
+
+        covered = self._crop_from_index(image, region, image_size, RGB_BANDS)
+        if covered is not None:
+            # Та же растяжка 500-3000, что у getThumbURL
+            print("Область покрыта сохраненным растром сцены, скачивание не требуется")
+            pil_image = self.Image.fromarray(_stretch_lut(DEFAULT_STRETCH)[covered[0]], 'RGB')
+        else:
+            print(f"Скачиваем изображение...")
+            content = self.rate_limiter.download(self.backend.thumbnail, image, region, image_size)
+            pil_image = self.Image.open(io.BytesIO(content))
+
+        print("Улучшаем изображение для детекции изменений...")
+        pil_image = self._enhance_image(pil_image)
+
+        # Единственное кодирование - сразу в формат хранения
+        print(f"Сохраняем изображение...")
+        self._save_image(pil_image, filepath)
+
+        width, height = pil_image.size
+        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+
+        # Расчёт детализации
+        area_km = (width * 10 / 1000) * (height * 10 / 1000)
+        print(f"\nИЗОБРАЖЕНИЕ СОХРАНЕНО!")
+        print(f"   Размер: {width}x{height} пикселей")
+        print(f"   Область: {area_km:.1f} км²")
+        print(f"   Детализация: {10.0 * 1000 / image_size:.1f} метров на пиксель")
+        print(f"   Размер файла: {file_size_mb:.2f} MB")
+        print(f"   Дата съемки: {image_date}")
+        print(f"   Облачность: {cloud_cover}%")
+        print(f"   Путь: {filepath}")
+
+        # Сохраняем в кэш
+        self._save_to_cache(latitude, longitude, image_date, str(filepath))
+        self.request_count += 1
+
+        return True, str(filepath), image_date, f"Успешно ({width}x{height}, {area_km:.1f}км²)"
+
+    def fetch_scene(self, latitude: float, longitude: float, entry: Dict[str, Any],
+                    image_size: int = 2048, fetch_mode: str = 'png',
+                    profile: str = 'rgb') -> Tuple[bool, Optional[str], Optional[str], str]:
+        """
+        Загрузка конкретной сцены из каталога без поиска по коллекции
 
-            print(f"Поиск изображений с {start_date} по {end_date}")
+        Args:
+            entry: Запись каталога сцен ({'scene_id', 'date', 'cloud_cover', ...})
 
-            # Загружаем коллекцию Sentinel-2
-            collection = (self.ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                          .filterBounds(point)
-                          .filterDate(start_date, end_date)
-                          .filter(self.ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover_threshold))
-                          .sort('CLOUDY_PIXEL_PERCENTAGE'))
+        Returns:
+            (успех, путь_к_файлу, дата_изображения, сообщение)
+        """
+        self._set_fetch_info()
+        try:
+            scene = self.backend.open_scene(entry)
+            return self._download_scene(scene, latitude, longitude, min(image_size, 2048), fetch_mode, profile)
+        except self._backend_errors() as gee_error:
+            return False, None, None, f"Ошибка GEE: {str(gee_error)}"
+        except Exception as error:
+            return False, None, None, f"Внутренняя ошибка: {str(error)}"
 
-            # Проверяем наличие изображений
-            collection_size = collection.size().getInfo()
-            print(f"Найдено изображений: {collection_size}")
+    def get_coalesced_images(self, territories: List[Dict[str, Any]],
+                             date: Optional[str] = None,
+                             cloud_cover_threshold: float = 30.0,
+                             image_size: int = 2048,
+                             fetch_mode: str = 'png',
+                             profile: str = 'rgb') -> Dict[int, Tuple[bool, Optional[str], Optional[str], str, Dict[str, Any]]]:
+        """
+        Снимки нескольких территорий с общими загрузками для близких территорий
+
+        Для группы выбирается одна сцена (по центру группы) и загружается одна
+        охватывающая область; окно каждой территории вырезается локально,
+        смещение записывается в метаданные растра ('crop').
 
-            if collection_size == 0:
-                return False, None, None, f"Нет изображений с облачностью < {cloud_cover_threshold}%"
+        Returns:
+            {id_территории: (успех, путь_к_файлу, дата_изображения, сообщение, сведения_о_загрузке)}
+        """
+        image_size = min(image_size, 2048)
+        results = {}
+        clusters = cluster_territories(territories)
+        print(f"\nТерриторий: {len(territories)}, групп для загрузки: {len(clusters)}")
+
+        for cluster in clusters:
+            if len(cluster) == 1:
+                territory = cluster[0]
+                result = self.get_satellite_image(territory['latitude'], territory['longitude'], date,
+                                                  cloud_cover_threshold, image_size, fetch_mode, profile)
+                results[territory['id']] = result + (self.last_fetch_info(),)
+                continue
+            results.update(self._fetch_cluster(cluster, date, cloud_cover_threshold,
+                                               image_size, fetch_mode, profile))
+        return results
+
+    def _fetch_cluster(self, cluster: List[Dict[str, Any]], date: Optional[str],
+                       cloud_cover_threshold: float, image_size: int,
+                       fetch_mode: str, profile: str) -> Dict[int, Tuple]:
+        """Одна загрузка на группу территорий и вырезка окон"""
+        actual_date = date or datetime.now().strftime('%Y-%m-%d')
+        names = ', '.join(str(territory['name']) for territory in cluster)
+        print(f"\nОбщая загрузка для {len(cluster)} территорий: {names}")
+
+        results = {}
+        try:
+            plan = plan_region(cluster, image_size)
+            image, image_date, cloud_cover, scene_id, error = self._find_best_image(
+                plan['center'][0], plan['center'][1], actual_date, cloud_cover_threshold)
+            if image is None:
+                return {territory['id']: (False, None, None, error, {}) for territory in cluster}
+
+            # Территории, для которых эта сцена уже загружена, не входят в область
+            pending = []
+            for territory in cluster:
+                render_key = self._render_key(territory['latitude'], territory['longitude'],
+                                              image_size, fetch_mode, profile)
+                stored = self._find_downloaded_scene(scene_id, render_key)
+                if stored:
+                    results[territory['id']] = (
+                        True, stored['image_path'], stored['capture_date'],
+                        f"Снимок не изменился (сцена {scene_id})",
+                        {'scene_id': scene_id, 'render_key': render_key, 'reused': True,
+                         'image_id': stored['id']})
+                else:
+                    pending.append(territory)
+            if not pending:
+                return results
+            if len(pending) < len(cluster):
+                plan = plan_region(pending, image_size)
 
-            # Выбираем наименее облачное изображение
-            image = self.ee.Image(collection.first())
+            print(f"Область {plan['width']}x{plan['height']} пикселей вместо "
+                  f"{len(pending)} загрузок {image_size}x{image_size}")
 
-            # Получаем дату захвата
-            image_date = self.ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
+            if fetch_mode == 'npy':
+                crops = self._crop_pixels(image, plan, pending, image_date, cloud_cover, image_size, profile)
+            else:
+                crops = self._crop_thumbnail(image, plan, pending, image_date, image_size)
+
+            for territory in pending:
+                render_key = self._render_key(territory['latitude'], territory['longitude'],
+                                              image_size, fetch_mode, profile)
+                results[territory['id']] = (
+                    True, crops[territory['id']], image_date,
+                    f"Общая загрузка ({len(pending)} территорий, сцена {scene_id})",
+                    {'scene_id': scene_id, 'render_key': render_key, 'reused': False})
+            return results
+
+        except self._backend_errors() as gee_error:
+            message = f"Ошибка GEE: {str(gee_error)}"
+        except Exception as error:
+            message = f"Внутренняя ошибка: {str(error)}"
+        for territory in cluster:
+            results.setdefault(territory['id'], (False, None, None, message, {}))
+        return results
+
+    def _crop_pixels(self, image, plan: Dict[str, Any], territories: List[Dict[str, Any]],
+                     image_date: str, cloud_cover, image_size: int, profile: str) -> Dict[int, str]:
+        """Сырые каналы общей области -> .npy окна каждой территории"""
+        if profile not in FETCH_PROFILES:
+            raise ValueError(f"Неизвестный профиль каналов: {profile}")
+        bands = FETCH_PROFILES[profile]
+
+        region_key = hashlib.md5(f"{plan['bounds']}_{image['scene_id']}_{profile}".encode()).hexdigest()
+        metadata = {
+            'bands': bands,
+            'profile': profile,
+            'stretch': list(DEFAULT_STRETCH),
+            'bounds': list(plan['bounds']),
+            'crs': 'EPSG:4326',
+            'geotransform': plan['geotransform'],
+            'capture_date': image_date,
+            'cloud_cover': cloud_cover,
+            'scene_id': image['scene_id']
+        }
+        if self.raster_store.exists(f"region_{region_key}"):
+            region_path = str(self.raster_store.path_for(f"region_{region_key}"))
+            tiles_count = 0
+        else:
+            region_path, tiles_count = self._download_raster(image, plan['bounds'], plan['width'], plan['height'],
+                                                             bands, f"region_{region_key}", metadata)
+        region = load_raster(region_path)
+
+        paths = {}
+        for territory in territories:
+            row, col = plan['crops'][territory['id']]
+            cache_key = (f"{self._get_cache_key(territory['latitude'], territory['longitude'], image_date)}"
+                         f"_{image_size}_{profile}")
+            crop_metadata = dict(metadata,
+                                 bounds=crop_bounds(plan, row, col, image_size),
+                                 geotransform=crop_geotransform(plan, row, col),
+                                 crop={'source': region_path, 'row': row, 'col': col})
+            paths[territory['id']] = self.raster_store.save(
+                cache_key, region[row:row + image_size, col:col + image_size], crop_metadata)
+
+        self.request_count += tiles_count
+        return paths
+
+    def _crop_thumbnail(self, image, plan: Dict[str, Any], territories: List[Dict[str, Any]],
+                        image_date: str, image_size: int) -> Dict[int, str]:
+        """Миниатюра общей области -> улучшенный снимок окна каждой территории"""
+        print(f"Скачиваем общую область...")
+        content = self.rate_limiter.download(self.backend.thumbnail, image, plan['bounds'],
+                                             (plan['width'], plan['height']))
+        region = self.Image.open(io.BytesIO(content))
+        region.load()
+        self.request_count += 1
+
+        paths = {}
+        for territory in territories:
+            row, col = plan['crops'][territory['id']]
+            filepath = self._cache_path(
+                self._get_cache_key(territory['latitude'], territory['longitude'], image_date), image_size)
+
+            # Улучшение по гистограмме окна, как при отдельной загрузке
+            crop = self._enhance_image(region.crop((col, row, col + image_size, row + image_size)))
+            self._save_image(crop, filepath)
+            self._save_to_cache(territory['latitude'], territory['longitude'], image_date, str(filepath))
+            paths[territory['id']] = str(filepath)
+        return paths
+
+    def _find_best_image(self, latitude: float, longitude: float, actual_date: str,
+                         cloud_cover_threshold: float):
+        """
+        Поиск наименее облачного снимка Sentinel-2 за SEARCH_WINDOW_DAYS дней до даты
+        (по локальному каталогу сцен, если он есть)
 
-            # Получаем облачность изображения
-            cloud_cover = image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo()
-            print(f"Найдено изображение от: {image_date}")
-            print(f"Облачность изображения: {cloud_cover}%")
+        Returns:
+            (сцена, дата_снимка, облачность, id_сцены, None)
+            или (None, None, None, None, ошибка)
+        """
+        try:
+            start_date, end_date = search_window(actual_date)
+        except ValueError as date_error:
+            return None, None, None, None, f"Некорректный формат даты: {date_error}"
+
+        print(f"Поиск изображений с {start_date} по {end_date}")
+
+        if self.catalog is not None and self.catalog.ensure(latitude, longitude, start_date, end_date):
+            entry, collection_size = self.catalog.find_scene(
+                latitude, longitude, start_date, end_date, cloud_cover_threshold)
+            scene = self.backend.open_scene(entry) if entry else None
+            print(f"Найдено изображений в каталоге: {collection_size}")
+        else:
+            scene, collection_size = self.rate_limiter.compute(
+                self.backend.find_scene, latitude, longitude, start_date, end_date, cloud_cover_threshold)
+            print(f"Найдено изображений: {collection_size}")
 
-            region = point.buffer(750).bounds()  # 750 метров = 1.5x1.5 км
+        if scene is None:
+            return None, None, None, None, f"Нет изображений с облачностью < {cloud_cover_threshold}%"
 
-            print("Получаем URL для скачивания...")
+        print(f"Найдено изображение от: {scene['date']}")
+        print(f"Облачность изображения: {scene['cloud_cover']}%")
+        print(f"Сцена: {scene['scene_id']}")
 
-            # ОПТИМАЛЬНЫЕ НАСТРОЙКИ ДЛЯ ДЕТЕКЦИИ ИЗМЕНЕНИЙ:
-            # Меньшая область + лучшие настройки контраста
+        return scene, scene['date'], scene['cloud_cover'], scene['scene_id'], None
 
-            # Генерируем URL для скачивания
-            url = image.getThumbURL({
-                'region': region,
-                'dimensions': f'{image_size}x{image_size}',
-                'format': 'png',
-                'bands': ['B4', 'B3', 'B2'],  # True Color (RGB)
-                'min': 500,  # Увеличение для лучшего контраста
-                'max': 3000,  # Оптимально для Sentinel-2
-                'gamma': 1.0  # Нейтральная гамма
-            })
+    def get_available_dates(self, latitude: float, longitude: float, start_date: str, end_date: str,
+                            cloud_cover_threshold: float = 100.0) -> List[Dict[str, Any]]:
+        """
+        Даты съемки над точкой за период [start_date, end_date) по каталогу сцен
 
-            print(f"Скачиваем изображение...")
+        Returns:
+            [{'date', 'scene_id', 'cloud_cover', 'scenes'}] (пустой список без каталога)
+        """
+        if self.catalog is None:
+            return []
+        self.catalog.ensure(latitude, longitude, start_date, end_date)
+        return self.catalog.available_dates(latitude, longitude, start_date, end_date, cloud_cover_threshold)
 
-            # Скачиваем изображение
-            response = self.requests.get(url, timeout=120)
-            if response.status_code != 200:
-                return False, None, None, f"Ошибка скачивания: {response.status_code}"
+    @staticmethod
+    def _region_bounds(latitude: float, longitude: float,
+                       buffer_m: float = 750.0) -> Tuple[float, float, float, float]:
+        """Квадрат вокруг точки в градусах: (min_lon, min_lat, max_lon, max_lat)"""
+        dlat = buffer_m / 111320.0
+        dlon = buffer_m / (111320.0 * max(math.cos(math.radians(latitude)), 1e-6))
+        return longitude - dlon, latitude - dlat, longitude + dlon, latitude + dlat
+
+    def _compute_pixels(self, image, bounds: Tuple[float, float, float, float],
+                        width: int, height: int, bands) -> np.ndarray:
+        """Загрузка каналов напрямую в numpy (computePixels у Earth Engine)"""
+        return self.rate_limiter.compute(self.backend.compute_pixels, image, bounds, width, height, bands)
 
-            # Сохраняем изображение
-            cache_key = self._get_cache_key(latitude, longitude, image_date)
-            filepath = self.cache_dir / f"{cache_key}_{image_size}.png"
+    @staticmethod
+    def _tile_size(band_count: int) -> int:
+        """Наибольшая сторона тайла (степень двойки), укладывающаяся в лимит computePixels"""
+        max_side = int(math.sqrt(MAX_REQUEST_BYTES / (2 * max(band_count, 1))))
+        tile = MAX_TILE_SIZE
+        while tile > max_side:
+            tile //= 2
+        return tile
+
+    def _compute_pixels_tiled(self, image, bounds: Tuple[float, float, float, float],
+                              width: int, height: int, bands, out: np.ndarray,
+                              tile_size: int, max_workers: int = TILE_WORKERS) -> int:
+        """
+        Загрузка области сеткой тайлов параллельно с записью в общий массив
 
-            print(f"Сохраняем изображение...")
+        Returns:
+            Количество загруженных тайлов
+        """
+        min_lon, min_lat, max_lon, max_lat = bounds
+        dx = (max_lon - min_lon) / width
+        dy = (max_lat - min_lat) / height
+
+        tiles = []
+        for row in range(0, height, tile_size):
+            for col in range(0, width, tile_size):
+                tile_h = min(tile_size, height - row)
+                tile_w = min(tile_size, width - col)
+                # Границы тайла на той же сетке, что и вся область
+                tile_bounds = (min_lon + col * dx, max_lat - (row + tile_h) * dy,
+                               min_lon + (col + tile_w) * dx, max_lat - row * dy)
+                tiles.append((row, col, tile_w, tile_h, tile_bounds))
+
+        def fetch_tile(tile):
+            row, col, tile_w, tile_h, tile_bounds = tile
+            out[row:row + tile_h, col:col + tile_w] = self._compute_pixels(
+                image, tile_bounds, tile_w, tile_h, bands)
+
+        print(f"Загрузка {len(tiles)} тайлов по {tile_size}px ({min(max_workers, len(tiles))} потока)...")
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tiles))) as pool:
+            # list() пробрасывает первую ошибку загрузки
+            list(pool.map(fetch_tile, tiles))
+
+        return len(tiles)
+
+    def _fetch_pixels(self, image, latitude: float, longitude: float, image_date: str,
+                      cloud_cover, image_size: int, profile: str = 'rgb',
+                      buffer_m: float = 750.0) -> Tuple[bool, Optional[str], Optional[str], str]:
+        """Сырые каналы uint16 без PNG: computePixels -> .npy (memmap для детекторов)"""
+        if profile not in FETCH_PROFILES:
+            return False, None, None, f"Неизвестный профиль каналов: {profile}"
+        bands = FETCH_PROFILES[profile]
+
+        cache_key = f"{self._get_cache_key(latitude, longitude, image_date)}_{image_size}_{profile}"
+        if buffer_m != 750.0:
+            cache_key += f"_r{int(buffer_m)}"
+        if self.raster_store.exists(cache_key):
+            print("Используем сырой растр из кэша")
+            return True, str(self.raster_store.path_for(cache_key)), image_date, "Сырой растр из кэша"
+
+        bounds = self._region_bounds(latitude, longitude, buffer_m)
+        min_lon, min_lat, max_lon, max_lat = bounds
+
+        metadata = {
+            'bands': bands,
+            'profile': profile,
+            'stretch': list(DEFAULT_STRETCH),
+            'bounds': [min_lon, min_lat, max_lon, max_lat],
+            'crs': 'EPSG:4326',
+            # Порядок GDAL: (x0, dx, 0, y0, 0, dy)
+            'geotransform': [min_lon, (max_lon - min_lon) / image_size, 0.0,
+                             max_lat, 0.0, -(max_lat - min_lat) / image_size],
+            'capture_date': image_date,
+            'cloud_cover': cloud_cover,
+            'scene_id': image.get('scene_id')
+        }
 
-            # Сохраняем скачанное изображение
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
+        covered = self._crop_from_index(image, bounds, image_size, bands)
+        if covered is not None:
+            pixels, match = covered
+            metadata.update(bounds=match['bounds'], geotransform=match['geotransform'],
+                            crop={'source': match['path'], 'row': match['row'], 'col': match['col']})
+            filepath = self.raster_store.save(cache_key, pixels, metadata)
+            print(f"Область покрыта сохраненным растром сцены, вырезка без загрузки: {filepath}")
+            return True, filepath, image_date, f"Вырезано из сохраненного растра ({image_size}x{image_size})"
+
+        start_time = time.time()
+        filepath, tiles_count = self._download_raster(image, bounds, image_size, image_size,
+                                                      bands, cache_key, metadata)
+
+        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+        print(f"\nСЫРОЙ РАСТР СОХРАНЕН!")
+        print(f"   Размер: {image_size}x{image_size} пикселей, каналы: {', '.join(bands)}")
+        print(f"   Тайлов: {tiles_count}, время загрузки: {time.time() - start_time:.1f} сек")
+        print(f"   Размер файла: {file_size_mb:.2f} MB")
+        print(f"   Дата съемки: {image_date}")
+        print(f"   Путь: {filepath}")
+
+        self.request_count += tiles_count
+        return True, filepath, image_date, f"Успешно ({image_size}x{image_size}, сырые каналы uint16)"
+
+    def _download_raster(self, image, bounds: Tuple[float, float, float, float], width: int, height: int,
+                         bands, cache_key: str, metadata: Dict[str, Any]) -> Tuple[str, int]:
+        """
+        Загрузка каналов области в RasterStore (одним запросом или тайлами)
 
-            print("Улучшаем изображение для детекции изменений...")
-            self._enhance_image(str(filepath))
+        Returns:
+            (путь_к_npy, количество_запросов)
+        """
+        tile_size = self._tile_size(len(bands))
+
+        if width <= tile_size and height <= tile_size:
+            print("Загружаем каналы напрямую в numpy (computePixels)...")
+            pixels = self._compute_pixels(image, bounds, width, height, bands)
+            filepath = self.raster_store.save(cache_key, pixels, metadata)
+            tiles_count = 1
+        else:
+            # Мозаика пишется сразу в memmap на диске, без сборки в памяти
+            mosaic = self.raster_store.create(cache_key, (height, width, len(bands)))
+            try:
+                tiles_count = self._compute_pixels_tiled(image, bounds, width, height,
+                                                         bands, mosaic, tile_size)
+            except Exception:
+                del mosaic
+                self.raster_store.discard(cache_key)
+                raise
+            metadata['tiles'] = tiles_count
+            filepath = self.raster_store.finalize(cache_key, mosaic, metadata)
+
+        if self.raster_index is not None:
+            self.raster_index.register(filepath, metadata, (height, width))
+        return filepath, tiles_count
+
+    def _crop_from_index(self, image, bounds: Tuple[float, float, float, float], size: int,
+                         bands) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        """
+        Вырезка области из ранее загруженного растра той же сцены
 
-            # Получаем информацию о размере
-            pil_image = self.Image.open(filepath)
-            width, height = pil_image.size
-            file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+        Returns:
+            (каналы (H, W, C) uint16, найденный растр) или None, если область не покрыта
+        """
+        if self.raster_index is None or not image.get('scene_id'):
+            return None
+        match = self.raster_index.find_covering(image['scene_id'], bands, bounds, size, size)
+        if match is None:
+            return None
+        return crop_raster(load_raster(match['path']), match, size, size), match
+
+    def get_region_image(self, latitude: float, longitude: float, radius_m: float,
+                         date: Optional[str] = None,
+                         cloud_cover_threshold: float = 30.0,
+                         profile: str = 'rgb',
+                         scale_m: float = 10.0) -> Tuple[bool, Optional[str], Optional[str], str]:
+        """
+        Сырой растр большой территории с родным разрешением Sentinel-2
 
-            # Расчёт детализации
-            area_km = (width * 10 / 1000) * (height * 10 / 1000)
-            print(f"\nИЗОБРАЖЕНИЕ СОХРАНЕНО!")
-            print(f"   Размер: {width}x{height} пикселей")
-            print(f"   Область: {area_km:.1f} км²")
-            print(f"   Детализация: {10.0 * 1000 / image_size:.1f} метров на пиксель")
-            print(f"   Размер файла: {file_size_mb:.2f} MB")
-            print(f"   Дата съемки: {image_date}")
-            print(f"   Облачность: {cloud_cover}%")
-            print(f"   Путь: {filepath}")
+        Область делится на тайлы, которые загружаются параллельно и
+        собираются в один .npy файл, поэтому время загрузки близко ко
+        времени загрузки одного тайла.
 
-            # Сохраняем в кэш
-            self._save_to_cache(latitude, longitude, image_date, str(filepath))
-            self.request_count += 1
+        Args:
+            latitude: Широта центра
+            longitude: Долгота центра
+            radius_m: Половина стороны квадрата области в метрах
+            date: Дата (YYYY-MM-DD) или None для текущей
+            cloud_cover_threshold: Максимальная облачность в %
+            profile: Набор каналов: 'rgb' или 'multispectral'
+            scale_m: Размер пикселя в метрах (10 = родное разрешение B2/B3/B4/B8)
 
-            return True, str(filepath), image_date, f"Успешно ({width}x{height}, {area_km:.1f}км²)"
+        Returns:
+            (успех, путь_к_файлу, дата_изображения, сообщение)
+        """
+        self._set_fetch_info()
+        try:
+            actual_date = date or datetime.now().strftime('%Y-%m-%d')
+            image_size = max(1, int(round(2 * radius_m / scale_m)))
 
-        except self.ee.EEException as gee_error:
+            print(f"\nЗагрузка области {2 * radius_m / 1000:.1f}x{2 * radius_m / 1000:.1f} км")
+            print(f"Координаты: {latitude:.4f}, {longitude:.4f}")
+            print(f"Размер растра: {image_size}x{image_size} пикселей ({scale_m:g} м/пиксель)")
+
+            image, image_date, cloud_cover, scene_id, error = self._find_best_image(
+                latitude, longitude, actual_date, cloud_cover_threshold)
+            if image is None:
+                return False, None, None, error
+
+            render_key = self._render_key(latitude, longitude, image_size, 'npy', profile, radius_m)
+            self._set_fetch_info(scene_id=scene_id, render_key=render_key, reused=False)
+            stored = self._find_downloaded_scene(scene_id, render_key)
+            if stored:
+                print(f"Сцена {scene_id} не изменилась, используем сохраненный растр")
+                self._set_fetch_info(scene_id=scene_id, render_key=render_key, reused=True,
+                                     image_id=stored['id'])
+                return True, stored['image_path'], stored['capture_date'], \
+                    f"Снимок не изменился (сцена {scene_id})"
+
+            return self._fetch_pixels(image, latitude, longitude, image_date, cloud_cover,
+                                      image_size, profile, buffer_m=radius_m)
+
+        except self._backend_errors() as gee_error:
             return False, None, None, f"Ошибка GEE: {str(gee_error)}"
         except Exception as error:
             return False, None, None, f"Внутренняя ошибка: {str(error)}"
@@ -424,7 +986,7 @@ class GEEClient:
             return {'error': f'Файл не существует: {image_path}'}
 
         try:
-            img = self.cv2.imread(image_path)
+            img = load_bgr(image_path)
             if img is None:
                 return {'error': 'Не удалось загрузить изображение'}
 
@@ -753,8 +1315,8 @@ class GEEClient:
             print(f"{'=' * 60}")
 
             # Загружаем изображения
-            img1 = self.cv2.imread(image_path1)
-            img2 = self.cv2.imread(image_path2)
+            img1 = load_bgr(image_path1)
+            img2 = load_bgr(image_path2)
 
             if img1 is None or img2 is None:
                 return {'error': 'Не удалось загрузить изображения'}
@@ -918,7 +1480,8 @@ class GEEClient:
         try:
             deleted_count = 0
 
-            for file in self.cache_dir.glob("*.png"):
+            for file in [path for image_format in CACHE_FORMATS
+                         for path in self.cache_dir.glob(f"*.{image_format}")]:
                 try:
                     file.unlink()
                     deleted_count += 1
@@ -935,7 +1498,8 @@ class GEEClient:
     def get_cache_info(self) -> Dict[str, Any]:
         """Получение информации о кэше"""
         try:
-            cache_files = list(self.cache_dir.glob("*.png"))
+            cache_files = [path for image_format in CACHE_FORMATS
+                           for path in self.cache_dir.glob(f"*.{image_format}")]
             total_size = sum(f.stat().st_size for f in cache_files if f.exists())
 
             return {
@@ -954,8 +1518,8 @@ class GEEClient:
         print("ОТЛАДКА СЕЗОННОГО АНАЛИЗА")
         print(f"{'=' * 60}")
 
-        img1 = self.cv2.imread(image_path1)
-        img2 = self.cv2.imread(image_path2)
+        img1 = load_bgr(image_path1)
+        img2 = load_bgr(image_path2)
 
         if img1 is None or img2 is None:
             print("Ошибка загрузки изображений")
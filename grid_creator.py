@@ -9,6 +9,8 @@ import os
 from typing import Dict, Any, Tuple
 from datetime import datetime
 
+from raster_store import load_bgr
+
 
 class GridCreator:
     def __init__(self, grid_size: int = 32):
@@ -79,7 +81,7 @@ class GridCreator:
         if not os.path.exists(image_path):
             return {'error': f'File not found: {image_path}'}
 
-        img = cv2.imread(image_path)
+        img = load_bgr(image_path)
         if img is None:
             return {'error': 'Failed to load image'}
 
@@ -232,8 +234,8 @@ class GridCreator:
         if not os.path.exists(before_path) or not os.path.exists(after_path):
             return {'error': 'Files not found'}
 
-        before = cv2.imread(before_path)
-        after = cv2.imread(after_path)
+        before = load_bgr(before_path)
+        after = load_bgr(after_path)
 
         if before is None or after is None:
             return {'error': 'Loading error'}
@@ -312,7 +314,7 @@ class GridCreator:
         if not os.path.exists(image_path):
             return {'error': f'Image not found: {image_path}'}
 
-        img = cv2.imread(image_path)
+        img = load_bgr(image_path)
         if img is None:
             return {'error': 'Image loading error'}
 
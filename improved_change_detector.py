@@ -8,6 +8,8 @@ import numpy as np
 from typing import Dict, Any
 import os
 
+from raster_store import load_bgr, load_band_stack
+
 
 class ImprovedChangeDetector:
     def __init__(self):
@@ -20,8 +22,8 @@ class ImprovedChangeDetector:
         print("\nУЛУЧШЕННОЕ ОБНАРУЖЕНИЕ РЕАЛЬНЫХ ИЗМЕНЕНИЙ")
 
         # Загрузка изображений
-        img1 = cv2.imread(img1_path)
-        img2 = cv2.imread(img2_path)
+        img1 = load_bgr(img1_path)
+        img2 = load_bgr(img2_path)
 
         if img1 is None or img2 is None:
             return {'error': 'Не удалось загрузить изображения'}
@@ -77,17 +79,26 @@ class ImprovedChangeDetector:
         # 5. анализ индексов (для леса/растительности)
         print("5. Анализ растительности...")
 
-        # NDVI-like индекс (для спутниковых снимков RGB)
-        b1, g1, r1 = cv2.split(img1.astype(np.float32))
-        b2, g2, r2 = cv2.split(img2.astype(np.float32))
+        spectral = self._spectral_indices(img1_path, img2_path, w, h)
+
+        if 'ndvi' in spectral:
+            # Настоящий NDVI по каналам B8/B4 мультиспектрального растра
+            print("   Используется NDVI (B8, B4)")
+            veg_index1, veg_index2 = spectral['ndvi']
+            veg_mask1 = veg_index1 > 0.3
+            veg_mask2 = veg_index2 > 0.3
+        else:
+            # NDVI-like индекс (для спутниковых снимков RGB)
+            b1, g1, r1 = cv2.split(img1.astype(np.float32))
+            b2, g2, r2 = cv2.split(img2.astype(np.float32))
 
-        # Простой вегетационный индекс
-        veg_index1 = (g1 - r1) / (g1 + r1 + 1e-6)
-        veg_index2 = (g2 - r2) / (g2 + r2 + 1e-6)
+            # Простой вегетационный индекс
+            veg_index1 = (g1 - r1) / (g1 + r1 + 1e-6)
+            veg_index2 = (g2 - r2) / (g2 + r2 + 1e-6)
 
-        # Порог для зелени
-        veg_mask1 = veg_index1 > 0.1  # Порог для зеленых областей
-        veg_mask2 = veg_index2 > 0.1
+            # Порог для зелени
+            veg_mask1 = veg_index1 > 0.1  # Порог для зеленых областей
+            veg_mask2 = veg_index2 > 0.1
 
         # Изменения в растительности
         veg_changes = np.logical_xor(veg_mask1, veg_mask2).astype(np.uint8) * 255
@@ -235,10 +246,39 @@ class ImprovedChangeDetector:
                 'vegetation_changes': int(np.sum(veg_changes_clean > 0)),
                 'earth_changes': int(np.sum(earth_changes_clean > 0)),
                 'color_difference': float(color_diff),
-                'change_density': float(change_density)
+                'change_density': float(change_density),
+                'spectral_indices': {
+                    name: float(np.mean(new_index) - np.mean(old_index))
+                    for name, (old_index, new_index) in spectral.items()
+                }
             }
         }
 
+    def _spectral_indices(self, img1_path: str, img2_path: str, w: int, h: int) -> Dict[str, Any]:
+        """
+        Спектральные индексы обоих снимков, если они загружены в мультиспектральном профиле
+
+        Returns:
+            {имя индекса: (индекс1, индекс2)} приведенные к размеру (w, h)
+        """
+        stack1 = load_band_stack(img1_path)
+        stack2 = load_band_stack(img2_path)
+        if stack1 is None or stack2 is None:
+            return {}
+
+        indices = {}
+        for name in ('ndvi', 'ndbi', 'nbr'):
+            if not (stack1.supports_index(name) and stack2.supports_index(name)):
+                continue
+            pair = []
+            for stack in (stack1, stack2):
+                index = stack.index(name)
+                if index.shape[:2] != (h, w):
+                    index = cv2.resize(index, (w, h))
+                pair.append(index)
+            indices[name] = tuple(pair)
+        return indices
+
     def _create_visualization(self, img, all_changes, veg_changes, earth_changes,
                               texture_changes, change_type, significance, is_seasonal):
         """Создание визуализации изменений (только английский текст)"""
@@ -0,0 +1,253 @@
+"""
+Очередь задач мониторинга для нескольких рабочих процессов и узлов
+
+Задача захватывается атомарным UPDATE с арендой (lease) на заданное время.
+Рабочий процесс продлевает аренду (heartbeat), пока выполняет задачу; если
+процесс или узел упал, аренда истекает и задачу забирает другой процесс.
+Число попыток ограничено, после последней неудачной задача получает статус
+failed. Повторная постановка задачи с тем же dedupe_key игнорируется, поэтому
+несколько узлов могут одновременно планировать один и тот же день.
+
+Реализация очереди выбирается через queue_from_env (MONITOR_QUEUE_BACKEND);
+SQLite-очередь рассчитана на общую файловую систему узлов и работает с
+обычным журналом: база очереди (MONITOR_QUEUE_DB, по умолчанию основная база)
+не должна открываться с DB_WAL=1, WAL на сетевой файловой системе не работает.
+"""
+
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Sequence
+
+from database import ThreadConnections
+
+QUEUE_DB_PATH = os.getenv('MONITOR_QUEUE_DB', 'satellite_monitor.db')
+# Срок аренды задачи и период ее продления (секунды)
+LEASE_SECONDS = float(os.getenv('MONITOR_LEASE_SECONDS', '300'))
+HEARTBEAT_SECONDS = float(os.getenv('MONITOR_HEARTBEAT_SECONDS', str(LEASE_SECONDS / 3)))
+MAX_ATTEMPTS = int(os.getenv('MONITOR_JOB_ATTEMPTS', '3'))
+# Несколько процессов и узлов пишут в одну базу - ждем блокировку дольше обычного
+QUEUE_BUSY_TIMEOUT_MS = 30000
+
+
+def default_worker_id() -> str:
+    """Идентификатор рабочего процесса: узел и PID"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue(abc.ABC):
+    """Интерфейс очереди задач"""
+
+    @abc.abstractmethod
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+                priority: float = 0.0) -> Optional[int]:
+        """Постановка задачи; None - задача с таким dedupe_key уже есть"""
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, kinds: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        """Захват следующей задачи (по убыванию приоритета); None - очередь пуста"""
+
+    @abc.abstractmethod
+    def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Продление аренды; False - аренда потеряна (истекла и задачу забрали)"""
+
+    @abc.abstractmethod
+    def complete(self, job_id: int, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        """Задача выполнена; False - аренда потеряна и задача уже не принадлежит процессу"""
+
+    @abc.abstractmethod
+    def fail(self, job_id: int, worker_id: str, error: str) -> bool:
+        """Неудача попытки: задача возвращается в очередь, пока есть попытки"""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Количество задач по статусам"""
+
+
+class SQLiteJobQueue(JobQueue):
+    """Очередь в таблице jobs базы SQLite"""
+
+    def __init__(self, db_path: str = QUEUE_DB_PATH, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._connections = ThreadConnections(self.db_path, busy_timeout_ms=QUEUE_BUSY_TIMEOUT_MS)
+        self._init_tables()
+
+    def _connect(self):
+        """Соединение потока как транзакция (строки - sqlite3.Row)"""
+        return self._connections.transaction(sqlite3.Row)
+
+    def _init_tables(self) -> None:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    dedupe_key TEXT UNIQUE,
+                    priority REAL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'queued',  -- queued, leased, done, failed
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    worker_id TEXT,
+                    lease_expires REAL,  -- unix time
+                    last_error TEXT,
+                    result TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_claim
+                ON jobs (status, priority DESC, id)
+            ''')
+            conn.commit()
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+                priority: float = 0.0) -> Optional[int]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO jobs (kind, payload, dedupe_key, priority, max_attempts)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (kind, json.dumps(payload), dedupe_key, priority, self.max_attempts))
+            conn.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, worker_id: str, kinds: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        kind_filter = ''
+        params: List[Any] = [worker_id, now + self.lease_seconds, now]
+        if kinds:
+            kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # Задачи с истекшей арендой и исчерпанными попытками больше не выдаются
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', worker_id = NULL, updated_at = CURRENT_TIMESTAMP,
+                       last_error = COALESCE(last_error, 'аренда истекла')
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts
+            ''', (now,))
+
+            # Выбор и захват одним оператором: два процесса не получат одну задачу
+            cursor.execute(f'''
+                UPDATE jobs
+                SET status = 'leased', worker_id = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = 'queued' OR (status = 'leased' AND lease_expires < ?))
+                      {kind_filter}
+                    ORDER BY priority DESC, id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', params)
+            row = cursor.fetchone()
+            conn.commit()
+
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET lease_expires = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND worker_id = ? AND status = 'leased'
+            ''', (time.time() + self.lease_seconds, job_id, worker_id))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def complete(self, job_id: int, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = 'done', result = ?, lease_expires = NULL,
+                       updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND worker_id = ? AND status = 'leased'
+            ''', (json.dumps(result or {}), job_id, worker_id))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs
+                SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                    worker_id = NULL, lease_expires = NULL, last_error = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND worker_id = ? AND status = 'leased'
+            ''', (error, job_id, worker_id))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+            return {status: count for status, count in cursor.fetchall()}
+
+
+class LeaseKeeper:
+    """
+    Продление аренды задачи в фоновом потоке на время ее выполнения
+
+        with LeaseKeeper(queue, job, worker_id) as lease:
+            ...
+            if lease.lost: ...
+    """
+
+    def __init__(self, queue: JobQueue, job: Dict[str, Any], worker_id: str,
+                 interval: float = HEARTBEAT_SECONDS):
+        self.queue = queue
+        self.job_id = job['id']
+        self.worker_id = worker_id
+        self.interval = max(0.1, interval)
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'lease-{self.job_id}', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker_id):
+                    self.lost = True
+                    print(f"   Аренда задачи {self.job_id} потеряна")
+                    return
+            except Exception as error:
+                print(f"   Ошибка продления аренды задачи {self.job_id}: {error}")
+
+    def __enter__(self) -> 'LeaseKeeper':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def queue_from_env() -> JobQueue:
+    """
+    Очередь из переменных окружения
+
+    MONITOR_QUEUE_BACKEND=sqlite (по умолчанию) - таблица jobs в MONITOR_QUEUE_DB
+    """
+    backend = os.getenv('MONITOR_QUEUE_BACKEND', 'sqlite').lower()
+    if backend == 'sqlite':
+        return SQLiteJobQueue()
+    raise ValueError(f"Неизвестная очередь задач: {backend}")
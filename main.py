@@ -380,7 +380,7 @@ class SatelliteMonitorApp:
         try:
             self.file_manager = FileManager()
             self.db = Database()
-            self.gee_client = GEEClient()
+            self.gee_client = GEEClient(database=self.db, image_format='jpg')
             self.change_detector = ChangeDetector(self.db, self.gee_client)
             self.grid_analyzer = GridAnalyzer()
             print("Система успешно инициализирована!")
@@ -426,18 +426,19 @@ class SatelliteMonitorApp:
             return
 
         print(f"\nНайдено территорий: {len(territories)}\n")
+        summaries = self.db.get_territory_summaries()
         for i, territory in enumerate(territories, 1):
             print(f"{i}. {territory['name']}")
             print(f"   Координаты: {territory['latitude']}, {territory['longitude']}")
             if territory['description']:
                 print(f"   Описание: {territory['description']}")
-            try:
-                images = self.db.get_territory_images(territory['id'])
-                print(f"   Изображений: {len(images)}")
-                if images:
-                    latest = max(images, key=lambda x: x.get('capture_date', ''))
-                    print(f"   Последний снимок: {latest.get('capture_date', 'неизвестно')}")
-            except:
+            summary = summaries.get(territory['id'])
+            if summary and summary['image_count']:
+                print(f"   Изображений: {summary['image_count']}")
+                print(f"   Последний снимок: {summary['latest_capture_date'] or 'неизвестно'}")
+                if summary['latest_change_percentage'] is not None:
+                    print(f"   Последнее изменение: {summary['latest_change_percentage']:.2f}%")
+            else:
                 print(f"   Нет снимков")
             print()
 
@@ -579,8 +580,8 @@ class SatelliteMonitorApp:
 
         print("\nВыберите территорию для управления изображениями:")
         for i, territory in enumerate(territories, 1):
-            images = self.db.get_territory_images(territory['id'])
-            print(f"{i}. {territory['name']} ({len(images)} изображений)")
+            image_count = self.db.get_territory_summary(territory['id'])['image_count']
+            print(f"{i}. {territory['name']} ({image_count} изображений)")
 
         try:
             choice = int(input("\nНомер территории: "))
@@ -692,10 +693,7 @@ class SatelliteMonitorApp:
         if selection == 'all':
             confirm = input(f"\nВы уверены, что хотите удалить ВСЕ {len(images)} изображений? (y/n): ").lower()
             if confirm == 'y':
-                deleted_count = 0
-                for image in images:
-                    if self.delete_image_with_confirmation(image, force=True, reason="удаление_всех"):
-                        deleted_count += 1
+                deleted_count = self.delete_images_batch(images, reason="удаление_всех")
                 print(f"\nУдалено изображений: {deleted_count}/{len(images)}")
             return
 
@@ -731,11 +729,8 @@ class SatelliteMonitorApp:
 
         confirm = input(f"\nУдалить {len(valid_indices)} изображений? (y/n): ").lower()
         if confirm == 'y':
-            deleted_count = 0
-            for idx in sorted(valid_indices, reverse=True):
-                image = images[idx - 1]
-                if self.delete_image_with_confirmation(image, force=True, reason="множественное_удаление"):
-                    deleted_count += 1
+            deleted_count = self.delete_images_batch([images[idx - 1] for idx in sorted(valid_indices)],
+                                                     reason="множественное_удаление")
             print(f"\nУдалено изображений: {deleted_count}/{len(valid_indices)}")
 
     def delete_old_images(self, territory):
@@ -814,10 +809,7 @@ class SatelliteMonitorApp:
         if 'old_images' in locals() and old_images:
             confirm = input(f"\nУдалить {len(old_images)} изображений? (y/n): ").lower()
             if confirm == 'y':
-                deleted_count = 0
-                for image in old_images:
-                    if self.delete_image_with_confirmation(image, force=True, reason="удаление_старых"):
-                        deleted_count += 1
+                deleted_count = self.delete_images_batch(old_images, reason="удаление_старых")
                 print(f"\nУдалено старых изображений: {deleted_count}/{len(old_images)}")
 
     def delete_cloudy_images(self, territory):
@@ -869,11 +861,8 @@ class SatelliteMonitorApp:
 
         confirm = input(f"\nУдалить {len(images_to_delete)} облачных изображений? (y/n): ").lower()
         if confirm == 'y':
-            deleted_count = 0
-            for image in images_to_delete:
-                if self.delete_image_with_confirmation(image, force=True,
-                                                       reason=f"высокая_облачность_{image['cloud_cover']}%"):
-                    deleted_count += 1
+            deleted_count = self.delete_images_batch(
+                images_to_delete, reason=lambda image: f"высокая_облачность_{image['cloud_cover']}%")
             print(f"\nУдалено облачных изображений: {deleted_count}/{len(images_to_delete)}")
 
     def delete_small_images(self, territory):
@@ -923,11 +912,8 @@ class SatelliteMonitorApp:
 
         confirm = input(f"\nУдалить {len(small_images)} маленьких изображений? (y/n): ").lower()
         if confirm == 'y':
-            deleted_count = 0
-            for image in small_images:
-                if self.delete_image_with_confirmation(image, force=True,
-                                                       reason=f"маленький_размер_{image['file_size'] / 1024:.1f}kb"):
-                    deleted_count += 1
+            deleted_count = self.delete_images_batch(
+                small_images, reason=lambda image: f"маленький_размер_{image['file_size'] / 1024:.1f}kb")
             print(f"\nУдалено маленьких изображений: {deleted_count}/{len(small_images)}")
 
     def recalculate_territory_stats(self, territory):
@@ -972,12 +958,10 @@ class SatelliteMonitorApp:
         if missing_count > 0:
             delete_missing = input(f"\nУдалить из БД {missing_count} отсутствующих файлов? (y/n): ").lower()
             if delete_missing == 'y':
-                deleted_count = 0
-                for image in images:
-                    if not os.path.exists(image['image_path']):
-                        if self.db.delete_image(image['id']):
-                            deleted_count += 1
-                            print(f"   Удален из БД: {image['capture_date']}")
+                missing = [image for image in images if not os.path.exists(image['image_path'])]
+                deleted_count = self.db.delete_images_many([image['id'] for image in missing])
+                for image in missing:
+                    print(f"   Удален из БД: {image['capture_date']}")
                 print(f"\nУдалено записей из БД: {deleted_count}")
 
     def delete_image_with_confirmation(self, image, force=False, reason=""):
@@ -1013,6 +997,30 @@ class SatelliteMonitorApp:
             print(f"Ошибка при удалении: {e}")
             return False
 
+    def delete_images_batch(self, images, reason=""):
+        """
+        Удаление нескольких изображений без подтверждения
+
+        Файлы переносятся в папку удаленных, записи и сравнения с этими снимками
+        удаляются из БД одной транзакцией.
+        reason - строка или функция(image), возвращающая причину для имени файла.
+        """
+        if not images:
+            return 0
+
+        for image in images:
+            file_path = image.get('image_path')
+            if file_path and os.path.exists(file_path):
+                self.file_manager.move_to_deleted(file_path, reason(image) if callable(reason) else reason)
+
+        try:
+            deleted_count = self.db.delete_images_many([image['id'] for image in images])
+            print(f"Удалено из базы данных: {deleted_count}")
+            return deleted_count
+        except Exception as e:
+            print(f"Ошибка при удалении: {e}")
+            return 0
+
     def find_and_delete_duplicates(self):
         print("\n" + "=" * 60)
         print("ПОИСК И УДАЛЕНИЕ ДУБЛИКАТОВ ИЗОБРАЖЕНИЙ")
@@ -1149,10 +1157,7 @@ class SatelliteMonitorApp:
 
                 print(f"Сохраняем: {keep_image.get('capture_date', 'неизвестно')}")
 
-                deleted_count = 0
-                for image in delete_images:
-                    if self.delete_image_with_confirmation(image, force=True, reason="дубликат"):
-                        deleted_count += 1
+                deleted_count = self.delete_images_batch(delete_images, reason="дубликат")
 
                 print(f"Удалено: {deleted_count}")
             elif choice == 3:
@@ -1174,11 +1179,8 @@ class SatelliteMonitorApp:
 
                     confirm = input(f"\nУдалить {len(valid_indices)} изображений? (y/n): ").lower()
                     if confirm == 'y':
-                        deleted_count = 0
-                        for idx in sorted(valid_indices, reverse=True):
-                            image = images[idx - 1]
-                            if self.delete_image_with_confirmation(image, force=True, reason="выбранный_дубликат"):
-                                deleted_count += 1
+                        deleted_count = self.delete_images_batch([images[idx - 1] for idx in sorted(set(valid_indices))],
+                                                                 reason="выбранный_дубликат")
                         print(f"Удалено: {deleted_count}")
                 except Exception as e:
                     print(f"Ошибка: {e}")
@@ -1187,7 +1189,7 @@ class SatelliteMonitorApp:
         print("\nАВТОМАТИЧЕСКАЯ ОЧИСТКА ДУБЛИКАТОВ")
         print("=" * 40)
 
-        total_deleted = 0
+        to_delete = []
         criteria = {
             'облачность': 0,
             'дата': 0,
@@ -1210,9 +1212,10 @@ class SatelliteMonitorApp:
                 delete_images = [img for img in images if img['id'] != best_image['id']]
                 criteria['дата'] += len(delete_images)
 
-            for image in delete_images:
-                if self.delete_image_with_confirmation(image, force=True, reason="автоочистка_дубликатов"):
-                    total_deleted += 1
+            to_delete.extend(delete_images)
+
+        # Все дубликаты удаляются из БД одной транзакцией
+        total_deleted = self.delete_images_batch(to_delete, reason="автоочистка_дубликатов")
 
         print(f"\nРЕЗУЛЬТАТЫ АВТООЧИСТКИ:")
         print(f"   Удалено дубликатов: {total_deleted}")
@@ -1307,6 +1310,12 @@ class SatelliteMonitorApp:
             capture_date = result[2]
             message = result[3] if len(result) > 3 else ""
 
+            fetch_info = self.gee_client.last_fetch_info()
+            if success and path and fetch_info.get('reused'):
+                print(f"\nНовой сцены нет: снимок от {capture_date} уже сохранен")
+                print(f"   Файл: {path}")
+                return
+
             if success and path:
                 new_filename = self.file_manager.get_safe_filename(territory_name)
                 new_path = os.path.join(self.file_manager.folders['original'], new_filename)
@@ -1344,7 +1353,9 @@ class SatelliteMonitorApp:
 
                 image_id = self.db.add_image(
                     territory_id, path, capture_date,
-                    cloud_cover, file_size
+                    cloud_cover, file_size,
+                    scene_id=fetch_info.get('scene_id'),
+                    render_key=fetch_info.get('render_key')
                 )
                 if image_id:
                     print(f"   Сохранено в БД с ID: {image_id}")
@@ -1438,8 +1449,8 @@ class SatelliteMonitorApp:
 
         print("\nВыберите территорию:")
         for i, territory in enumerate(territories, 1):
-            images = self.db.get_territory_images(territory['id'])
-            print(f"{i}. {territory['name']} ({len(images)} изображений)")
+            image_count = self.db.get_territory_summary(territory['id'])['image_count']
+            print(f"{i}. {territory['name']} ({image_count} изображений)")
 
         try:
             choice = int(input("\nНомер территории: "))
@@ -1495,6 +1506,11 @@ class SatelliteMonitorApp:
                 date = result[2]
                 message = result[3] if len(result) > 3 else ""
 
+                fetch_info = self.gee_client.last_fetch_info()
+                if success and fetch_info.get('reused'):
+                    print(f"   Новой сцены нет (снимок от {date}), пропускаем")
+                    continue
+
                 if success:
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     safe_name = self.file_manager.get_safe_filename(territory['name']).replace('satellite_', '')
@@ -1525,7 +1541,9 @@ class SatelliteMonitorApp:
 
                     self.db.add_image(
                         territory['id'], path, date,
-                        cloud_cover, file_size
+                        cloud_cover, file_size,
+                        scene_id=fetch_info.get('scene_id'),
+                        render_key=fetch_info.get('render_key')
                     )
 
                     self.change_detector.detect_and_save_changes(territory['id'])
@@ -1569,8 +1587,8 @@ class SatelliteMonitorApp:
 
         print("\nВыберите территорию:")
         for i, territory in enumerate(territories, 1):
-            images = self.db.get_territory_images(territory['id'])
-            print(f"{i}. {territory['name']} ({len(images)} изображений)")
+            image_count = self.db.get_territory_summary(territory['id'])['image_count']
+            print(f"{i}. {territory['name']} ({image_count} изображений)")
 
         try:
             choice = int(input("\nНомер территории: "))
@@ -2258,8 +2276,8 @@ class SatelliteMonitorApp:
         if territories:
             print(f"\nАКТИВНЫЕ ТЕРРИТОРИИ:")
             for territory in territories[:3]:
-                images = self.db.get_territory_images(territory['id'])
-                print(f"   {territory['name']}: {len(images)} изображений")
+                image_count = self.db.get_territory_summary(territory['id'])['image_count']
+                print(f"   {territory['name']}: {image_count} изображений")
 
             if len(territories) > 3:
                 print(f"   ... и еще {len(territories) - 3} территорий")
@@ -1,69 +1,65 @@
 
 """
 Автоматический мониторинг территорий
+
+Несколько процессов или узлов с общим хранилищем:
+    python monitor.py enqueue   - поставить задачи дня в очередь
+    python monitor.py worker [--once] - разбирать очередь (можно запускать несколько;
+                                        --once - выйти, когда очередь пуста)
 """
 
+import os
+import sys
 import schedule
 import time
 from datetime import datetime
 from database import Database
 from gee_client import GEEClient
 from change_detector import ChangeDetector
+from revisit_scheduler import RevisitScheduler
+from priority_scheduler import PriorityScheduler
+from monitoring_pipeline import MonitoringPipeline
+from fetch_coalescer import cluster_territories
+from job_queue import queue_from_env, default_worker_id, LeaseKeeper
+
+# 'png' - миниатюры getThumbURL, 'npy' - сырые каналы uint16 (computePixels, без перекодирования)
+FETCH_MODE = os.getenv('GEE_FETCH_MODE', 'png')
+# Для режима 'npy': 'rgb' или 'multispectral' (NIR/SWIR для NDVI, NDBI, NBR)
+FETCH_PROFILE = os.getenv('GEE_FETCH_PROFILE', 'rgb')
+# Загружать только территории, над которыми был новый пролет Sentinel-2 (GEE_REVISIT_AWARE=0 - все)
+REVISIT_AWARE = os.getenv('GEE_REVISIT_AWARE', '1').lower() not in ('0', 'false', 'no')
+# Прерванный прогон моложе этого срока (часы) продолжается, а не начинается заново
+RESUME_HOURS = float(os.getenv('MONITOR_RESUME_HOURS', '24'))
+# Наибольшее число территорий за прогон (0 - все); остальные откладываются по приоритету
+RUN_MAX_TERRITORIES = int(os.getenv('MONITOR_MAX_TERRITORIES', '0'))
+# Пауза рабочего процесса при пустой очереди (секунды)
+WORKER_POLL_SECONDS = float(os.getenv('MONITOR_WORKER_POLL', '30'))
+
+
+def select_territories(db, gee, territories, max_territories=None):
+    """
+    Территории с вероятным новым снимком по убыванию приоритета
+
+    max_territories - бюджет прогона (None - без ограничения), остальные откладываются
+    """
+    if REVISIT_AWARE and gee.catalog is not None:
+        print("\nПроверка новых пролетов Sentinel-2:")
+        scheduled = territories
+        territories = RevisitScheduler(db, gee.catalog).due_territories(territories)
+        print(f"К загрузке: {len(territories)} из {len(scheduled)}")
+        # Новых сцен нет - территория проверена и не считается "несвежей"
+        due = {territory['id'] for territory in territories}
+        db.mark_territories_checked([t['id'] for t in scheduled if t['id'] not in due])
 
+    if not territories:
+        return []
 
-def monitor_territory(territory, db, gee, detector):
-    """Мониторинг одной территории"""
-    print(f"\nТерритория: {territory['name']}")
-
-    # Получаем новое изображение
-    success, path, date, message = gee.get_satellite_image(
-        territory['latitude'],
-        territory['longitude'],
-        image_size=512
-    )
-
-    if not success:
-        print(f"   Ошибка: {message}")
-        return False
-
-    print(f"   Снимок от {date}")
-
-    # Анализируем изображение
-    analysis = gee.analyze_image(path)
-
-    # Сохраняем в базу
-    import os
-    file_size = os.path.getsize(path) if os.path.exists(path) else None
-    cloud_cover = analysis.get('cloud_cover', {}).get('percentage') if 'error' not in analysis else None
-
-    image_id = db.add_image(
-        territory['id'], path, date,
-        cloud_cover, file_size
-    )
-
-    # Проверяем облачность
-    if 'error' not in analysis:
-        cloud = analysis['cloud_cover']['percentage']
-        print(f"   Облачность: {cloud:.1f}%")
-
-        if cloud > 60:
-            print(f"   Высокая облачность")
-
-    # Проверяем изменения
-    changes = detector.detect_and_save_changes(territory['id'])
-    if changes:
-        change_percent = changes['change_percentage']
-        print(f"   Изменения: {change_percent:.1f}%")
-
-        if change_percent > 15:
-            print(f"   Значительные изменения обнаружены!")
-
-        # Проверяем, отправлено ли email уведомление
-        if hasattr(detector, 'email_config') and detector.email_config:
-            if detector.email_config.EMAIL_ENABLED and change_percent > detector.email_config.CHANGE_THRESHOLD:
-                print(f"   Email уведомление отправлено на {detector.email_config.EMAIL_TO}")
-
-    return True
+    # Сначала территории с активными изменениями и просроченные по SLA
+    print("\nПриоритет территорий:")
+    selected, deferred = PriorityScheduler(db).plan(territories, max_territories=max_territories)
+    if deferred:
+        print(f"Отложено до следующего прогона: {len(deferred)}")
+    return selected
 
 
 def daily_monitoring():
@@ -73,7 +69,7 @@ def daily_monitoring():
     print(f"{'=' * 60}")
 
     db = Database()
-    gee = GEEClient()
+    gee = GEEClient(database=db)
     detector = ChangeDetector(db, gee)
 
     territories = db.get_all_territories()
@@ -84,16 +80,42 @@ def daily_monitoring():
 
     print(f"\nНайдено территорий: {len(territories)}")
 
-    successful = 0
-    changes_detected = 0
+    # Прерванный прогон продолжается: готовые территории пропускаются
+    run_id, resumed = db.start_monitoring_run(RESUME_HOURS)
+    run_items = db.get_run_items(run_id)
+    if resumed:
+        finished = {tid for tid, item in run_items.items() if item['stage'] == 'done'}
+        print(f"Продолжение прерванного прогона #{run_id}: готово {len(finished)} из {len(run_items)}")
+        territories = [t for t in territories if t['id'] not in finished]
+
+    # Скачанные до прерывания снимки обрабатываются без проверки пролетов
+    in_progress = [t for t in territories if run_items.get(t['id'], {}).get('stage') in ('fetched', 'saved')]
+
+    candidates = [t for t in territories if t not in in_progress]
+    budget = max(0, RUN_MAX_TERRITORIES - len(in_progress)) if RUN_MAX_TERRITORIES > 0 else None
+    territories = in_progress + select_territories(db, gee, candidates, budget)
+
+    if not territories:
+        db.finish_monitoring_run(run_id)
+        print("\nНовых снимков нет, загрузка и детекция не требуются")
+        return
+
+    db.add_run_items(run_id, [t['id'] for t in territories])
 
-    for territory in territories:
-        if monitor_territory(territory, db, gee, detector):
-            successful += 1
+    # Загрузка, детекция, запись и уведомления идут одновременно разными этапами
+    pipeline = MonitoringPipeline(db, gee, detector, image_size=512,
+                                  fetch_mode=FETCH_MODE, profile=FETCH_PROFILE)
+    stats = pipeline.run(territories, run_id=run_id)
+    successful = len(territories) - stats.get('failed', 0) - stats.get('deferred', 0)
+    db.finish_monitoring_run(run_id)
+    # Раз в сутки счетчики статистики сверяются с таблицами
+    db.repair_statistics()
 
     print(f"\n{'=' * 60}")
     print(f"Мониторинг завершен: {successful}/{len(territories)} успешно")
-    print(f"Изменений обнаружено: {changes_detected}")
+    print(f"Изменений обнаружено: {stats.get('changes', 0)}")
+    pipeline.print_stats()
+    gee.rate_limiter.print_stats()
 
     # Отправляем сводный отчет если есть email уведомления
     if hasattr(detector, 'notifier') and detector.notifier and hasattr(detector, 'email_config'):
@@ -104,6 +126,91 @@ def daily_monitoring():
     print(f"{'=' * 60}")
 
 
+def enqueue_monitoring():
+    """
+    Постановка задач дня в общую очередь: одна задача на группу близких территорий
+
+    Задачи дня имеют ключ с датой, поэтому повторная постановка
+    (с этого же или другого узла) не создает дублей.
+    """
+    db = Database()
+    gee = GEEClient(database=db)
+    job_queue = queue_from_env()
+
+    territories = select_territories(db, gee, db.get_all_territories(),
+                                     RUN_MAX_TERRITORIES if RUN_MAX_TERRITORIES > 0 else None)
+    order = {territory['id']: position for position, territory in enumerate(territories)}
+    day = datetime.now().strftime('%Y-%m-%d')
+
+    added = 0
+    for cluster in cluster_territories(territories):
+        ids = sorted(territory['id'] for territory in cluster)
+        # Приоритет группы - по ее самой приоритетной территории
+        priority = len(territories) - min(order[territory_id] for territory_id in ids)
+        job_id = job_queue.enqueue('monitor', {'territory_ids': ids},
+                                   dedupe_key=f"monitor:{day}:{','.join(map(str, ids))}",
+                                   priority=priority)
+        if job_id is not None:
+            added += 1
+
+    print(f"\nПоставлено задач: {added}, очередь: {job_queue.stats()}")
+    db.repair_statistics()
+    return added
+
+
+def run_worker(worker_id=None, exit_when_empty=False):
+    """
+    Рабочий процесс очереди задач
+
+    Задачи:
+        monitor - {'territory_ids': [...]} загрузка, детекция и уведомления группы
+
+    Задача с неудачными или отложенными территориями возвращается в очередь
+    (до MONITOR_JOB_ATTEMPTS попыток). При повторе уже загруженные сцены
+    не скачиваются и не записываются заново.
+    """
+    worker_id = worker_id or default_worker_id()
+    job_queue = queue_from_env()
+    db = Database()
+    gee = GEEClient(database=db)
+    detector = ChangeDetector(db, gee)
+    pipeline = MonitoringPipeline(db, gee, detector, image_size=512,
+                                  fetch_mode=FETCH_MODE, profile=FETCH_PROFILE)
+    print(f"\nРабочий процесс {worker_id} запущен")
+
+    while True:
+        job = job_queue.claim(worker_id, kinds=('monitor',))
+        if job is None:
+            if exit_when_empty:
+                break
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+
+        print(f"\nЗадача {job['id']} ({job['kind']}), попытка {job['attempts']}")
+        with LeaseKeeper(job_queue, job, worker_id) as lease:
+            try:
+                territories = [t for t in map(db.get_territory, job['payload']['territory_ids']) if t]
+                result = pipeline.run(territories)
+                pipeline.print_stats()
+            except Exception as error:
+                print(f"   Ошибка задачи {job['id']}: {error}")
+                job_queue.fail(job['id'], worker_id, str(error))
+                continue
+
+        # Ошибки загрузки и детекции конвейер только считает - повтор задачи здесь
+        unfinished = result.get('failed', 0) + result.get('deferred', 0)
+        if unfinished:
+            error = f"не обработано территорий: {unfinished} из {len(territories)}"
+            print(f"   Задача {job['id']}: {error}")
+            job_queue.fail(job['id'], worker_id, error)
+            continue
+
+        if lease.lost or not job_queue.complete(job['id'], worker_id, result):
+            print(f"   Задача {job['id']} выполнена, но аренда истекла - ее мог повторить другой процесс")
+
+    print(f"\nОчередь пуста, рабочий процесс {worker_id} завершен: {job_queue.stats()}")
+
+
 def schedule_monitoring(hour=10, minute=0):
     """Настройка регулярного мониторинга по расписанию"""
     print(f"\nНастройка расписания...")
@@ -135,8 +242,10 @@ def main():
     print("1. Ручной запуск (сейчас)")
     print("2. Автоматический (ежедневно в 10:00)")
     print("3. Автоматический с выбором времени")
+    print("4. Поставить задачи в очередь (несколько процессов/узлов)")
+    print("5. Рабочий процесс очереди")
 
-    choice = input("\nВаш выбор (1-3): ").strip()
+    choice = input("\nВаш выбор (1-5): ").strip()
 
     if choice == '1':
         daily_monitoring()
@@ -149,13 +258,22 @@ def main():
             schedule_monitoring(hour=hour, minute=minute)
         except ValueError:
             print("Ошибка: введите числа")
+    elif choice == '4':
+        enqueue_monitoring()
+    elif choice == '5':
+        run_worker()
     else:
         print("Неверный выбор")
 
 
 if __name__ == "__main__":
     try:
-        main()
+        if len(sys.argv) > 1 and sys.argv[1] == 'enqueue':
+            enqueue_monitoring()
+        elif len(sys.argv) > 1 and sys.argv[1] == 'worker':
+            run_worker(exit_when_empty='--once' in sys.argv)
+        else:
+            main()
     except KeyboardInterrupt:
         print("\nВыход")
     except Exception as e:
@@ -0,0 +1,342 @@
+"""
+Конвейер мониторинга территорий
+
+Этапы связаны ограниченными очередями: когда следующий этап не успевает,
+очередь заполняется и предыдущий этап ждет. Сетевые загрузки и вычисления
+детекторов идут одновременно, и время прогона определяется самым
+медленным этапом, а не суммой всех этапов.
+
+    загрузка (пул потоков, группы близких территорий - одна загрузка)
+      -> анализ снимка и детекция изменений (пул потоков)
+      -> запись в БД (один поток)
+      -> email уведомления (один поток)
+
+С run_id этапы каждой территории отмечаются в run_items, и перезапуск
+прерванного прогона продолжает с последнего выполненного этапа: готовые
+территории пропускаются, уже скачанные снимки не загружаются повторно.
+
+Группы загружаются в порядке переданного списка (по приоритету), а с
+time_budget новые загрузки после исчерпания бюджета не начинаются -
+оставшиеся территории откладываются до следующего прогона.
+"""
+
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Dict, Any, List, Optional
+
+from fetch_coalescer import cluster_territories
+
+PIPELINE_FETCH_WORKERS = int(os.getenv('MONITOR_FETCH_WORKERS', '4'))
+PIPELINE_DETECT_WORKERS = int(os.getenv('MONITOR_DETECT_WORKERS', str(os.cpu_count() or 2)))
+# Емкость очередей между этапами
+PIPELINE_QUEUE_SIZE = int(os.getenv('MONITOR_QUEUE_SIZE', '8'))
+# Наибольшее число результатов, записываемых одной транзакцией
+PIPELINE_WRITE_BATCH = int(os.getenv('MONITOR_WRITE_BATCH', '32'))
+# Бюджет времени на загрузки одного прогона в секундах (0 - без ограничения)
+PIPELINE_TIME_BUDGET = float(os.getenv('MONITOR_TIME_BUDGET', '0'))
+
+_DONE = object()
+
+
+class MonitoringPipeline:
+    """Мониторинг списка территорий конвейером этапов"""
+
+    STAGES = ('fetch', 'detect', 'write', 'notify')
+
+    def __init__(self, db, gee, detector, image_size: int = 512,
+                 fetch_mode: str = 'png', profile: str = 'rgb',
+                 fetch_workers: int = PIPELINE_FETCH_WORKERS,
+                 detect_workers: int = PIPELINE_DETECT_WORKERS,
+                 queue_size: int = PIPELINE_QUEUE_SIZE,
+                 write_batch: int = PIPELINE_WRITE_BATCH):
+        self.db = db
+        self.gee = gee
+        self.detector = detector
+        self.image_size = image_size
+        self.fetch_mode = fetch_mode
+        self.profile = profile
+        self.fetch_workers = max(1, fetch_workers)
+        self.detect_workers = max(1, detect_workers)
+        self.queue_size = max(1, queue_size)
+        self.write_batch = max(1, write_batch)
+
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {}
+        self.run_id: Optional[int] = None
+        self.deadline: Optional[float] = None
+
+    def _count(self, key: str, value=1) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def _busy(self, stage: str, started: float) -> None:
+        """Время работы этапа (без ожидания очередей)"""
+        self._count(f'{stage}_seconds', time.time() - started)
+
+    def _mark(self, territory_id: int, stage: str, **fields) -> None:
+        """Отметка этапа территории в прогоне (без run_id - только время проверки для 'done')"""
+        try:
+            if stage == 'done':
+                self.db.mark_territories_checked([territory_id])
+            if self.run_id is not None:
+                self.db.update_run_item(self.run_id, territory_id, stage, **fields)
+        except Exception as error:
+            print(f"   Ошибка записи этапа прогона: {error}")
+
+    # ========== ЭТАПЫ ==========
+
+    def _fetch_worker(self, clusters: queue.Queue, detect_queue: queue.Queue) -> None:
+        while True:
+            try:
+                cluster = clusters.get_nowait()
+            except queue.Empty:
+                return
+
+            if self.deadline is not None and time.time() > self.deadline:
+                # Бюджет исчерпан: территории остаются 'pending' до следующего прогона
+                self._count('deferred', len(cluster))
+                continue
+
+            started = time.time()
+            try:
+                results = self.gee.get_coalesced_images(cluster, image_size=self.image_size,
+                                                        fetch_mode=self.fetch_mode, profile=self.profile)
+            except Exception as error:
+                results = {territory['id']: (False, None, None, str(error), {}) for territory in cluster}
+            self._busy('fetch', started)
+
+            for territory in cluster:
+                success, path, date, message, fetch_info = results[territory['id']]
+                if not success:
+                    print(f"   {territory['name']}: ошибка загрузки - {message}")
+                    self._count('failed')
+                    self._mark(territory['id'], 'failed', message=message)
+                elif fetch_info.get('reused'):
+                    # Та же сцена, что и в прошлый раз - сравнивать нечего
+                    print(f"   {territory['name']}: новой сцены нет, детекция пропущена")
+                    self._count('reused')
+                    self._mark(territory['id'], 'done', message=message)
+                else:
+                    self._count('fetched')
+                    self._mark(territory['id'], 'fetched', image_path=path, capture_date=date,
+                               scene_id=fetch_info.get('scene_id'),
+                               render_key=fetch_info.get('render_key'))
+                    # Блокируется, пока детекторы не разберут очередь
+                    detect_queue.put({'territory': territory, 'path': path, 'date': date,
+                                      'fetch_info': fetch_info})
+
+    def _detect_worker(self, detect_queue: queue.Queue, write_queue: queue.Queue) -> None:
+        while True:
+            item = detect_queue.get()
+            if item is _DONE:
+                return
+
+            started = time.time()
+            try:
+                item['analysis'] = self.gee.analyze_image(item['path'])
+
+                if item.get('image_id') is None:
+                    # Предыдущий снимок территории - новый еще не записан в БД
+                    old_image = self.db.get_latest_image(item['territory']['id'])
+                else:
+                    # Продолжение прогона: новый снимок уже записан, берем снимок до него
+                    old_image = next((image for image in self.db.get_territory_images(item['territory']['id'], 2)
+                                      if image['id'] != item['image_id']), None)
+                item['old_image'] = old_image
+                item['comparison'] = None
+                if old_image and old_image['image_path'] != item['path']:
+                    new_image = {'image_path': item['path'], 'capture_date': item['date']}
+                    item['comparison'] = self.detector.compare_images(old_image, new_image)
+            except Exception as error:
+                print(f"   {item['territory']['name']}: ошибка детекции - {error}")
+                traceback.print_exc()
+                item['comparison'] = None
+                item.setdefault('analysis', {'error': str(error)})
+            self._busy('detect', started)
+            write_queue.put(item)
+
+    def _writer(self, write_queue: queue.Queue, notify_queue: queue.Queue) -> None:
+        """Единственный поток, пишущий в БД"""
+        while True:
+            batch = [write_queue.get()]
+            # Все, что уже накопилось в очереди, пишется одной транзакцией
+            while batch[-1] is not _DONE and len(batch) < self.write_batch:
+                try:
+                    batch.append(write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is _DONE
+            items = [item for item in batch if item is not _DONE]
+
+            if items:
+                started = time.time()
+                try:
+                    self._write_batch(items, notify_queue)
+                except Exception as error:
+                    print(f"   Ошибка записи: {error}")
+                    self._count('failed', len(items))
+                    for item in items:
+                        self._mark(item['territory']['id'], 'failed', message=str(error))
+                self._busy('write', started)
+            if done:
+                return
+
+    def _write_batch(self, items: List[Dict[str, Any]], notify_queue: queue.Queue) -> None:
+        """Запись пачки: снимки, затем изменения и этапы прогона - по транзакции на каждое"""
+        new_items = [item for item in items if item.get('image_id') is None]
+        # Продолжение прогона: снимок уже записан до прерывания
+        saved_before = [item for item in items if item.get('image_id') is not None]
+        rows = []
+        for item in new_items:
+            analysis = item['analysis']
+            path = item['path']
+            rows.append({
+                'territory_id': item['territory']['id'],
+                'image_path': path,
+                'capture_date': item['date'],
+                'cloud_cover': analysis.get('cloud_cover', {}).get('percentage') if 'error' not in analysis else None,
+                'file_size': os.path.getsize(path) if os.path.exists(path) else None,
+                'scene_id': item['fetch_info'].get('scene_id'),
+                'render_key': item['fetch_info'].get('render_key')
+            })
+        if rows:
+            # С run_id этап 'saved' отмечается в той же транзакции
+            for item, image_id in zip(new_items, self.db.add_images_many(rows, run_id=self.run_id)):
+                item['image_id'] = image_id
+            self._count('saved', len(rows))
+
+        for item in saved_before:
+            if item['comparison'] is not None and self.db.has_change_for_image(item['image_id']):
+                # Изменения сохранены до прерывания, не хватило только отметки этапа
+                item['comparison'] = None
+
+        compared = [item for item in items if item['comparison'] is not None]
+        entries = [(item['territory']['id'], item['old_image'],
+                    {'id': item['image_id'], 'image_path': item['path'], 'capture_date': item['date']},
+                    item['comparison']) for item in compared]
+        if entries:
+            for item, entry, changes in zip(compared, entries, self.detector.save_changes_many(entries)):
+                self._count('changes')
+                print(f"   {item['territory']['name']}: изменения {changes['change_percentage']:.1f}%")
+                territory_id, old_image, new_image, comparison = entry
+                notify_queue.put((territory_id, changes['change_id'], comparison, new_image, old_image))
+
+        territory_ids = [item['territory']['id'] for item in items]
+        self.db.mark_territories_checked(territory_ids)
+        if self.run_id is not None:
+            self.db.mark_run_items(self.run_id, territory_ids, 'done')
+
+    def _notifier(self, notify_queue: queue.Queue) -> None:
+        while True:
+            item = notify_queue.get()
+            if item is _DONE:
+                return
+
+            started = time.time()
+            try:
+                if self.detector.notify_changes(*item):
+                    self._count('notified')
+            except Exception as error:
+                print(f"   Ошибка уведомления: {error}")
+            self._busy('notify', started)
+
+    # ========== ЗАПУСК ==========
+
+    def _resume_item(self, territory: Dict[str, Any], run_item: Dict[str, Any]) -> Dict[str, Any]:
+        """Элемент очереди детекции для территории, снимок которой скачан до прерывания"""
+        return {'territory': territory, 'path': run_item['image_path'], 'date': run_item['capture_date'],
+                'fetch_info': {'scene_id': run_item['scene_id'], 'render_key': run_item['render_key']},
+                'image_id': run_item['image_id'] if run_item['stage'] == 'saved' else None}
+
+    def run(self, territories: List[Dict[str, Any]], run_id: Optional[int] = None,
+            time_budget: float = PIPELINE_TIME_BUDGET) -> Dict[str, Any]:
+        """
+        Прогон всех территорий
+
+        Args:
+            territories: Территории для мониторинга в порядке приоритета
+            run_id: Прогон в monitoring_runs; этапы отмечаются в run_items,
+                    и территории продолжаются с последнего выполненного этапа
+            time_budget: Секунды, после которых новые загрузки не начинаются (0 - без ограничения)
+
+        Returns:
+            Счетчики (fetched, reused, failed, saved, changes, notified, resumed, skipped, deferred),
+            занятость этапов в секундах и общее время
+        """
+        self.stats = {}
+        self.run_id = run_id
+        started = time.time()
+        self.deadline = started + time_budget if time_budget and time_budget > 0 else None
+
+        run_items = self.db.get_run_items(run_id) if run_id is not None else {}
+        to_fetch, resumed = [], []
+        for territory in territories:
+            run_item = run_items.get(territory['id'])
+            stage = run_item['stage'] if run_item else 'pending'
+            if stage == 'done':
+                self._count('skipped')
+            elif stage in ('fetched', 'saved') and run_item['image_path'] and os.path.exists(run_item['image_path']):
+                resumed.append(self._resume_item(territory, run_item))
+            else:
+                # pending, failed или скачанный файл пропал - загружаем заново
+                to_fetch.append(territory)
+
+        # Группа загружается в очереди на месте своей самой приоритетной территории
+        order = {territory['id']: position for position, territory in enumerate(to_fetch)}
+        clusters: queue.Queue = queue.Queue()
+        for cluster in sorted(cluster_territories(to_fetch),
+                              key=lambda members: min(order[t['id']] for t in members)):
+            clusters.put(cluster)
+
+        detect_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        write_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        notify_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        fetchers = [threading.Thread(target=self._fetch_worker, args=(clusters, detect_queue),
+                                     name=f'fetch-{i}', daemon=True) for i in range(self.fetch_workers)]
+        detectors = [threading.Thread(target=self._detect_worker, args=(detect_queue, write_queue),
+                                      name=f'detect-{i}', daemon=True) for i in range(self.detect_workers)]
+        writer = threading.Thread(target=self._writer, args=(write_queue, notify_queue),
+                                  name='db-writer', daemon=True)
+        notifier = threading.Thread(target=self._notifier, args=(notify_queue,),
+                                    name='notifier', daemon=True)
+
+        for thread in fetchers + detectors + [writer, notifier]:
+            thread.start()
+
+        # Скачанные до прерывания снимки сразу идут на детекцию
+        for item in resumed:
+            self._count('resumed')
+            detect_queue.put(item)
+
+        # Завершение по этапам: каждый следующий этап получает _DONE после предыдущего
+        for thread in fetchers:
+            thread.join()
+        for _ in detectors:
+            detect_queue.put(_DONE)
+        for thread in detectors:
+            thread.join()
+        write_queue.put(_DONE)
+        writer.join()
+        notify_queue.put(_DONE)
+        notifier.join()
+
+        self.stats['total_seconds'] = time.time() - started
+        return dict(self.stats)
+
+    def print_stats(self) -> None:
+        stats = self.stats
+        print(f"\nКонвейер: загружено {stats.get('fetched', 0)}, без изменений {stats.get('reused', 0)}, "
+              f"ошибок {stats.get('failed', 0)}, записано {stats.get('saved', 0)}, "
+              f"сравнений {stats.get('changes', 0)}, уведомлений {stats.get('notified', 0)}")
+        if stats.get('deferred'):
+            print(f"   Отложено до следующего прогона (бюджет времени): {stats['deferred']}")
+        if stats.get('resumed') or stats.get('skipped'):
+            print(f"   Продолжение прогона: готовых пропущено {stats.get('skipped', 0)}, "
+                  f"продолжено со скачанного снимка {stats.get('resumed', 0)}")
+        print(f"   Общее время: {stats.get('total_seconds', 0):.1f} сек")
+        for stage in self.STAGES:
+            print(f"   Этап {stage}: занят {stats.get(f'{stage}_seconds', 0):.1f} сек")
@@ -17,6 +17,8 @@ from PIL import Image, ImageDraw
 import cv2
 import numpy as np
 
+from raster_store import load_bgr, is_raw_raster
+
 
 class NotificationManager:
     def __init__(self, config=None):
@@ -251,6 +253,10 @@ class NotificationManager:
             if not isinstance(file_path, str):
                 continue
 
+            # Сырые растры (.npy) не прикладываем - это не изображения
+            if is_raw_raster(file_path):
+                continue
+
             # Проверяем существование файла
             if os.path.exists(file_path):
                 try:
@@ -276,8 +282,8 @@ class NotificationManager:
             print("  🖼 Creating comparison image...")
 
             # Используем OpenCV
-            old_img = cv2.imread(old_path)
-            new_img = cv2.imread(new_path)
+            old_img = load_bgr(old_path)
+            new_img = load_bgr(new_path)
 
             if old_img is None or new_img is None:
                 print("   Failed to load images")
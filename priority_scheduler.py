@@ -0,0 +1,118 @@
+"""
+Приоритет территорий по истории изменений
+
+Территории с частыми недавними изменениями, свежими тревогами и давно не
+проверявшимися снимками обрабатываются первыми. Планировщик ограничивает
+прогон числом территорий (MONITOR_MAX_TERRITORIES); бюджет времени
+(MONITOR_TIME_BUDGET) соблюдает MonitoringPipeline, который обрабатывает
+территории в порядке приоритета и по истечении срока откладывает оставшиеся.
+В обоих случаях откладываются территории с наименьшим приоритетом.
+Отложенные территории с каждым днем становятся "несвежими" и после срока
+SLA идут в начало очереди. Несвежесть считается от последней успешной
+проверки (в том числе без новой сцены), а не от последнего снимка.
+"""
+
+import math
+import os
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+# Окно истории изменений (дни)
+PRIORITY_WINDOW_DAYS = int(os.getenv('MONITOR_PRIORITY_WINDOW_DAYS', '30'))
+# Процент изменений, считающийся тревогой (как порог уведомлений по умолчанию)
+PRIORITY_ALERT_THRESHOLD = float(os.getenv('MONITOR_PRIORITY_ALERT_THRESHOLD', '5.0'))
+# Наибольший срок между успешными проверками территории (дни)
+PRIORITY_SLA_DAYS = float(os.getenv('MONITOR_SLA_DAYS', '7'))
+# Срок, за который вклад последней тревоги убывает в e раз (дни)
+ALERT_DECAY_DAYS = 14.0
+
+# Веса составляющих приоритета
+WEIGHT_ACTIVITY = 3.0
+WEIGHT_ALERT = 2.0
+WEIGHT_STALENESS = 1.0
+# Надбавка территориям, вышедшим за срок SLA: они идут раньше всех остальных
+OVERDUE_BONUS = 10.0
+
+
+def _days_since(timestamp: Optional[str], now: datetime) -> Optional[float]:
+    if not timestamp:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(timestamp).replace('Z', ''))
+    except ValueError:
+        return None
+    return max(0.0, (now - moment).total_seconds() / 86400)
+
+
+class PriorityScheduler:
+    """Порядок и отбор территорий для прогона мониторинга"""
+
+    def __init__(self, db, window_days: int = PRIORITY_WINDOW_DAYS,
+                 alert_threshold: float = PRIORITY_ALERT_THRESHOLD,
+                 sla_days: float = PRIORITY_SLA_DAYS):
+        self.db = db
+        self.window_days = window_days
+        self.alert_threshold = alert_threshold
+        self.sla_days = sla_days
+
+    def score(self, activity: Dict[str, Any], now: Optional[datetime] = None) -> Tuple[float, str]:
+        """
+        Приоритет территории по строке Database.get_territory_activity
+
+        Returns:
+            (приоритет, пояснение)
+        """
+        now = now or datetime.utcnow()
+
+        # Частота тревог (в неделю, не больше 1) и средний процент изменений за окно
+        alerts_per_week = activity.get('recent_alerts', 0) * 7 / max(1, self.window_days)
+        activity_score = min(1.0, alerts_per_week) + (activity.get('avg_change') or 0) / 100
+
+        since_alert = _days_since(activity.get('last_alert_at'), now)
+        alert_score = math.exp(-since_alert / ALERT_DECAY_DAYS) if since_alert is not None else 0.0
+
+        # Проверок еще не было - территория считается вышедшей за срок
+        since_check = _days_since(activity.get('last_checked_at'), now)
+        staleness = self.sla_days if since_check is None else since_check
+        overdue = staleness >= self.sla_days
+
+        score = (WEIGHT_ACTIVITY * activity_score + WEIGHT_ALERT * alert_score +
+                 WEIGHT_STALENESS * staleness / self.sla_days + (OVERDUE_BONUS if overdue else 0.0))
+
+        reason = (f"тревог за {self.window_days} дн.: {activity.get('recent_alerts', 0)}, "
+                  f"последняя тревога: {'нет' if since_alert is None else f'{since_alert:.0f} дн. назад'}, "
+                  f"проверка: {'нет' if since_check is None else f'{since_check:.0f} дн. назад'}"
+                  f"{', просрочен SLA' if overdue else ''}")
+        return score, reason
+
+    def plan(self, territories: List[Dict[str, Any]], max_territories: Optional[int] = None,
+             now: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Территории по убыванию приоритета в пределах бюджета числа территорий
+
+        Бюджет времени прогона здесь не учитывается: его соблюдает
+        MonitoringPipeline.run (time_budget), обрабатывая территории в этом порядке.
+
+        Args:
+            territories: Кандидаты на прогон
+            max_territories: Наибольшее число территорий (None - без ограничения)
+
+        Returns:
+            (к_обработке, отложенные)
+        """
+        now = now or datetime.utcnow()
+        activity = self.db.get_territory_activity(self.window_days, self.alert_threshold)
+
+        scored = []
+        for territory in territories:
+            score, reason = self.score(activity.get(territory['id'], {}), now)
+            scored.append((score, territory, reason))
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+
+        limit = len(scored) if max_territories is None else max(0, max_territories)
+        for position, (score, territory, reason) in enumerate(scored):
+            mark = '' if position < limit else ' (отложена)'
+            print(f"   {territory['name']}: приоритет {score:.2f}{mark} - {reason}")
+
+        ordered = [territory for _, territory, _ in scored]
+        return ordered[:limit], ordered[limit:]
@@ -0,0 +1,134 @@
+"""
+Индекс загруженных растров по сцене и географическим границам
+
+Запрос области, целиком лежащей внутри уже загруженного растра той же
+сцены и того же разрешения, обслуживается локальной вырезкой без GEE.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional, Dict, Any, Sequence, Tuple
+
+import numpy as np
+
+from database import ThreadConnections
+
+# Допустимое расхождение размера пикселя (сетки групп считаются по широте центра)
+RESOLUTION_TOLERANCE = 0.01
+
+
+class RasterIndex:
+    """Таблица raster_index: путь к .npy, сцена, каналы, границы и сетка пикселей"""
+
+    def __init__(self, db_path: str = "satellite_monitor.db"):
+        self.db_path = Path(db_path)
+        self._connections = ThreadConnections(self.db_path)
+        self._init_tables()
+
+    def _init_tables(self) -> None:
+        with self._connections.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS raster_index (
+                    path TEXT PRIMARY KEY,
+                    scene_id TEXT NOT NULL,
+                    bands TEXT NOT NULL,
+                    min_lon REAL NOT NULL,
+                    min_lat REAL NOT NULL,
+                    max_lon REAL NOT NULL,
+                    max_lat REAL NOT NULL,
+                    pixel_width REAL NOT NULL,
+                    pixel_height REAL NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_raster_index_scene
+                ON raster_index (scene_id, min_lon, max_lon)
+            ''')
+            conn.commit()
+
+    def register(self, path: str, metadata: Dict[str, Any], shape: Sequence[int]) -> None:
+        """Добавление загруженного растра (метаданные RasterStore со scene_id)"""
+        if not metadata.get('scene_id') or not metadata.get('geotransform'):
+            return
+        min_lon, min_lat, max_lon, max_lat = metadata['bounds']
+        _, dx, _, _, _, dy = metadata['geotransform']
+        with self._connections.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO raster_index
+                (path, scene_id, bands, min_lon, min_lat, max_lon, max_lat,
+                 pixel_width, pixel_height, width, height)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (str(path), metadata['scene_id'], ','.join(metadata['bands']),
+                  min_lon, min_lat, max_lon, max_lat, dx, abs(dy), shape[1], shape[0]))
+            conn.commit()
+
+    def _remove(self, path: str) -> None:
+        with self._connections.transaction() as conn:
+            conn.execute('DELETE FROM raster_index WHERE path = ?', (path,))
+            conn.commit()
+
+    def find_covering(self, scene_id: str, bands: Sequence[str],
+                      bounds: Tuple[float, float, float, float],
+                      width: int, height: int) -> Optional[Dict[str, Any]]:
+        """
+        Наименьший загруженный растр сцены, целиком покрывающий область
+        с тем же размером пикселя
+
+        Returns:
+            {'path', 'row', 'col', 'channels', 'bounds', 'geotransform'} или None
+        """
+        min_lon, min_lat, max_lon, max_lat = bounds
+        dx = (max_lon - min_lon) / width
+        dy = (max_lat - min_lat) / height
+
+        with self._connections.transaction(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM raster_index
+                WHERE scene_id = ? AND min_lon <= ? AND max_lon >= ? AND min_lat <= ? AND max_lat >= ?
+                ORDER BY width * height
+            ''', (scene_id, min_lon + dx / 2, max_lon - dx / 2, min_lat + dy / 2, max_lat - dy / 2))
+            rows = [dict(row) for row in cursor.fetchall()]
+
+        for row in rows:
+            names = row['bands'].split(',')
+            if any(band not in names for band in bands):
+                continue
+            if (abs(dx / row['pixel_width'] - 1) > RESOLUTION_TOLERANCE or
+                    abs(dy / row['pixel_height'] - 1) > RESOLUTION_TOLERANCE):
+                continue
+
+            # Смещение окна на сетке растра (с точностью до половины пикселя)
+            col = int(round((min_lon - row['min_lon']) / row['pixel_width']))
+            top = int(round((row['max_lat'] - max_lat) / row['pixel_height']))
+            if col < 0 or top < 0 or col + width > row['width'] or top + height > row['height']:
+                continue
+
+            if not os.path.exists(row['path']):
+                self._remove(row['path'])
+                continue
+
+            x0 = row['min_lon'] + col * row['pixel_width']
+            y0 = row['max_lat'] - top * row['pixel_height']
+            return {
+                'path': row['path'],
+                'row': top,
+                'col': col,
+                'channels': [names.index(band) for band in bands],
+                'bounds': [x0, y0 - height * row['pixel_height'], x0 + width * row['pixel_width'], y0],
+                # Порядок GDAL: (x0, dx, 0, y0, 0, dy)
+                'geotransform': [x0, row['pixel_width'], 0.0, y0, 0.0, -row['pixel_height']]
+            }
+        return None
+
+
+def crop_raster(raster: np.ndarray, match: Dict[str, Any], width: int, height: int) -> np.ndarray:
+    """Вырезка окна найденного растра (копия, чтобы не держать исходный memmap)"""
+    row, col = match['row'], match['col']
+    return np.ascontiguousarray(raster[row:row + height, col:col + width][:, :, match['channels']])
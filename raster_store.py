@@ -0,0 +1,259 @@
+"""
+Хранилище сырых растров Sentinel-2 (NPY) для детекторов изменений
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, Sequence, Tuple
+
+import numpy as np
+
+# Каналы и растяжка, совпадающие с настройками getThumbURL
+RGB_BANDS = ['B4', 'B3', 'B2']
+DEFAULT_STRETCH = (500, 3000)
+
+# Профили загрузки: набор каналов Sentinel-2, сохраняемых в .npy
+FETCH_PROFILES = {
+    'rgb': RGB_BANDS,
+    # + NIR (B8) и SWIR (B11, B12) для настоящих вегетационных индексов
+    'multispectral': RGB_BANDS + ['B8', 'B11', 'B12']
+}
+
+# Нормализованные разности (a - b) / (a + b)
+SPECTRAL_INDICES = {
+    'ndvi': ('B8', 'B4'),   # растительность
+    'ndbi': ('B11', 'B8'),  # застройка
+    'nbr': ('B8', 'B12')    # гари и вырубки
+}
+
+_LUT_CACHE: Dict[Tuple[int, int], np.ndarray] = {}
+_STACK_CACHE: 'OrderedDict[Tuple[str, float], BandStack]' = OrderedDict()
+_STACK_CACHE_SIZE = 8
+_STACK_LOCK = threading.Lock()
+
+
+class RasterStore:
+    """Кэш многоканальных растров в формате .npy с метаданными в .json"""
+
+    def __init__(self, root: str = 'satellite_images/raw'):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        """Путь к растру по ключу кэша"""
+        return self.root / f"{key}.npy"
+
+    def exists(self, key: str) -> bool:
+        return self.path_for(key).exists()
+
+    def save(self, key: str, array: np.ndarray, metadata: Dict[str, Any]) -> str:
+        """
+        Сохранение растра и метаданных (атомарно, через временный файл)
+
+        Args:
+            key: Ключ кэша
+            array: Массив (H, W, C) uint16
+            metadata: Каналы, границы, геопривязка, дата съемки и т.д.
+
+        Returns:
+            Путь к .npy файлу
+        """
+        path = self.path_for(key)
+        tmp_path = self._tmp_path(key)
+
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+        self._write_metadata(path, array.shape, array.dtype, metadata)
+        return str(path)
+
+    def create(self, key: str, shape: Tuple[int, ...], dtype=np.uint16) -> np.memmap:
+        """
+        Пустой растр на диске для записи по частям (мозаика из тайлов)
+
+        Пишется во временный файл; после заполнения вызвать finalize()
+        """
+        return np.lib.format.open_memmap(str(self._tmp_path(key)), mode='w+',
+                                         dtype=dtype, shape=tuple(shape))
+
+    def finalize(self, key: str, array: np.memmap, metadata: Dict[str, Any]) -> str:
+        """Сброс растра, созданного create(), на диск и публикация под ключом"""
+        path = self.path_for(key)
+        array.flush()
+        os.replace(self._tmp_path(key), path)
+
+        self._write_metadata(path, array.shape, array.dtype, metadata)
+        return str(path)
+
+    def discard(self, key: str) -> None:
+        """Удаление недописанного временного растра"""
+        tmp_path = self._tmp_path(key)
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    def _tmp_path(self, key: str) -> Path:
+        path = self.path_for(key)
+        return path.with_name(path.name + '.tmp')
+
+    @staticmethod
+    def _write_metadata(path: Path, shape: Tuple[int, ...], dtype,
+                        metadata: Dict[str, Any]) -> None:
+        meta = dict(metadata)
+        meta['shape'] = list(shape)
+        meta['dtype'] = str(dtype)
+        with open(metadata_path(path), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def is_raw_raster(path: Optional[str]) -> bool:
+    """Является ли файл сырым растром (.npy)"""
+    return bool(path) and str(path).lower().endswith('.npy')
+
+
+def metadata_path(path) -> Path:
+    """Путь к файлу метаданных растра"""
+    return Path(path).with_suffix('.json')
+
+
+def load_raster(path: str, mmap: bool = True) -> np.ndarray:
+    """Загрузка растра; по умолчанию файл отображается в память (без копирования)"""
+    return np.load(str(path), mmap_mode='r' if mmap else None)
+
+
+def load_metadata(path: str) -> Dict[str, Any]:
+    """Метаданные растра (пустой словарь, если файла нет)"""
+    meta_file = metadata_path(path)
+    if not meta_file.exists():
+        return {}
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _stretch_lut(stretch: Sequence[int]) -> np.ndarray:
+    """Таблица uint16 -> uint8 для линейной растяжки (строится один раз)"""
+    low, high = int(stretch[0]), int(stretch[1])
+    lut = _LUT_CACHE.get((low, high))
+    if lut is None:
+        values = (np.arange(65536, dtype=np.float32) - low) * (255.0 / max(high - low, 1))
+        lut = np.clip(values, 0, 255).astype(np.uint8)
+        _LUT_CACHE[(low, high)] = lut
+    return lut
+
+
+def to_display_bgr(bands: np.ndarray, band_names: Sequence[str],
+                   stretch: Sequence[int] = DEFAULT_STRETCH) -> np.ndarray:
+    """
+    Перевод сырых каналов в 8-битное BGR изображение (формат OpenCV)
+
+    Args:
+        bands: Массив (H, W, C) uint16
+        band_names: Имена каналов в порядке последней оси
+        stretch: Диапазон (min, max) для линейной растяжки
+    """
+    names = list(band_names)
+    order = [names.index(b) for b in ('B2', 'B3', 'B4')]
+    lut = _stretch_lut(stretch)
+    return lut[bands[:, :, order]]
+
+
+def load_bgr(path: str) -> Optional[np.ndarray]:
+    """
+    Загрузка изображения для детекторов: .npy через memmap, остальное через OpenCV
+
+    Returns:
+        BGR uint8 массив или None, если загрузить не удалось
+    """
+    if is_raw_raster(path):
+        if not os.path.exists(path):
+            return None
+        meta = load_metadata(path)
+        return to_display_bgr(load_raster(path),
+                              meta.get('bands', RGB_BANDS),
+                              meta.get('stretch', DEFAULT_STRETCH))
+
+    import cv2
+    return cv2.imread(str(path))
+
+
+def normalized_difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Векторизованная нормализованная разность (a - b) / (a + b), 0 где сумма равна 0"""
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    total = a + b
+    result = np.zeros_like(total)
+    np.divide(a - b, total, out=result, where=total > 0)
+    return result
+
+
+class BandStack:
+    """Мультиспектральный растр с лениво вычисляемыми индексами (NDVI, NDBI, NBR)"""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.metadata = load_metadata(self.path)
+        self.bands = load_raster(self.path)
+        self.band_names = list(self.metadata.get('bands', RGB_BANDS))
+        self._indices: Dict[str, np.ndarray] = {}
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.bands.shape[0], self.bands.shape[1]
+
+    def has_bands(self, *names: str) -> bool:
+        return all(name in self.band_names for name in names)
+
+    def band(self, name: str) -> np.ndarray:
+        """Канал по имени (представление memmap без копирования)"""
+        return self.bands[:, :, self.band_names.index(name)]
+
+    def supports_index(self, name: str) -> bool:
+        return name in SPECTRAL_INDICES and self.has_bands(*SPECTRAL_INDICES[name])
+
+    def index(self, name: str) -> np.ndarray:
+        """Спектральный индекс (вычисляется один раз и переиспользуется)"""
+        if name not in self._indices:
+            first, second = SPECTRAL_INDICES[name]
+            self._indices[name] = normalized_difference(self.band(first), self.band(second))
+        return self._indices[name]
+
+    def compute_indices(self) -> Dict[str, np.ndarray]:
+        """Все индексы, доступные для набора каналов"""
+        return {name: self.index(name) for name in SPECTRAL_INDICES if self.supports_index(name)}
+
+    def to_bgr(self) -> np.ndarray:
+        return to_display_bgr(self.bands, self.band_names,
+                              self.metadata.get('stretch', DEFAULT_STRETCH))
+
+
+def load_band_stack(path: Optional[str]) -> Optional[BandStack]:
+    """
+    Загрузка мультиспектрального растра с индексами
+
+    Недавно загруженные растры кэшируются, поэтому несколько детекторов,
+    работающих с одним снимком, используют одни и те же индексы.
+
+    Returns:
+        BandStack или None, если файл не является сырым растром
+    """
+    if not is_raw_raster(path) or not os.path.exists(path):
+        return None
+
+    cache_key = (os.path.abspath(path), os.path.getmtime(path))
+    with _STACK_LOCK:
+        stack = _STACK_CACHE.get(cache_key)
+        if stack is not None:
+            _STACK_CACHE.move_to_end(cache_key)
+            return stack
+
+    stack = BandStack(path)
+    stack.compute_indices()
+
+    with _STACK_LOCK:
+        _STACK_CACHE[cache_key] = stack
+        while len(_STACK_CACHE) > _STACK_CACHE_SIZE:
+            _STACK_CACHE.popitem(last=False)
+    return stack
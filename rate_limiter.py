@@ -0,0 +1,222 @@
+"""
+Ограничение частоты запросов к Google Earth Engine на стороне клиента
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional
+
+# Признаки ответа GEE о превышении квоты
+QUOTA_ERROR_MARKERS = (
+    '429',
+    'too many requests',
+    'too many concurrent aggregations',
+    'quota exceeded',
+    'rate limit'
+)
+
+
+class QuotaExceededError(Exception):
+    """GEE отклонил запрос из-за квоты (HTTP 429)"""
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Является ли ошибка отказом GEE по квоте"""
+    if isinstance(error, QuotaExceededError):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in QUOTA_ERROR_MARKERS)
+
+
+class TokenBucket:
+    """Ведро токенов: не более rate запросов в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: int):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Получение токена (блокирует поток до появления токена)
+
+        Returns:
+            Время ожидания в секундах
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self, factor: float = 0.5, min_rate: float = 0.1) -> None:
+        """Снижение скорости после отказа GEE"""
+        with self._lock:
+            self._refill()
+            self.rate = max(min_rate, self.rate * factor)
+
+    def recover(self, step: float = 0.05) -> None:
+        """Постепенное возвращение к исходной скорости после успешных запросов"""
+        with self._lock:
+            if self.rate < self.base_rate:
+                self._refill()
+                self.rate = min(self.base_rate, self.rate + self.base_rate * step)
+
+
+class RateLimiter:
+    """
+    Ограничитель запросов к GEE
+
+    Два независимых канала:
+        compute  - getInfo, getThumbURL, computePixels
+        download - скачивание файлов по URL
+
+    Для каждого канала: ведро токенов, лимит одновременных запросов
+    и экспоненциальная задержка с адаптивным снижением скорости при 429.
+    """
+
+    def __init__(self, compute_rate: float = 10.0, compute_burst: int = 20, max_concurrent_compute: int = 8,
+                 download_rate: float = 5.0, download_burst: int = 10, max_concurrent_download: int = 4,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.buckets = {
+            'compute': TokenBucket(compute_rate, compute_burst),
+            'download': TokenBucket(download_rate, download_burst)
+        }
+        self.semaphores = {
+            'compute': threading.BoundedSemaphore(max_concurrent_compute),
+            'download': threading.BoundedSemaphore(max_concurrent_download)
+        }
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            kind: {'requests': 0, 'throttled': 0, 'retries': 0, 'errors': 0,
+                   'wait_seconds': 0.0, 'backoff_seconds': 0.0, 'active': 0}
+            for kind in self.buckets
+        }
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        """Настройки из переменных окружения GEE_*"""
+        return cls(
+            compute_rate=float(os.getenv('GEE_COMPUTE_RATE', '10')),
+            compute_burst=int(os.getenv('GEE_COMPUTE_BURST', '20')),
+            max_concurrent_compute=int(os.getenv('GEE_MAX_CONCURRENT_COMPUTE', '8')),
+            download_rate=float(os.getenv('GEE_DOWNLOAD_RATE', '5')),
+            download_burst=int(os.getenv('GEE_DOWNLOAD_BURST', '10')),
+            max_concurrent_download=int(os.getenv('GEE_MAX_CONCURRENT_DOWNLOAD', '4')),
+            max_retries=int(os.getenv('GEE_MAX_RETRIES', '5'))
+        )
+
+    def _count(self, kind: str, key: str, value=1) -> None:
+        with self._stats_lock:
+            self._stats[kind][key] += value
+
+    @contextmanager
+    def slot(self, kind: str = 'compute'):
+        """Место для одного запроса: токен + лимит одновременных запросов"""
+        waited = self.buckets[kind].acquire()
+        started = time.monotonic()
+        with self.semaphores[kind]:
+            waited += time.monotonic() - started
+            self._count(kind, 'requests')
+            self._count(kind, 'wait_seconds', waited)
+            self._count(kind, 'active')
+            try:
+                yield
+            finally:
+                self._count(kind, 'active', -1)
+
+    def call(self, kind: str, func: Callable, *args, **kwargs):
+        """
+        Выполнение запроса с ограничением частоты и повтором при отказе по квоте
+
+        Остальные ошибки пробрасываются сразу, без повторов.
+        """
+        bucket = self.buckets[kind]
+        attempt = 0
+        while True:
+            try:
+                with self.slot(kind):
+                    result = func(*args, **kwargs)
+                bucket.recover()
+                return result
+            except Exception as error:
+                if not is_quota_error(error):
+                    self._count(kind, 'errors')
+                    raise
+
+                self._count(kind, 'throttled')
+                bucket.slow_down()
+                if attempt >= self.max_retries:
+                    self._count(kind, 'errors')
+                    raise
+
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.0)  # разброс, чтобы потоки не повторяли одновременно
+                attempt += 1
+                self._count(kind, 'retries')
+                self._count(kind, 'backoff_seconds', delay)
+                print(f"   Квота GEE ({kind}): повтор {attempt}/{self.max_retries} через {delay:.1f} сек")
+                time.sleep(delay)
+
+    def compute(self, func: Callable, *args, **kwargs):
+        return self.call('compute', func, *args, **kwargs)
+
+    def download(self, func: Callable, *args, **kwargs):
+        return self.call('download', func, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики запросов и текущая скорость по каналам"""
+        with self._stats_lock:
+            result = {kind: dict(values) for kind, values in self._stats.items()}
+        for kind, bucket in self.buckets.items():
+            result[kind]['rate'] = bucket.rate
+            result[kind]['base_rate'] = bucket.base_rate
+        return result
+
+    def estimate_seconds(self, compute_requests: int = 0, download_requests: int = 0) -> float:
+        """Минимальное время выполнения запросов при текущей скорости (для планирования прогонов)"""
+        compute = self.buckets['compute']
+        download = self.buckets['download']
+        return max(max(0, compute_requests - compute.capacity) / compute.rate,
+                   max(0, download_requests - download.capacity) / download.rate)
+
+    def print_stats(self) -> None:
+        print("\nЗапросы к GEE:")
+        for kind, values in self.stats().items():
+            print(f"   {kind}: {values['requests']} запросов, "
+                  f"отказов по квоте: {values['throttled']}, повторов: {values['retries']}, "
+                  f"ожидание: {values['wait_seconds'] + values['backoff_seconds']:.1f} сек, "
+                  f"скорость: {values['rate']:.1f}/{values['base_rate']:.1f} в сек")
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Общий ограничитель процесса (квота GEE одна на проект)"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter.from_env()
+        return _default_limiter
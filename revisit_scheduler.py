@@ -0,0 +1,135 @@
+"""
+Планирование мониторинга по пролетам Sentinel-2
+
+Sentinel-2 снимает одну точку раз в несколько дней, поэтому ежедневная
+загрузка и детекция для каждой территории в основном повторяют прошлый
+результат. Период пролетов над точкой оценивается по времени прошлых сцен
+из локального каталога; территория ставится в очередь, только если
+ожидаемый пролет уже наступил и дешевая проверка метаданных (обновление
+каталога, без пикселей) показала, что загрузка выберет еще не сохраненную
+сцену. Сцена выбирается так же, как при загрузке (SceneCatalog.find_scene
+за SEARCH_WINDOW_DAYS дней), иначе территория с более свежей, но облачной
+сценой ставилась бы в очередь каждый день без нового снимка.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from scene_catalog import SEARCH_WINDOW_DAYS, search_window
+
+# Период, по которому оценивается частота пролетов
+REVISIT_HISTORY_DAYS = int(os.getenv('GEE_REVISIT_HISTORY_DAYS', '90'))
+# Как часто можно повторять проверку метаданных для одной точки (часы)
+REVISIT_PROBE_HOURS = float(os.getenv('GEE_REVISIT_PROBE_HOURS', '1'))
+# Задержка появления сцены в GEE после съемки
+INGESTION_LAG = timedelta(hours=12)
+
+
+def estimate_period(times: List[datetime]) -> Optional[float]:
+    """
+    Период пролетов в днях (медиана интервалов между съемками разных дней)
+
+    Returns:
+        None, если съемок меньше двух
+    """
+    days = sorted({moment.date() for moment in times})
+    intervals = sorted((b - a).days for a, b in zip(days, days[1:]))
+    if not intervals:
+        return None
+    return float(intervals[len(intervals) // 2])
+
+
+class RevisitScheduler:
+    """Отбор территорий, для которых вероятно появился новый снимок"""
+
+    def __init__(self, db, catalog, max_cloud: float = 30.0):
+        """
+        Args:
+            db: База данных (последние снимки территорий)
+            catalog: Каталог сцен SceneCatalog
+            max_cloud: Облачность, при которой сцена пригодна для детекции
+        """
+        self.db = db
+        self.catalog = catalog
+        self.max_cloud = max_cloud
+
+    def predict_next(self, latitude: float, longitude: float,
+                     now: Optional[datetime] = None) -> Tuple[Optional[datetime], Optional[float]]:
+        """
+        Ожидаемое время следующего пролета по локальному каталогу (без запросов к GEE)
+
+        Returns:
+            (время_пролета, период_в_днях) или (None, None), если истории мало
+        """
+        now = now or datetime.utcnow()
+        start = (now - timedelta(days=REVISIT_HISTORY_DAYS)).strftime('%Y-%m-%d')
+        end = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+
+        # Пролеты считаются по всем сценам, облачные тоже
+        times = [datetime.utcfromtimestamp(scene['time_start'] / 1000)
+                 for scene in self.catalog.scenes(latitude, longitude, start, end)]
+        period = estimate_period(times)
+        if period is None:
+            return None, None
+
+        predicted = max(times) + timedelta(days=period)
+        # Пропущенные пролеты (каталог давно не обновлялся) - берем ближайший после последнего
+        while predicted + timedelta(days=period) <= now:
+            predicted += timedelta(days=period)
+        return predicted, period
+
+    def check(self, territory: Dict[str, Any], now: Optional[datetime] = None) -> Tuple[bool, str]:
+        """
+        Нужна ли территории загрузка и детекция
+
+        Returns:
+            (в_очередь, причина)
+        """
+        # Дата запроса - как у загрузки (GEEClient.get_satellite_image без даты)
+        window_start, window_end = search_window((now or datetime.now()).strftime('%Y-%m-%d'))
+        now = now or datetime.utcnow()
+        latitude, longitude = territory['latitude'], territory['longitude']
+        start = min((now - timedelta(days=REVISIT_HISTORY_DAYS)).strftime('%Y-%m-%d'), window_start)
+        end = max((now + timedelta(days=1)).strftime('%Y-%m-%d'), window_end)
+
+        stored = self.db.get_territory_scene_ids(territory['id'])
+
+        def chosen_scene() -> Optional[Dict[str, Any]]:
+            # Та же сцена, которую выберет загрузка: наименее облачная в окне поиска
+            scene, _ = self.catalog.find_scene(latitude, longitude, window_start, window_end,
+                                               self.max_cloud)
+            return scene
+
+        # Каталог уже знает сцену, которой нет среди сохраненных снимков
+        scene = chosen_scene()
+        if scene is not None and scene['scene_id'] not in stored:
+            return True, f"новая сцена от {scene['date']}"
+
+        # Ожидаемый пролет еще не наступил (или сцена еще не появилась в GEE)
+        predicted, period = self.predict_next(latitude, longitude, now)
+        if predicted is not None and now < predicted + INGESTION_LAG:
+            return False, f"следующий пролет ~{predicted.strftime('%Y-%m-%d')} (раз в {period:g} дн.)"
+
+        # Проверка метаданных: обновление каталога без загрузки пикселей
+        if not self.catalog.ensure(latitude, longitude, start, end, max_age_hours=REVISIT_PROBE_HOURS):
+            # Каталог недоступен - территорию не пропускаем
+            return True, "каталог сцен недоступен"
+
+        scene = chosen_scene()
+        if scene is None:
+            return False, f"нет сцен с облачностью < {self.max_cloud}% за {SEARCH_WINDOW_DAYS} дней"
+        if scene['scene_id'] not in stored:
+            return True, f"новая сцена от {scene['date']}"
+        return False, f"новых сцен нет (сцена от {scene['date']} уже загружена)"
+
+    def due_territories(self, territories: List[Dict[str, Any]],
+                        now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Территории, для которых стоит запускать загрузку и детекцию"""
+        due = []
+        for territory in territories:
+            queued, reason = self.check(territory, now)
+            print(f"   {territory['name']}: {'в очереди' if queued else 'пропуск'} - {reason}")
+            if queued:
+                due.append(territory)
+        return due
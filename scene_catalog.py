@@ -0,0 +1,315 @@
+"""
+Локальный каталог сцен Sentinel-2 по точкам мониторинга
+
+Вместо поиска по коллекции GEE при каждой загрузке список сцен над точкой
+хранится в SQLite и дополняется инкрементально: запрашиваются только сцены
+новее последней синхронизации, страницами по CATALOG_BATCH_SIZE записей
+за один запрос. Выбор снимка, дозагрузка истории и список доступных дат
+для интерфейса работают по каталогу без обращения к GEE.
+"""
+
+import calendar
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from database import ThreadConnections
+
+# Каталог включен по умолчанию (GEE_SCENE_CATALOG=0 - поиск в GEE при каждой загрузке)
+CATALOG_ENABLED = os.getenv('GEE_SCENE_CATALOG', '1').lower() not in ('0', 'false', 'no')
+# Записей каталога в одном запросе к GEE
+CATALOG_BATCH_SIZE = int(os.getenv('GEE_CATALOG_BATCH', '200'))
+# Как часто проверять новые сцены для текущих дат (часы)
+CATALOG_MAX_AGE_HOURS = float(os.getenv('GEE_CATALOG_MAX_AGE_HOURS', '6'))
+# Сцены появляются в GEE с задержкой, поэтому последние дни запрашиваются повторно
+CATALOG_OVERLAP_DAYS = 3
+# Снимок выбирается среди сцен за столько дней до даты запроса
+SEARCH_WINDOW_DAYS = 60
+
+DAY_MS = 24 * 3600 * 1000
+
+
+def date_to_ms(date: str) -> int:
+    """'YYYY-MM-DD' -> мс UTC"""
+    return calendar.timegm(datetime.strptime(date, '%Y-%m-%d').timetuple()) * 1000
+
+
+def search_window(date: str) -> Tuple[str, str]:
+    """Период [start, end) поиска снимка на дату 'YYYY-MM-DD'"""
+    target_date = datetime.strptime(date, '%Y-%m-%d')
+    return ((target_date - timedelta(days=SEARCH_WINDOW_DAYS)).strftime('%Y-%m-%d'),
+            (target_date + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+
+def point_key(latitude: float, longitude: float) -> str:
+    return f"{latitude:.5f},{longitude:.5f}"
+
+
+class SceneCatalog:
+    """
+    Каталог сцен над точками (территориями)
+
+    scene_catalog - сцены над точкой: id, время съемки, облачность, охват
+    catalog_sync  - синхронизированный период [synced_from, synced_until)
+                    и время последней проверки новых сцен
+    """
+
+    def __init__(self, db_path: str = "satellite_monitor.db",
+                 backend_provider: Optional[Callable[[], Any]] = None,
+                 rate_limiter=None):
+        """
+        Args:
+            db_path: Путь к базе данных
+            backend_provider: Функция, возвращающая источник снимков (вызывается только при обновлении)
+            rate_limiter: Ограничитель запросов к GEE
+        """
+        self.db_path = Path(db_path)
+        self._connections = ThreadConnections(self.db_path)
+        self.backend_provider = backend_provider
+        self.rate_limiter = rate_limiter
+        self._point_locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._stats = {'lookups': 0, 'refreshes': 0, 'requests': 0, 'scenes_added': 0}
+        self._init_tables()
+
+    def _init_tables(self) -> None:
+        with self._connections.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scene_catalog (
+                    point_key TEXT NOT NULL,
+                    scene_id TEXT NOT NULL,
+                    time_start INTEGER NOT NULL,
+                    capture_date DATE NOT NULL,
+                    cloud_cover REAL,
+                    footprint TEXT,
+                    PRIMARY KEY (point_key, scene_id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_scene_catalog_date
+                ON scene_catalog (point_key, capture_date)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS catalog_sync (
+                    point_key TEXT PRIMARY KEY,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    synced_from INTEGER NOT NULL,
+                    synced_until INTEGER NOT NULL,
+                    checked_at INTEGER NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._locks_lock:
+            self._stats[key] += value
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики: поиски по каталогу, обновления и запросы к GEE"""
+        with self._locks_lock:
+            return dict(self._stats)
+
+    def _point_lock(self, key: str) -> threading.Lock:
+        """Одна точка обновляется одним потоком, остальные ждут и читают результат"""
+        with self._locks_lock:
+            return self._point_locks.setdefault(key, threading.Lock())
+
+    def _get_sync(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._connections.transaction(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM catalog_sync WHERE point_key = ?', (key,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    # ========== ОБНОВЛЕНИЕ ==========
+
+    def ensure(self, latitude: float, longitude: float, start_date: str, end_date: str,
+               max_age_hours: Optional[float] = None) -> bool:
+        """
+        Дозагрузка каталога точки для периода [start_date, end_date)
+
+        GEE запрашивается, только если период выходит за синхронизированный
+        или новые сцены не проверялись дольше max_age_hours
+        (по умолчанию CATALOG_MAX_AGE_HOURS).
+
+        Returns:
+            True - каталог покрывает период и по нему можно выбирать сцены
+        """
+        key = point_key(latitude, longitude)
+        now_ms = int(time.time() * 1000)
+        start_ms = date_to_ms(start_date)
+        end_ms = min(date_to_ms(end_date), now_ms)
+        self._count('lookups')
+
+        with self._point_lock(key):
+            sync = self._get_sync(key)
+
+            ranges = []
+            checked_at = now_ms
+            if sync is None:
+                ranges.append((start_ms, end_ms))
+            else:
+                checked_at = sync['checked_at']
+                if start_ms < sync['synced_from']:
+                    ranges.append((start_ms, sync['synced_from']))
+                if max_age_hours is None:
+                    max_age_hours = CATALOG_MAX_AGE_HOURS
+                # Синхронизировано до момента проверки - новые сцены ищем не чаще max_age_hours
+                up_to_date = (sync['synced_until'] >= sync['checked_at'] and
+                              now_ms - sync['checked_at'] < max_age_hours * 3600 * 1000)
+                if end_ms > sync['synced_until'] and not up_to_date:
+                    ranges.append((sync['synced_until'] - CATALOG_OVERLAP_DAYS * DAY_MS, end_ms))
+                    checked_at = now_ms
+
+            if not ranges:
+                return True
+
+            try:
+                added = sum(self._fetch_range(latitude, longitude, key, range_start, range_end)
+                            for range_start, range_end in ranges)
+            except Exception as error:
+                # Не удалась только проверка новых сцен после прошлой проверки - период
+                # синхронизирован до нее, выбираем по сохраненным записям. Если часть
+                # периода вне synced_from..synced_until не загружалась, каталогу нельзя доверять
+                if (sync is not None and start_ms >= sync['synced_from'] and
+                        (end_ms <= sync['synced_until'] or sync['synced_until'] >= sync['checked_at'])):
+                    print(f"Каталог сцен: не удалось обновить ({error}), используем сохраненные записи")
+                    return True
+                print(f"Каталог сцен: не удалось загрузить период ({error})")
+                return False
+
+            self._save_sync(key, latitude, longitude,
+                            min(start_ms, sync['synced_from']) if sync else start_ms,
+                            max(end_ms, sync['synced_until']) if sync else end_ms,
+                            checked_at)
+            self._count('refreshes')
+            print(f"Каталог сцен обновлен: новых сцен {added}")
+            return True
+
+    def _fetch_range(self, latitude: float, longitude: float, key: str,
+                     start_ms: int, end_ms: int) -> int:
+        """Постраничная загрузка записей каталога; возвращает число новых сцен"""
+        backend = self.backend_provider()
+        added = 0
+        cursor_ms = start_ms
+        while cursor_ms < end_ms:
+            if self.rate_limiter is not None:
+                entries = self.rate_limiter.compute(backend.list_scenes, latitude, longitude,
+                                                    cursor_ms, end_ms, CATALOG_BATCH_SIZE)
+            else:
+                entries = backend.list_scenes(latitude, longitude, cursor_ms, end_ms, CATALOG_BATCH_SIZE)
+            self._count('requests')
+            added += self._store(key, entries)
+
+            if len(entries) < CATALOG_BATCH_SIZE:
+                break
+            # Сцены соседних тайлов имеют одинаковое время - следующая страница
+            # начинается с него же, повторы отбрасываются первичным ключом
+            last_ms = entries[-1]['time_start']
+            cursor_ms = last_ms if last_ms > cursor_ms else cursor_ms + 1
+        return added
+
+    def _store(self, key: str, entries: List[Dict[str, Any]]) -> int:
+        if not entries:
+            return 0
+        with self._connections.transaction() as conn:
+            cursor = conn.cursor()
+            before = conn.total_changes
+            cursor.executemany('''
+                INSERT OR IGNORE INTO scene_catalog
+                (point_key, scene_id, time_start, capture_date, cloud_cover, footprint)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(key, entry['scene_id'], entry['time_start'], entry['date'], entry['cloud_cover'],
+                   json.dumps(list(entry['footprint'])) if entry.get('footprint') else None)
+                  for entry in entries])
+            added = conn.total_changes - before
+            conn.commit()
+        self._count('scenes_added', added)
+        return added
+
+    def _save_sync(self, key: str, latitude: float, longitude: float,
+                   synced_from: int, synced_until: int, checked_at: int) -> None:
+        with self._connections.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO catalog_sync
+                (point_key, latitude, longitude, synced_from, synced_until, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, latitude, longitude, synced_from, synced_until, checked_at))
+            conn.commit()
+
+    # ========== ПОИСК ==========
+
+    def find_scene(self, latitude: float, longitude: float, start_date: str, end_date: str,
+                   max_cloud: float) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        Наименее облачная сцена из каталога (как ImageryBackend.find_scene)
+
+        Returns:
+            (запись каталога или None, количество подходящих сцен)
+        """
+        with self._connections.transaction(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT scene_id, time_start, capture_date, cloud_cover, footprint,
+                       COUNT(*) OVER () AS total
+                FROM scene_catalog
+                WHERE point_key = ? AND capture_date >= ? AND capture_date < ? AND cloud_cover < ?
+                ORDER BY cloud_cover ASC, time_start DESC
+                LIMIT 1
+            ''', (point_key(latitude, longitude), start_date, end_date, max_cloud))
+            row = cursor.fetchone()
+
+        if row is None:
+            return None, 0
+        return {
+            'scene_id': row['scene_id'],
+            'time_start': row['time_start'],
+            'date': row['capture_date'],
+            'cloud_cover': row['cloud_cover'],
+            'footprint': tuple(json.loads(row['footprint'])) if row['footprint'] else None
+        }, row['total']
+
+    def scenes(self, latitude: float, longitude: float, start_date: str, end_date: str,
+               max_cloud: float = 100.0) -> List[Dict[str, Any]]:
+        """Все сцены каталога над точкой за период по возрастанию времени съемки"""
+        with self._connections.transaction(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT scene_id, time_start, capture_date, cloud_cover
+                FROM scene_catalog
+                WHERE point_key = ? AND capture_date >= ? AND capture_date < ? AND cloud_cover < ?
+                ORDER BY time_start
+            ''', (point_key(latitude, longitude), start_date, end_date, max_cloud))
+            return [{'scene_id': row['scene_id'], 'time_start': row['time_start'],
+                     'date': row['capture_date'], 'cloud_cover': row['cloud_cover']}
+                    for row in cursor.fetchall()]
+
+    def available_dates(self, latitude: float, longitude: float, start_date: str, end_date: str,
+                        max_cloud: float = 100.0) -> List[Dict[str, Any]]:
+        """
+        Даты съемки над точкой с наименьшей облачностью за каждый день
+
+        Returns:
+            [{'date', 'scene_id', 'cloud_cover', 'scenes'}] по возрастанию даты
+        """
+        with self._connections.transaction(sqlite3.Row) as conn:
+            cursor = conn.cursor()
+            # Голый столбец scene_id при MIN() берется из строки с минимумом
+            cursor.execute('''
+                SELECT capture_date, scene_id, MIN(cloud_cover) AS cloud_cover, COUNT(*) AS scenes
+                FROM scene_catalog
+                WHERE point_key = ? AND capture_date >= ? AND capture_date < ? AND cloud_cover < ?
+                GROUP BY capture_date
+                ORDER BY capture_date
+            ''', (point_key(latitude, longitude), start_date, end_date, max_cloud))
+            return [{'date': row['capture_date'], 'scene_id': row['scene_id'],
+                     'cloud_cover': row['cloud_cover'], 'scenes': row['scenes']}
+                    for row in cursor.fetchall()]
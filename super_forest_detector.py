@@ -11,6 +11,8 @@ from scipy import ndimage
 import skimage
 import warnings
 
+from raster_store import load_bgr
+
 warnings.filterwarnings('ignore')
 
 
@@ -32,8 +34,8 @@ class SuperForestDetector:
         print("=" * 70)
 
         # Загрузка с проверкой
-        before = cv2.imread(before_path)
-        after = cv2.imread(after_path)
+        before = load_bgr(before_path)
+        after = load_bgr(after_path)
 
         if before is None or after is None:
             return {'error': 'Ошибка загрузки изображений'}
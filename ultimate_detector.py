@@ -9,6 +9,8 @@ from typing import Dict, Any, Tuple
 import os
 import time
 
+from raster_store import load_bgr
+
 
 class UltimateDetector:
     def __init__(self, debug: bool = False):
@@ -29,8 +31,8 @@ class UltimateDetector:
         print("=" * 50)
 
         # Загрузка
-        before = cv2.imread(before_path)
-        after = cv2.imread(after_path)
+        before = load_bgr(before_path)
+        after = load_bgr(after_path)
 
         if before is None or after is None:
             return {'error': 'Ошибка загрузки изображений', 'success': False}